@@ -0,0 +1,92 @@
+import itertools
+from array import array
+from collections import Counter
+
+import numpy
+
+
+class DrugCounts(object):
+    """Corpus-wide statistics of the drugs mentioned in a collection of documents.
+
+    Only drugbank ids and document indexes are kept: `mentions` counts the matches of each drug,
+    `documents` the documents mentioning it, and `cooccurrences`, if enabled, the documents mentioning
+    each pair of drugs. The documents mentioning a drug are stored as a sorted array of indexes, from
+    which `presence` builds a bitmap over the collection.
+
+    Counts of disjoint collections, e.g. computed by parallel workers, are combined with `merge`; the
+    documents of the merged counts are numbered after the ones of the counts they are merged into.
+    """
+
+    def __init__(self, cooccurrence=False):
+        self.cooccurrence = cooccurrence
+        self.n_documents = 0
+        self.mentions = Counter()
+        self.cooccurrences = Counter()
+        self._documents = {}
+
+    def __len__(self):
+        return len(self.mentions)
+
+    def add_document(self, drugbank_ids):
+        """Adds a document given the drugbank id of each of its mentions.
+
+        Returns:
+            int: index of the document in the collection.
+        """
+        doc_index = self.n_documents
+        self.mentions.update(drugbank_ids)
+        present = sorted(set(drugbank_ids))
+        for drugbank_id in present:
+            self._documents.setdefault(drugbank_id, array("q")).append(doc_index)
+        if self.cooccurrence:
+            self.cooccurrences.update(itertools.combinations(present, 2))
+        self.n_documents += 1
+        return doc_index
+
+    def merge(self, other):
+        """Adds the counts of another collection to this one; returns this one."""
+        if self.cooccurrence != other.cooccurrence:
+            raise ValueError("Counts with and without co-occurrences cannot be merged")
+
+        self.mentions.update(other.mentions)
+        self.cooccurrences.update(other.cooccurrences)
+        for drugbank_id, doc_indexes in other._documents.items():
+            shifted = numpy.frombuffer(doc_indexes, dtype=numpy.int64) + self.n_documents
+            self._documents.setdefault(drugbank_id, array("q")).extend(shifted.tolist())
+        self.n_documents += other.n_documents
+        return self
+
+    @property
+    def documents(self):
+        """Number of documents mentioning each drug."""
+        return Counter({drugbank_id: len(doc_indexes) for drugbank_id, doc_indexes in self._documents.items()})
+
+    def document_indexes(self, drugbank_id):
+        """Returns the sorted indexes of the documents mentioning a drug."""
+        doc_indexes = self._documents.get(drugbank_id)
+        if doc_indexes is None:
+            return numpy.empty(0, dtype=numpy.int64)
+        return numpy.frombuffer(doc_indexes, dtype=numpy.int64).copy()
+
+    def presence(self, drugbank_id, packed=False):
+        """Returns the bitmap of the documents mentioning a drug.
+
+        Args:
+            drugbank_id (str): the drug.
+            packed (bool, optional): packs the bitmap in bytes with `numpy.packbits`, 8 documents per byte.
+                                        Defaults to a boolean array with one entry per document.
+        """
+        bitmap = numpy.zeros(self.n_documents, dtype=bool)
+        bitmap[self.document_indexes(drugbank_id)] = True
+        return numpy.packbits(bitmap) if packed else bitmap
+
+    def to_dict(self):
+        """Returns the counts as a dictionary of plain types, e.g. to be saved as JSON."""
+        counts = {
+            "n_documents": self.n_documents,
+            "mentions": dict(self.mentions.most_common()),
+            "documents": dict(self.documents.most_common()),
+        }
+        if self.cooccurrence:
+            counts["cooccurrences"] = [[a, b, n] for (a, b), n in self.cooccurrences.most_common()]
+        return counts
@@ -0,0 +1,70 @@
+import contextlib
+import time
+
+# degradation levels of a match with a time budget, from none to skipping the rest of the text
+DEGRADATION_LEVELS = ("none", "window", "exact", "skip")
+# fraction of the budget elapsed from which each level after "none" applies
+LEVEL_FRACTIONS = (0.5, 0.75, 1.0)
+# window, in tokens, of the n-grams generated from the "window" level on
+DEGRADED_WINDOW = 2
+
+
+class TimeBudget(object):
+    """Clock of a match with a time budget.
+
+    The degradation level only goes up: it is the highest level whose fraction of the budget has
+    elapsed at any call of `update`. The time spent in each stage is accumulated in `stage_seconds`.
+    """
+
+    def __init__(self, budget_ms):
+        assert budget_ms > 0, "time_budget_ms must be positive"
+        self.budget = budget_ms / 1000.
+        self.start = time.perf_counter()
+        self.level = 0
+        self.stage_seconds = {}
+
+    @property
+    def elapsed(self):
+        return time.perf_counter() - self.start
+
+    @property
+    def degradation(self):
+        return DEGRADATION_LEVELS[self.level]
+
+    def update(self):
+        fraction = self.elapsed / self.budget
+        self.level = max(self.level, sum(1 for level_fraction in LEVEL_FRACTIONS if fraction >= level_fraction))
+        return self.level
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stage_seconds[name] = self.stage_seconds.get(name, 0.) + time.perf_counter() - start
+
+
+class BudgetedMatches(list):
+    """Matches returned by `DrugFinder.match` with a time budget, in the same format as without one.
+
+    Attributes:
+        partial (bool): whether any degradation was applied, so that matches may be missing.
+        degradation (str): highest degradation level applied, one of `DEGRADATION_LEVELS`: `window` generates
+            n-grams of at most `DEGRADED_WINDOW` tokens, `exact` only retrieves the terms equal to the n-grams,
+            `skip` leaves the rest of the text unmatched.
+        elapsed_ms (float): time spent matching.
+        stage_seconds (dict): time spent parsing, generating n-grams and retrieving and scoring candidates.
+    """
+
+    def __init__(self, matches, partial=False, degradation="none", elapsed_ms=0., stage_seconds=None):
+        super().__init__(matches)
+        self.partial = partial
+        self.degradation = degradation
+        self.elapsed_ms = elapsed_ms
+        self.stage_seconds = {} if stage_seconds is None else stage_seconds
+
+    @classmethod
+    def from_budget(cls, matches, budget):
+        return cls(matches, partial=budget.level > 0, degradation=budget.degradation,
+                   elapsed_ms=budget.elapsed * 1000., stage_seconds=budget.stage_seconds)
@@ -0,0 +1,132 @@
+import hashlib
+import json
+import os
+import pickle
+import sqlite3
+import time
+
+from drugfinder.utils import mkdir
+
+CACHE_FILENAME = "drugfinder-cache.sqlite"
+# the entries are counted again every so many puts, to see the entries added and evicted by other processes
+COUNT_INTERVAL = 1000
+# SQLite limits the number of parameters of a statement
+MAX_PARAMETERS = 500
+
+
+def index_version(path):
+    """Returns a fingerprint of an installation directory that changes with every install or upgrade.
+
+    It is the hash of the manifest of the install (`drugbank-hashes.json`) if there is one, else of the
+    size and modification time of the simstring files, which are only written by installers.
+    """
+    manifest_fp = os.path.join(path, "drugbank-hashes.json")
+    digest = hashlib.sha256()
+    if os.path.exists(manifest_fp):
+        with open(manifest_fp, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                digest.update(block)
+        return digest.hexdigest()
+
+    simstring_dir = os.path.join(path, "drugbank-simstring.db")
+    for filename in sorted(os.listdir(simstring_dir)):
+        stat = os.stat(os.path.join(simstring_dir, filename))
+        digest.update("{}:{}:{};".format(filename, stat.st_size, stat.st_mtime_ns).encode("utf-8"))
+    return digest.hexdigest()
+
+
+def cache_key(text, config):
+    """Hash of a text and of the configuration (options and index versions) its matches depend on."""
+    digest = hashlib.sha256(json.dumps(config, sort_keys=True).encode("utf-8"))
+    digest.update(b"\x00")
+    digest.update(text.encode("utf-8", "surrogatepass"))
+    return digest.hexdigest()
+
+
+class ResultCache(object):
+    """On-disk cache of the matches of whole documents, stored in a SQLite database.
+
+    Entries are keyed by `cache_key` and hold the pickled matches. When there are more than
+    `max_entries` entries, the least recently used ones are evicted. Several processes can share
+    the same cache directory.
+
+    The entries are counted when the cache is opened, then the count is kept up to date from the new
+    keys put, and counted again every `COUNT_INTERVAL` puts. With several processes the bound can be
+    exceeded by the entries the others put in the meantime.
+    """
+
+    def __init__(self, path, max_entries=100000):
+        assert max_entries > 0, "max_entries must be positive"
+        mkdir(path)
+        self.path = os.path.join(path, CACHE_FILENAME)
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+
+        self.db = sqlite3.connect(self.path, timeout=30.0)
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS results (key TEXT PRIMARY KEY, value BLOB NOT NULL, last_used REAL NOT NULL)"
+        )
+        self.db.execute("CREATE INDEX IF NOT EXISTS results_last_used ON results (last_used)")
+        self.db.commit()
+        self._entries = len(self)
+        self._puts = 0
+
+    def close(self):
+        self.db.close()
+
+    def __len__(self):
+        return self.db.execute("SELECT COUNT(*) FROM results").fetchone()[0]
+
+    @property
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups > 0 else 0.,
+            "entries": len(self),
+        }
+
+    def get(self, key):
+        return self.get_many([key]).get(key)
+
+    def get_many(self, keys):
+        """Returns a dictionary with the cached matches of the keys found in the cache."""
+        keys = list(dict.fromkeys(keys))
+        found = {key: pickle.loads(value) for key, value in self._select("key, value", keys)}
+
+        if len(found) > 0:
+            now = time.time()
+            self.db.executemany("UPDATE results SET last_used = ? WHERE key = ?", [(now, key) for key in found])
+            self.db.commit()
+        self.hits += len(found)
+        self.misses += len(keys) - len(found)
+        return found
+
+    def put(self, key, matches):
+        self.put_many({key: matches})
+
+    def put_many(self, items):
+        """Stores the matches of several keys, then evicts the least recently used entries over the bound."""
+        now = time.time()
+        new_keys = len(items) - sum(1 for _ in self._select("key", list(items)))
+        self.db.executemany(
+            "INSERT OR REPLACE INTO results (key, value, last_used) VALUES (?, ?, ?)",
+            [(key, pickle.dumps(matches, protocol=pickle.HIGHEST_PROTOCOL), now) for key, matches in items.items()],
+        )
+        self._puts += 1
+        self._entries = len(self) if self._puts % COUNT_INTERVAL == 0 else self._entries + new_keys
+        excess = self._entries - self.max_entries
+        if excess > 0:
+            self._entries -= self.db.execute(
+                "DELETE FROM results WHERE key IN (SELECT key FROM results ORDER BY last_used LIMIT ?)", (excess,)
+            ).rowcount
+        self.db.commit()
+
+    def _select(self, columns, keys):
+        for i in range(0, len(keys), MAX_PARAMETERS):
+            block = keys[i:i + MAX_PARAMETERS]
+            yield from self.db.execute(
+                "SELECT {} FROM results WHERE key IN ({})".format(columns, ", ".join("?" * len(block))), block
+            )
@@ -0,0 +1,64 @@
+import re
+
+# chunk size used when a text is longer than the `max_length` of the spaCy pipeline
+DEFAULT_CHUNK_SIZE = 100000
+
+# paragraph breaks, then sentence ends, then any whitespace
+_BOUNDARY_RES = (
+    re.compile(r"\n\s*\n"),
+    re.compile(r"(?<=[.!?;])\s+"),
+    re.compile(r"\s+"),
+)
+_WORD_RE = re.compile(r"\S+")
+
+
+def _last_boundary(text, start, limit):
+    for boundary_re in _BOUNDARY_RES:
+        end = None
+        for m in boundary_re.finditer(text, start, limit):
+            end = m.end()
+        if end is not None and end > start:
+            # a whitespace run cut by the limit still belongs to the chunk
+            while end < len(text) and text[end].isspace():
+                end += 1
+            return end
+
+    # a single word longer than the chunk is not split
+    m = _BOUNDARY_RES[-1].search(text, limit)
+    return len(text) if m is None else m.end()
+
+
+def _skip_words(text, pos, n_words):
+    end = pos
+    for i, m in enumerate(_WORD_RE.finditer(text, pos)):
+        if i == n_words:
+            break
+        end = m.end()
+    return end
+
+
+def iter_sentence_ends(text):
+    """Yields the end offsets of the sentences of a raw text, after a sentence end or a paragraph break."""
+    ends = {m.end() for boundary_re in _BOUNDARY_RES[:2] for m in boundary_re.finditer(text)}
+    yield from sorted(ends)
+    yield len(text)
+
+
+def iter_chunks(text, chunk_size, overlap_words):
+    """Splits a text in consecutive chunks of at most `chunk_size` characters.
+
+    Chunks end after a paragraph break if there is one, else after the end of a sentence, else
+    after a whitespace, so that the next chunk starts with a word. Each chunk is parsed with the
+    `overlap_words` words that follow it, so that every n-gram starting in the chunk can be generated
+    whole.
+
+    Yields:
+        Tuple: (start, end, parse_end) offsets; the chunk owns the matches starting in [start, end)
+            and the text to parse is text[start:parse_end].
+    """
+    start = 0
+    while start < len(text):
+        limit = start + chunk_size
+        end = len(text) if limit >= len(text) else _last_boundary(text, start, limit)
+        yield start, end, _skip_words(text, end, overlap_words)
+        start = end
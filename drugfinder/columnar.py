@@ -0,0 +1,151 @@
+from array import array
+
+import numpy
+
+# one row per candidate; strings and drug records are stored once in the side tables
+# and referenced by their position
+MATCH_DTYPE = numpy.dtype([
+    ("doc", numpy.int32),
+    ("group", numpy.int32),
+    ("start", numpy.int32),
+    ("end", numpy.int32),
+    ("ngram", numpy.int32),
+    ("term", numpy.int32),
+    ("drugbank_id", numpy.int32),
+    ("similarity", numpy.float64),
+])
+
+
+class StringTable(object):
+    """Interned strings, each stored once and referenced by its index."""
+
+    def __init__(self):
+        self.values = []
+        self._index = {}
+
+    def __len__(self):
+        return len(self.values)
+
+    def __getitem__(self, idx):
+        return self.values[idx]
+
+    def add(self, value):
+        try:
+            return self._index[value]
+        except KeyError:
+            self._index[value] = len(self.values)
+            self.values.append(value)
+            return self._index[value]
+
+
+class ColumnarMatches(object):
+    """Column-oriented storage of the matches of a collection of documents.
+
+    Every candidate returned by `DrugFinder` becomes one row with the columns of `MATCH_DTYPE`.
+    N-grams, terms and drugbank ids are interned in `StringTable`s and drug records are kept
+    once per drugbank id in `records`, so memory grows with the number of rows and not with
+    the size of the drug data.
+    """
+
+    def __init__(self):
+        self.ngrams = StringTable()
+        self.terms = StringTable()
+        self.drugbank_ids = StringTable()
+        self.records = []
+        self.n_documents = 0
+        self._columns = {
+            name: array("d" if name == "similarity" else "i") for name in MATCH_DTYPE.names
+        }
+        # rows of a document are contiguous: document i has the rows from offset i to offset i + 1
+        self._doc_offsets = array("q", [0])
+
+    def __len__(self):
+        return len(self._columns["doc"])
+
+    def add_document(self, matches):
+        """Appends the matches of one document, in the format returned by `DrugFinder.match`.
+
+        Args:
+            matches (list): list of groups of match dictionaries.
+
+        Returns:
+            int: index of the document in the collection.
+        """
+        doc_index = self.n_documents
+        columns = self._columns
+        for group_index, group in enumerate(matches):
+            for match in group:
+                drugbank_id = self.drugbank_ids.add(match["drugbank_id"])
+                if drugbank_id == len(self.records):
+                    self.records.append(match["data"])
+
+                columns["doc"].append(doc_index)
+                columns["group"].append(group_index)
+                columns["start"].append(match["start"])
+                columns["end"].append(match["end"])
+                columns["ngram"].append(self.ngrams.add(match["ngram"]))
+                columns["term"].append(self.terms.add(match["term"]))
+                columns["drugbank_id"].append(drugbank_id)
+                columns["similarity"].append(match["similarity"])
+
+        self.n_documents += 1
+        self._doc_offsets.append(len(columns["doc"]))
+        return doc_index
+
+    def to_columns(self):
+        """Returns the columns as a dictionary of NumPy arrays."""
+        return {
+            name: numpy.frombuffer(column, dtype=MATCH_DTYPE[name]).copy() if len(column) > 0
+            else numpy.empty(0, dtype=MATCH_DTYPE[name])
+            for name, column in self._columns.items()
+        }
+
+    def to_structured_array(self):
+        """Returns the rows as a NumPy structured array with `MATCH_DTYPE`."""
+        result = numpy.empty(len(self), dtype=MATCH_DTYPE)
+        for name, column in self.to_columns().items():
+            result[name] = column
+        return result
+
+    def _row_to_dict(self, columns, row):
+        drugbank_id = int(columns["drugbank_id"][row])
+        return {
+            "start": int(columns["start"][row]),
+            "end": int(columns["end"][row]),
+            "ngram": self.ngrams[columns["ngram"][row]],
+            "term": self.terms[columns["term"][row]],
+            "drugbank_id": self.drugbank_ids[drugbank_id],
+            "data": self.records[drugbank_id],
+            "similarity": float(columns["similarity"][row]),
+        }
+
+    def to_dicts(self):
+        """Converts the collection back to the format of `DrugFinder.match`.
+
+        Returns:
+            list: one list of groups of match dictionaries per document.
+        """
+        documents = [[] for _ in range(self.n_documents)]
+        columns = self._columns
+        last_key = None
+        for row in range(len(self)):
+            key = (columns["doc"][row], columns["group"][row])
+            if key != last_key:
+                documents[key[0]].append([])
+                last_key = key
+            documents[key[0]][-1].append(self._row_to_dict(columns, row))
+        return documents
+
+    def document(self, doc_index):
+        """Returns the matches of a single document in the format of `DrugFinder.match`."""
+        if not 0 <= doc_index < self.n_documents:
+            raise IndexError("document index out of range")
+        groups = []
+        last_group = None
+        for row in range(self._doc_offsets[doc_index], self._doc_offsets[doc_index + 1]):
+            group = self._columns["group"][row]
+            if group != last_group:
+                groups.append([])
+                last_group = group
+            groups[-1].append(self._row_to_dict(self._columns, row))
+        return groups
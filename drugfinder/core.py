@@ -1,19 +1,100 @@
 import os
 import sys
 import datetime
+import itertools
+import contextlib
+import threading
 
-from drugfinder.utils import DrugBankDB, Intervals, safe_unicode, get_similarity
+from drugfinder.utils import DrugBankDB, InstallLock, Intervals, get_similarity, read_record_format
 from drugfinder.simstring import SimstringDBReader
+from drugfinder.sparse import SparseDBReader
+from drugfinder.symspell import SymSpellDB, edit_similarity
+from drugfinder.columnar import ColumnarMatches
+from drugfinder.aggregate import DrugCounts
+from drugfinder.budget import TimeBudget, BudgetedMatches, DEGRADATION_LEVELS, DEGRADED_WINDOW
+from drugfinder.overlay import LexiconOverlay
+from drugfinder.tokenizer import RuleTokenizer
+from drugfinder.chunking import iter_chunks, iter_sentence_ends, DEFAULT_CHUNK_SIZE
+from drugfinder.cache import ResultCache, cache_key, index_version
+from drugfinder.doccache import DocCache, model_version
+from drugfinder.sharedcache import SharedCache, DEFAULT_SLOTS, DEFAULT_SLOT_SIZE
+from drugfinder.versions import is_versioned, current_version, resolve_installation
+from drugfinder.prefixes import PrefixIndex, count_tokens
+from drugfinder.normalization import NormalizedText, normalize_term, transliterate
 from drugfinder import constants
 import nltk
+import numpy
 import spacy
-from unidecode import unidecode
+from spacy.attrs import IS_PUNCT, IS_SPACE, LIKE_NUM, IS_BRACKET, POS, ORTH, LEMMA, IDX, LENGTH
+from spacy.parts_of_speech import ADP, DET, CONJ
+from spacy.tokens import Span
 import logging
 logging.basicConfig(format='%(asctime)s %(levelname)s:%(message)s',
                     filename="drugfinder-match.log",
                     encoding='utf-8',
                     level=logging.DEBUG)
 
+_TOKEN_FLAG_ATTRS = [IS_PUNCT, IS_SPACE, LIKE_NUM, IS_BRACKET, POS, ORTH, LEMMA, IDX, LENGTH]
+_GRAMMAR_POS = numpy.array([ADP, DET, CONJ], dtype=numpy.uint64)
+# number of n-grams generated or matched between two checks of the time budget of `match`
+_BUDGET_CHECK_INTERVAL = 256
+
+
+class _Indexes(object):
+    """The files of one installed version, as opened by a `DrugFinder`.
+
+    Requests hold it from start to end; once `DrugFinder.reload` replaces it, it is closed when the
+    last request holding it is done.
+    """
+
+    def __init__(self, version, path, simstring_db, drugbank_db, symspell_db, normalize_unicode, prefix_index=None):
+        self.version = version
+        self.path = path
+        self.simstring_db = simstring_db
+        self.drugbank_db = drugbank_db
+        self.symspell_db = symspell_db
+        self.normalize_unicode = normalize_unicode
+        self.prefix_index = prefix_index
+        # held shared until closed, so that installs do not remove the version while it is open
+        self.install_lock = None
+        self._fingerprint = None
+        self._users = 0
+        self._retired = False
+        self._lock = threading.Lock()
+
+    @property
+    def fingerprint(self):
+        # part of the keys of the result cache
+        if self._fingerprint is None:
+            self._fingerprint = index_version(self.path)
+        return self._fingerprint
+
+    def acquire(self):
+        with self._lock:
+            self._users += 1
+        return self
+
+    def release(self):
+        with self._lock:
+            self._users -= 1
+            close = self._retired and self._users == 0
+        if close:
+            self.close()
+
+    def retire(self):
+        with self._lock:
+            self._retired = True
+            close = self._users == 0
+        if close:
+            self.close()
+
+    def close(self):
+        for db in (self.simstring_db, self.drugbank_db, self.symspell_db):
+            if db is not None:
+                db.close()
+        if self.install_lock is not None:
+            self.install_lock.release()
+
 
 class DrugFinder(object):
     """Main class of the DrugFinder module.
@@ -28,7 +109,22 @@ class DrugFinder(object):
                  min_match_length=1,
                  verbose=False,
                  spacy_component=False,
-                 umls_linking=False):
+                 umls_linking=False,
+                 preload=False,
+                 memory_budget=None,
+                 overlay_fp=None,
+                 tokenizer="spacy",
+                 read_only=False,
+                 retrieval_engine="simstring",
+                 symspell=None,
+                 max_edit_distance=None,
+                 cache_dir=None,
+                 cache_max_entries=100000,
+                 prune_windows=False,
+                 parse_cache_dir=None,
+                 shared_cache=None,
+                 shared_cache_slots=DEFAULT_SLOTS,
+                 shared_cache_slot_size=DEFAULT_SLOT_SIZE):
         """Instantiate DrugFinder object that is the interface through
             which text can be processed.
 
@@ -44,15 +140,59 @@ class DrugFinder(object):
                 spacy_component (bool, optional): TODO:?? Defaults to false.
                 umls_linking (bool, optional): TODO: links the drugfinder found in the text with UMLS concepts using
                                                 QuickUMLS. Defaults to false.
+                preload (bool, optional): loads the term map and the drug records into memory at startup.
+                                            Defaults to false.
+                memory_budget (int, optional): maximum estimated size in bytes of the preloaded data; what
+                                                does not fit is read from disk. Defaults to no limit.
+                overlay_fp (str, optional): Path to a lexicon overlay built with `drugfinder.overlay`, queried
+                                            together with the DrugBank files. Defaults to no overlay.
+                tokenizer (str, optional): `spacy` or `rule`. The `rule` tokenizer does not load any spaCy model
+                                            and only supports matching with `ignore_syntax=True`. Defaults to `spacy`.
+                read_only (bool, optional): opens the installed files read-only, so that any number of processes
+                                            can share them. Defaults to false.
+                retrieval_engine (str, optional): `simstring` queries the simstring database once per n-gram;
+                                            `sparse` retrieves the candidates of all the n-grams of a batch of
+                                            documents with one sparse matrix product. `sparse` needs scipy (the
+                                            `sparse` extra) and an installation made with `--sparse-index`.
+                                            Defaults to `simstring`.
+                symspell (str, optional): `alongside` or `instead` to also retrieve, or to only retrieve, the
+                                            candidates of n-grams no longer than the terms of the deletion index
+                                            built with `--symspell` by edit distance. Defaults to no edit
+                                            distance lookups.
+                max_edit_distance (int, optional): maximum edit distance of the `symspell` lookups, at most the one
+                                            of the index. Defaults to the one of the index.
+                cache_dir (str, optional): directory of an on-disk cache of the matches of whole texts, keyed by
+                                            the text, the matcher options and the version of the installed
+                                            files. Texts found in it are neither parsed nor matched. Defaults to
+                                            no cache.
+                cache_max_entries (int, optional): number of texts kept in the cache; the least recently used
+                                            ones are evicted. Defaults to 100000.
+                prune_windows (bool, optional): uses the prefix index written at install to skip the tokens
+                                            no term can start with, and to stop the windows of the others at
+                                            the number of tokens of the longest term they can start. Fewer
+                                            n-grams are retrieved, but n-grams whose first token is misspelled
+                                            beyond recognition are no longer tried. Defaults to false.
+                parse_cache_dir (str, optional): directory where the spaCy parses of the texts are kept as
+                                            `DocBin` files, keyed by the text and the model version, so that
+                                            matching a corpus again, e.g. with other options, only generates
+                                            and matches its n-grams. Needs the `spacy` tokenizer. Defaults to
+                                            no parse cache.
+                shared_cache (str, optional): name of a shared memory cache of the candidates retrieved for
+                                            the n-grams and of the drugs looked up for the terms of the DrugBank
+                                            files, shared by every process of the host that gives the same name.
+                                            Defaults to no shared cache.
+                shared_cache_slots (int, optional): number of entries of the shared cache, when this process
+                                            creates it. Defaults to 65536.
+                shared_cache_slot_size (int, optional): size in bytes of an entry of the shared cache, when this
+                                            process creates it. Drug records that do not fit are not cached and
+                                            are counted as `oversized` in `shared_cache_stats`; DrugBank records
+                                            often need 4096 bytes or more. Defaults to 1024.
         """
         if umls_linking:
             raise Exception("UMLS linking is not supported yet")
 
         self.verbose = verbose
         self.__validate_parameters(overlapping_criteria, similarity_name)
-        simstring_fp = os.path.join(drugbank_fp, "drugbank-simstring.db")
-        drugbank_db = os.path.join(drugbank_fp, "drugbank-db.db")
-
         self.valid_punctuation = constants.UNICODE_DASHES
         self.negations = constants.NEGATIONS
 
@@ -60,9 +200,6 @@ class DrugFinder(object):
         self.ngram_length = 3
         self.threshold = threshold
         self.min_match_length = min_match_length
-        self.normalize_unicode_flag = os.path.exists(
-            os.path.join(drugbank_fp, "normalize-unicode.flag")
-        )
         # download stopwords if necessary
         try:
             nltk.corpus.stopwords.words()
@@ -75,19 +212,22 @@ class DrugFinder(object):
             nltk.corpus.stopwords.words(constants.LANGUAGES[self.language_flag])
         )
         spacy_lang = constants.SPACY_LANGUAGE_MAP[self.language_flag]
-        database_backend_fp = os.path.join(drugbank_fp, "database_backend.flag")
-        if os.path.exists(database_backend_fp):
-            with open(database_backend_fp) as f:
-                self._database_backend = f.read().strip()
-        else:
-            self._database_backend = 'unqlite'
-
         # domain specific stopwords
         self._stopwords = self._stopwords.union(constants.DRUGBANK_SPECIFIC_STOPWORDS)
         self._info = None
+        self._flag_hashes = None
+        # number of n-grams, candidates and key-value lookups of the last batch of documents matched
+        self.lookup_stats = None
+
+        valid_tokenizers = {"spacy", "rule"}
+        assert tokenizer in valid_tokenizers, '"{}" is not a valid tokenizer. Choose between {}'.format(
+            tokenizer, ", ".join(valid_tokenizers)
+        )
+        self.tokenizer = tokenizer
+        self.rule_tokenizer = RuleTokenizer(self._stopwords, self.valid_punctuation)
 
         # if this is not being executed as spacy component, then it must be standalone
-        if spacy_component:
+        if spacy_component or tokenizer == "rule":
             # In this case, the pipeline is external to this current class
             self.nlp = None
         else:
@@ -104,11 +244,210 @@ class DrugFinder(object):
                 )
                 raise OSError(msg)
 
-        self.simstring_db = SimstringDBReader(path=simstring_fp,
-                                              similarity_name=similarity_name,
-                                              threshold=threshold,
-                                              filename='drug-terms.simstring')
-        self.drugbank_db = DrugBankDB(path=drugbank_db, database_backend=self._database_backend)
+        self.doc_cache = None
+        if parse_cache_dir is not None:
+            assert self.nlp is not None, "parse_cache_dir needs the spacy tokenizer"
+            self.doc_cache = DocCache(parse_cache_dir, self.nlp)
+
+        self.shared_cache = None
+        if shared_cache is not None:
+            self.shared_cache = SharedCache(shared_cache, n_slots=shared_cache_slots, slot_size=shared_cache_slot_size)
+
+        valid_engines = {"simstring", "sparse"}
+        assert retrieval_engine in valid_engines, '"{}" is not a valid retrieval engine. Choose between {}'.format(
+            retrieval_engine, ", ".join(valid_engines)
+        )
+        self.retrieval_engine = retrieval_engine
+        assert symspell in {None, "alongside", "instead"}, (
+            '"{}" is not a valid symspell mode. Choose between alongside, instead'.format(symspell)
+        )
+        self.symspell = symspell
+        self.preload = preload
+        self.memory_budget = memory_budget
+        self.read_only = read_only
+        self.prune_windows = prune_windows
+
+        # the files of the version being served; requests pin it so that `reload` can swap it at any time
+        self.drugbank_fp = drugbank_fp
+        self._local = threading.local()
+        self._indexes_lock = threading.Lock()
+        self._reload_lock = threading.Lock()
+        self._indexes = self._open_indexes(*resolve_installation(drugbank_fp))
+        self.max_edit_distance = max_edit_distance
+
+        self.overlay = None
+        self._overlay_prefix_index = None
+        if overlay_fp is not None:
+            self.overlay = LexiconOverlay(path=overlay_fp,
+                                          similarity_name=similarity_name,
+                                          threshold=threshold,
+                                          read_only=read_only)
+            if prune_windows:
+                self._overlay_prefix_index = PrefixIndex(os.path.join(overlay_fp, "drugbank-simstring.db"),
+                                                         filename="drug-terms.simstring")
+
+        self.result_cache = None
+        if cache_dir is not None:
+            self.result_cache = ResultCache(cache_dir, max_entries=cache_max_entries)
+            self._cache_config = {
+                "overlay_version": index_version(overlay_fp) if overlay_fp is not None else None,
+                "tokenizer": tokenizer,
+                "spacy_model": None if self.nlp is None else model_version(self.nlp),
+            }
+
+    def _open_indexes(self, version, path):
+        # taken in every mode: a version can only be removed once no process has it open
+        install_lock = InstallLock(path)
+        try:
+            indexes = self._open_index_files(version, path)
+        except BaseException:
+            install_lock.release()
+            raise
+        indexes.install_lock = install_lock
+        return indexes
+
+    def _open_index_files(self, version, path):
+        database_backend_fp = os.path.join(path, "database_backend.flag")
+        if os.path.exists(database_backend_fp):
+            with open(database_backend_fp) as f:
+                database_backend = f.read().strip()
+        else:
+            database_backend = 'unqlite'
+
+        reader_class = SparseDBReader if self.retrieval_engine == "sparse" else SimstringDBReader
+        simstring_db = reader_class(path=os.path.join(path, "drugbank-simstring.db"),
+                                    similarity_name=self.similarity_name,
+                                    threshold=self.threshold,
+                                    filename='drug-terms.simstring',
+                                    read_only=self.read_only)
+        drugbank_db = DrugBankDB(path=os.path.join(path, "drugbank-db.db"),
+                                 database_backend=database_backend,
+                                 preload=self.preload,
+                                 memory_budget=self.memory_budget,
+                                 read_only=self.read_only,
+                                 record_format=read_record_format(path))
+        if self.preload and self.verbose:
+            print(
+                "[{}] preloaded {terms:,} terms and {records:,} drug records "
+                "({bytes:,} bytes) in {seconds:.2f} s".format(
+                    datetime.datetime.now().isoformat(), **drugbank_db.preload_stats
+                ),
+                file=sys.stderr,
+            )
+
+        symspell_db = None
+        if self.symspell is not None:
+            symspell_db = SymSpellDB(path=os.path.join(path, "drugbank-symspell.db"),
+                                     database_backend=database_backend,
+                                     read_only=self.read_only)
+
+        prefix_index = None
+        if self.prune_windows:
+            prefix_index = PrefixIndex(os.path.join(path, "drugbank-simstring.db"), filename="drug-terms.simstring")
+
+        normalize_unicode = os.path.exists(os.path.join(path, "normalize-unicode.flag"))
+        return _Indexes(version, path, simstring_db, drugbank_db, symspell_db, normalize_unicode, prefix_index)
+
+    def reload(self, background=False):
+        """Swaps in the current version of a versioned installation, if it is not the one being served.
+
+            The new version is opened while the old one keeps serving. Requests that started before the
+            swap finish on the old version, which is closed once they are done; the next ones use the new
+            version.
+
+            Args:
+                background (bool, optional): opens the new version in a separate thread. Defaults to false.
+
+            Returns:
+                bool: whether a new version was swapped in; with `background`, the thread opening it.
+        """
+        if background:
+            thread = threading.Thread(target=self.reload, daemon=True)
+            thread.start()
+            return thread
+
+        if not is_versioned(self.drugbank_fp):
+            raise IOError('"{}" is not a versioned installation; install it with `--versioned`'.format(
+                self.drugbank_fp))
+
+        with self._reload_lock:
+            version, path = current_version(self.drugbank_fp)
+            if version == self._indexes.version:
+                return False
+            start = datetime.datetime.now()
+            indexes = self._open_indexes(version, path)
+            with self._indexes_lock:
+                old_indexes, self._indexes = self._indexes, indexes
+            old_indexes.retire()
+
+        logging.info("Swapped in version {} of {} (was {}), opened in {:.2f} s".format(
+            version, self.drugbank_fp, old_indexes.version, (datetime.datetime.now() - start).total_seconds()))
+        return True
+
+    @contextlib.contextmanager
+    def _pinned_indexes(self, indexes=None):
+        """Makes the current thread use the same installed version until the request is done.
+
+            Without `indexes`, the version being served is held; nested requests use the version
+            already pinned.
+
+        """
+        if getattr(self._local, "indexes", None) is not None:
+            yield self._local.indexes
+            return
+
+        acquired = indexes is None
+        if acquired:
+            indexes = self._acquire_indexes()
+        self._local.indexes = indexes
+        try:
+            yield indexes
+        finally:
+            self._local.indexes = None
+            if acquired:
+                indexes.release()
+
+    def _acquire_indexes(self):
+        with self._indexes_lock:
+            return self._indexes.acquire()
+
+    def _active_indexes(self):
+        indexes = getattr(self._local, "indexes", None)
+        return self._indexes if indexes is None else indexes
+
+    @property
+    def simstring_db(self):
+        return self._active_indexes().simstring_db
+
+    @property
+    def drugbank_db(self):
+        return self._active_indexes().drugbank_db
+
+    @property
+    def symspell_db(self):
+        return self._active_indexes().symspell_db
+
+    @property
+    def normalize_unicode_flag(self):
+        return self._active_indexes().normalize_unicode
+
+    @property
+    def cache_stats(self):
+        """Hits, misses, hit rate and number of entries of the result cache, or None without cache."""
+        if self.result_cache is None:
+            return None
+        return self.result_cache.stats
+
+    @property
+    def shared_cache_stats(self):
+        """Host-wide hits, misses, inserts, evictions and oversized values of the shared cache, or None without one."""
+        if self.shared_cache is None:
+            return None
+        return self.shared_cache.stats
+
+    def _cache_key(self, text, **options):
+        return cache_key(text, dict(self._cache_config, info=self.info,
+                                    index_version=self._active_indexes().fingerprint, **options))
 
     def get_info(self):
         """Computes a summary of the matcher options.
@@ -120,23 +459,28 @@ class DrugFinder(object):
 
     @property
     def info(self):
-        """Computes a summary of the matcher options.
+        """Computes a summary of the matcher options and of the installed version it serves.
 
         Returns:
             Dict: Dictionary containing information on the DrugFinder instance.
         """
-        # useful for caching of responses
+        # part of the keys of the result cache; the options never change, the index version can be reloaded
         if self._info is None:
             self._info = {
                 "threshold": self.threshold,
                 "similarity_name": self.similarity_name,
+                "overlapping_criteria": self.overlapping_criteria,
                 "window": self.window,
                 "ngram_length": self.ngram_length,
                 "min_match_length": self.min_match_length,
                 "negations": sorted(self.negations),
                 "valid_punctuation": sorted(self.valid_punctuation),
+                "overlay": self.overlay is not None,
+                "symspell": self.symspell,
+                "max_edit_distance": self.max_edit_distance,
+                "prune_windows": self.prune_windows,
             }
-        return self._info
+        return dict(self._info, index_version=self._active_indexes().version)
 
     def __validate_parameters(self, overlapping_criteria, similarity_name):
         valid_criteria = {"length", "score"}
@@ -195,80 +539,150 @@ class DrugFinder(object):
     def _is_longer_than_min(self, span) -> bool:
         return (span.end_char - span.start_char) >= self.min_match_length
 
-    def _make_ngrams(self, sentence) -> tuple:
+    def _token_flags(self, sentence) -> dict:
+        """Computes, in a single pass over the token attributes of the sentence, the flags
+            used by `_make_ngrams` to decide where spans can start, continue and end.
+
+        """
+        doc = sentence.doc
+        vocab_strings = doc.vocab.strings
+        if self._flag_hashes is None or self._flag_hashes[0] is not vocab_strings:
+            self._flag_hashes = (
+                vocab_strings,
+                numpy.array([vocab_strings[w] for w in self._stopwords], dtype=numpy.uint64),
+                numpy.array([vocab_strings[w] for w in self.negations], dtype=numpy.uint64),
+                numpy.array([vocab_strings[w] for w in self.valid_punctuation], dtype=numpy.uint64),
+            )
+        _, stopword_hashes, negation_hashes, punctuation_hashes = self._flag_hashes
+
+        start = sentence.start if isinstance(sentence, Span) else 0
+        attrs = doc.to_array(_TOKEN_FLAG_ATTRS)[start:start + len(sentence)]
+        is_punct, is_space, like_num, is_bracket, pos, orth, lemma, idx, length = attrs.T
+
+        punct_or_space = (is_punct | is_space).astype(bool)
+        grammar = numpy.isin(pos, _GRAMMAR_POS)
+        stop = numpy.isin(orth, stopword_hashes)
+        is_det = pos == DET
+        # a token with its trailing whitespace spans from its offset to the offset of the next token
+        end = start + len(sentence)
+        next_idx = numpy.append(idx[1:], doc[end].idx if end < len(doc) else len(doc.text))
+        return {
+            "valid": ~(punct_or_space | grammar),
+            "valid_start": ~(like_num.astype(bool) | (stop & ~numpy.isin(lemma, negation_hashes)) | grammar),
+            "valid_end": ~(punct_or_space | stop | grammar),
+            "valid_middle": ~punct_or_space | is_bracket.astype(bool) | numpy.isin(orth, punctuation_hashes),
+            "is_det": is_det,
+            "det_count": numpy.concatenate(([0], numpy.cumsum(is_det))),
+            "idx": idx.astype(numpy.int64),
+            "end_char": (idx + length).astype(numpy.int64),
+            "next_idx": next_idx.astype(numpy.int64),
+        }
+
+    def _make_ngrams(self, sentence, window=None) -> tuple:
         """Create ngrams from sentences equal to the size of the window
             and greater than the minimum size, excluding invalid tokens,
             determiners and stopwords
 
         """
+        window = self.window if window is None else window
         sentence_length = len(sentence)
-
-        # do not include determiners inside a span
-        skip_in_span = {token.i for token in sentence if token.pos_ == "DET"}
-
-        # invalidate a span if it includes any on these symbols
-        invalid_mid_tokens = {
-            token.i for token in sentence if not self._is_valid_middle_token(token)
-        }
+        if sentence_length == 0:
+            return
+
+        flags = self._token_flags(sentence)
+        # scalar access is much faster on lists than on numpy arrays
+        valid = flags["valid"].tolist()
+        valid_start = flags["valid_start"].tolist()
+        valid_end = flags["valid_end"].tolist()
+        valid_middle = flags["valid_middle"].tolist()
+        is_det = flags["is_det"].tolist()
+        det_count = flags["det_count"].tolist()
+        idx = flags["idx"].tolist()
+        end_char = flags["end_char"].tolist()
+
+        next_idx = flags["next_idx"].tolist()
+        text = sentence.doc.text
+
+        limits = None
+        if self.prune_windows:
+            words = [text[idx[k]:end_char[k]] for k in range(sentence_length)]
+            limits = self._window_limits(words)
+            # number of tokens of the prefix index up to each token, determiners excluded
+            term_tokens = list(itertools.accumulate(
+                (0 if is_det[k] else count_tokens(word) for k, word in enumerate(words)), initial=0
+            ))
 
         for i in range(sentence_length):
-            token = sentence[i]
+            if not valid[i]:
+                continue
 
-            if not self._is_valid_token(token):
+            if limits is not None and limits[i] == 0:
                 continue
 
             # do not consider this token by itself if it is
             # a number or a stopword.
-            if self._is_valid_start_token(token):
-                compensate = False
-            else:
-                compensate = True
+            compensate = not valid_start[i]
 
-            span_end = min(sentence_length, i + self.window) + 1
+            span_end = min(sentence_length, i + window) + 1
 
             # we take a shortcut if the token is the last one
             # in the sentence
             if (
                 i + 1 == sentence_length
-                and self._is_valid_end_token(token)  # it's the last token
-                and len(token)  # it's a valid end token
+                and valid_end[i]  # it's the last token
+                and end_char[i] - idx[i]  # it's a valid end token
                 >= self.min_match_length  # it's of minimum length
             ):
-                yield token.idx, token.idx + len(token), token.text
+                yield idx[i], end_char[i], text[idx[i]:end_char[i]]
 
             for j in range(i + 1, span_end):
+                if limits is not None and term_tokens[j] - term_tokens[i] > limits[i]:
+                    break
+
                 if compensate:
                     compensate = False
                     continue
 
-                if sentence[j - 1] in invalid_mid_tokens:
+                # do not extend a span over symbols that invalidate it
+                if not valid_middle[j - 1]:
                     break
 
-                if not self._is_valid_end_token(sentence[j - 1]):
+                if not valid_end[j - 1]:
                     continue
 
-                span = sentence[i:j]
-
-                if not self._is_longer_than_min(span):
+                if end_char[j - 1] - idx[i] < self.min_match_length:
                     continue
 
-                yield (
-                    span.start_char,
-                    span.end_char,
-                    "".join(
-                        token.text_with_ws
-                        for token in span
-                        if token.i not in skip_in_span
-                    ).strip(),
-                )
+                if det_count[j] == det_count[i]:
+                    ngram = text[idx[i]:end_char[j - 1]]
+                else:
+                    # do not include determiners inside a span
+                    ngram = "".join(
+                        text[idx[k]:next_idx[k]] for k in range(i, j) if not is_det[k]
+                    ).strip()
+
+                yield idx[i], end_char[j - 1], ngram
 
-    def _make_token_sequences(self, parsed):
+    def _make_token_sequences(self, parsed, window=None):
         """ Creates token sequences from sentences the size of the window
             and that are larger than the minimum size.
             It is used when the ignore_syntax parameter is true.
         """
+        window = self.window if window is None else window
+        limits = None
+        if self.prune_windows:
+            words = [token.text for token in parsed]
+            limits = self._window_limits(words)
+            term_tokens = list(itertools.accumulate((count_tokens(word) for word in words), initial=0))
+
         for i in range(len(parsed)):
-            for j in range(i + 1, min(i + self.window, len(parsed)) + 1):
+            if limits is not None and limits[i] == 0:
+                continue
+
+            for j in range(i + 1, min(i + window, len(parsed)) + 1):
+                if limits is not None and term_tokens[j] - term_tokens[i] > limits[i]:
+                    break
+
                 span = parsed[i:j]
 
                 if not self._is_longer_than_min(span):
@@ -276,55 +690,231 @@ class DrugFinder(object):
 
                 yield span.start_char, span.end_char, span.text
 
+    def _window_limits(self, words):
+        """Returns, for each token, the largest number of tokens of a term of the installed version or of
+            the overlay that could start with it; 0 if no term could.
+
+        """
+        prefix_indexes = [self._active_indexes().prefix_index]
+        if self._overlay_prefix_index is not None:
+            prefix_indexes.append(self._overlay_prefix_index)
+
+        limits = []
+        for word in words:
+            word = normalize_term(word, self.normalize_unicode_flag)
+            limits.append(max(prefix_index.max_tokens(word) for prefix_index in prefix_indexes))
+        return limits
+
+    def _get_candidates(self, ngram):
+        return self._get_candidates_many([ngram])[0]
+
+    def _get_candidates_many(self, ngrams, keys=None):
+        """Returns, for each n-gram, a dictionary mapping its candidate terms to their edit similarity.
+
+            The edit similarity, 1 - distance / length, is 0 for the candidates retrieved by trigram
+            similarity only. `keys` are the normalized n-grams, computed from the n-grams if not given.
+
+        """
+        if keys is None:
+            keys = [normalize_term(ngram) for ngram in ngrams]
+        short = [False] * len(ngrams)
+        if self.symspell_db is not None:
+            short = [len(ngram) <= self.symspell_db.max_term_length for ngram in ngrams]
+
+        # in `instead` mode, short n-grams are only looked up in the deletion index
+        trigram = [not (is_short and self.symspell == "instead") for is_short in short]
+        retrieved = iter(self._retrieve_terms([key for key, t in zip(keys, trigram) if t]))
+
+        looked_up = []
+        if self.symspell_db is not None:
+            looked_up = self.symspell_db.lookup_many([key for key, s in zip(keys, short) if s],
+                                                     self.max_edit_distance, normalized=True)
+        looked_up = iter(looked_up)
+
+        results = []
+        for key, is_short, is_trigram in zip(keys, short, trigram):
+            candidates = {}
+            if is_trigram:
+                candidates = dict.fromkeys(next(retrieved), 0.)
+            if self.overlay is not None:
+                for term in self.overlay.simstring_db.get(key, normalized=True):
+                    candidates.setdefault(term, 0.)
+            if is_short:
+                # as many edits as a short n-gram has characters are no match: the threshold also applies
+                for term, distance in next(looked_up):
+                    similarity = edit_similarity(key, term, distance)
+                    if similarity >= self.threshold:
+                        candidates[term] = similarity
+            results.append(candidates)
+        return results
+
+    @staticmethod
+    def _get_exact_candidates_many(keys):
+        # terms are installed normalized; the candidates that are not installed are dropped with the others
+        return [{key: 1.} for key in keys]
+
+    def _shared_namespace(self, kind):
+        # entries depend on the version of the files and, for candidates, on the retrieval options
+        namespace = "{}:{}:".format(kind, self._active_indexes().fingerprint)
+        if kind == "candidates":
+            namespace += "{}:{}:{}:".format(self.retrieval_engine, self.similarity_name, self.threshold)
+        return namespace
+
+    def _retrieve_terms(self, keys):
+        simstring_db = self.simstring_db
+        if self.shared_cache is None:
+            return simstring_db.get_many(keys, normalized=True)
+
+        def compute_many(missing):
+            return [tuple(terms) for terms in simstring_db.get_many(missing, normalized=True)]
+
+        return self.shared_cache.get_many(keys, compute_many, namespace=self._shared_namespace("candidates"))
+
+    def _lookup_many(self, terms, kind):
+        # candidate terms come from the indexes, already normalized; terms that are not installed are
+        # cached too, as empty lookups
+        drugbank_db = self.drugbank_db
+        get_many = drugbank_db.get_many if kind == "drugs" else drugbank_db.get_ids_many
+        if self.shared_cache is None:
+            return get_many(terms, normalized=True)
+
+        def compute_many(missing):
+            found = get_many(missing, normalized=True)
+            return [found.get(term) for term in missing]
+
+        values = self.shared_cache.get_many(terms, compute_many, namespace=self._shared_namespace(kind))
+        return {term: value for term, value in zip(terms, values) if value is not None}
+
+    def _get_drugs(self, terms):
+        # terms of the overlay take precedence over the DrugBank ones; like in `_lookup_many`, the
+        # candidate terms are already normalized
+        drugs = {}
+        if self.overlay is not None:
+            drugs = self.overlay.get_many(terms, self.drugbank_db, normalized=True)
+            terms = [term for term in terms if term not in drugs]
+        drugs.update(self._lookup_many(terms, "drugs"))
+        return drugs
+
+    def _get_drug_ids(self, terms):
+        # same as `_get_drugs`, without reading the drug records
+        drug_ids = {}
+        if self.overlay is not None:
+            drug_ids = self.overlay.get_ids_many(terms, normalized=True)
+            terms = [term for term in terms if term not in drug_ids]
+        drug_ids.update(self._lookup_many(terms, "ids"))
+        return drug_ids
+
     def _get_all_matches(self, ngrams):
-        matches = []
-        for start, end, ngram in ngrams:
-            ngram_normalized = ngram
+        return self._get_all_matches_batch([ngrams])[0]
+
+    def _get_all_matches_batch(self, ngram_batches, exact=False, texts=None):
+        """Computes the matches of the n-grams of one or more documents.
+
+            The candidates of every n-gram are retrieved first, so that each distinct candidate
+            term of the batch is resolved by a single `get_many` call before scoring. With `exact`,
+            the only candidate of an n-gram is the term equal to it. `texts` are the texts the offsets
+            of the n-grams refer to, if any.
+
+        """
+        documents, unique_terms = self._retrieve_batch(ngram_batches, exact, texts)
+        drugs = self._get_drugs(unique_terms)
+        self.lookup_stats = {
+            "documents": len(documents),
+            "ngrams": sum(len(retrieved) for retrieved in documents),
+            "candidates": sum(len(candidates) for retrieved in documents for *_, candidates in retrieved),
+            "term_lookups": len(unique_terms),
+            "record_lookups": len({drugbank_id for items in drugs.values() for drugbank_id, _ in items}),
+        }
+
+        return [self._score_candidates(retrieved, drugs) for retrieved in documents]
+
+    def _retrieve_batch(self, ngram_batches, exact=False, texts=None):
+        """Retrieves the candidates of the n-grams of one or more documents.
 
-            if self.normalize_unicode_flag:
-                ngram_normalized = unidecode(ngram_normalized)
+            When the `texts` the n-grams come from are given, each text is normalized once, and the n-grams
+            that are slices of it read their normalized forms from it.
 
+            Returns:
+                Tuple: for each document, the (start, end, ngram, normalized ngram, candidates) of its n-grams,
+                    and the sorted distinct candidate terms of the batch.
+
+        """
+        ngram_batches = [list(ngrams) for ngrams in ngram_batches]
+        if texts is None:
+            texts = [None] * len(ngram_batches)
+        normalize_unicode = self.normalize_unicode_flag
+        normalized, keys = [], []
+        for ngrams, text in zip(ngram_batches, texts):
+            normalized_text = NormalizedText(text, normalize_unicode) if text is not None else None
+            for start, end, ngram in ngrams:
+                # n-grams without their determiners are shorter than their span
+                forms = None
+                if normalized_text is not None and end - start == len(ngram):
+                    forms = normalized_text.get(start, end)
+                if forms is None:
+                    forms = transliterate(ngram, normalize_unicode), normalize_term(ngram, normalize_unicode)
+                normalized.append(forms[0])
+                keys.append(forms[1])
+
+        # the candidates of the whole batch are retrieved at once, which the sparse engine vectorizes
+        if exact:
+            candidates = iter(self._get_exact_candidates_many(keys))
+        else:
+            candidates = iter(self._get_candidates_many(normalized, keys))
+        normalized = iter(normalized)
+        documents = []
+        for ngrams in ngram_batches:
+            documents.append([
+                (start, end, ngram, next(normalized), next(candidates)) for start, end, ngram in ngrams
+            ])
+
+        unique_terms = {match for retrieved in documents for *_, candidates in retrieved for match in candidates}
+        return documents, sorted(unique_terms)
+
+    def _score_candidates(self, retrieved, drugs):
+        matches = []
+        for start, end, ngram, ngram_normalized, candidate_ngrams in retrieved:
             last_drug_id = None
-            candidate_ngrams = list(set(self.simstring_db.get(ngram_normalized)))
 
             ngram_matches = []
 
-            for match in candidate_ngrams:
-                item = self.drugbank_db.get(match)
-                if item is None:
+            for match, match_edit_similarity in candidate_ngrams.items():
+                if match not in drugs:
                     continue
 
-                drugbank_id, data = item
-
                 match_similarity = get_similarity(
                     x=ngram_normalized,
                     y=match,
                     n=self.ngram_length,
                     similarity_name=self.similarity_name,
                 )
+                # short terms found by edit distance keep a score their few trigrams cannot give them
+                match_similarity = max(match_similarity, match_edit_similarity)
 
                 if match_similarity == 0:
                     continue
 
-                if last_drug_id is not None and last_drug_id == drugbank_id:
-                    if match_similarity > ngram_matches[-1]["similarity"]:
-                        ngram_matches.pop(-1)
-                    else:
-                        continue
-
-                last_drug_id = drugbank_id
-
-                ngram_matches.append(
-                    {
-                        "start": start,
-                        "end": end,
-                        "ngram": ngram,
-                        "term": safe_unicode(match),
-                        "drugbank_id": drugbank_id,
-                        "data": data,
-                        "similarity": match_similarity,
-                    }
-                )
+                # a term shared by several drugs matches each of them
+                for drugbank_id, data in drugs[match]:
+                    if last_drug_id is not None and last_drug_id == drugbank_id:
+                        if match_similarity > ngram_matches[-1]["similarity"]:
+                            ngram_matches.pop(-1)
+                        else:
+                            continue
+
+                    last_drug_id = drugbank_id
+
+                    ngram_matches.append(
+                        {
+                            "start": start,
+                            "end": end,
+                            "ngram": ngram,
+                            "term": match,
+                            "drugbank_id": drugbank_id,
+                            "data": data,
+                            "similarity": match_similarity,
+                        }
+                    )
 
             if len(ngram_matches) > 0:
                 matches.append(
@@ -336,6 +926,59 @@ class DrugFinder(object):
                 )
         return matches
 
+    def _score_candidate_ids(self, retrieved, drug_ids):
+        """Scores the candidates of the n-grams of a document as `_score_candidates`, keeping only the best
+            drugs of each n-gram.
+
+            Returns:
+                List: the (start, end, similarity, drugbank_ids) of the n-grams with a match, with the drugs
+                    that reach the best similarity of the n-gram.
+
+        """
+        spans = []
+        for start, end, ngram, ngram_normalized, candidate_ngrams in retrieved:
+            best_similarity, best_ids = 0, []
+            for match, match_edit_similarity in candidate_ngrams.items():
+                if match not in drug_ids:
+                    continue
+
+                match_similarity = get_similarity(
+                    x=ngram_normalized,
+                    y=match,
+                    n=self.ngram_length,
+                    similarity_name=self.similarity_name,
+                )
+                match_similarity = max(match_similarity, match_edit_similarity)
+
+                if match_similarity == 0 or match_similarity < best_similarity:
+                    continue
+                if match_similarity > best_similarity:
+                    best_similarity, best_ids = match_similarity, []
+                best_ids.extend(drugbank_id for drugbank_id in drug_ids[match] if drugbank_id not in best_ids)
+
+            if len(best_ids) > 0:
+                spans.append((start, end, best_similarity, best_ids))
+        return spans
+
+    @staticmethod
+    def _span_score(span) -> tuple:
+        return span[2], (span[1] - span[0])
+
+    @staticmethod
+    def _span_longest(span) -> tuple:
+        return (span[1] - span[0]), span[2]
+
+    def _select_spans(self, spans):
+        """Same as `_select_terms`, for the spans of `_score_candidate_ids`."""
+        sort_func = self._span_longest if self.overlapping_criteria == "length" else self._span_score
+        intervals = Intervals()
+        selected = []
+        for span in sorted(spans, key=sort_func, reverse=True):
+            if span[:2] not in intervals:
+                selected.append(span)
+                intervals.append(span[:2])
+        return selected
+
     @staticmethod
     def _select_score(match) -> tuple:
         return match[0]["similarity"], (match[0]["end"] - match[0]["start"])
@@ -361,42 +1004,426 @@ class DrugFinder(object):
 
         return final_matches_subset
 
-    def _print_verbose_status(self, parsed, matches):
+    def _print_verbose_status(self, n_tokens, matches):
         logging.info("{:,} extracted from {:,} tokens".format(
                 sum(len(match_group) for match_group in matches),
-                len(parsed),
+                n_tokens,
         ))
+        logging.debug("{ngrams:,} n-grams, {candidates:,} candidates, {term_lookups:,} term lookups and "
+                      "{record_lookups:,} record lookups for {documents:,} documents".format(**self.lookup_stats))
         if not self.verbose:
             return False
 
         print(
-            "[{}] {:,} extracted from {:,} tokens".format(
+            "[{}] {:,} extracted from {:,} tokens ({:,} n-grams, {:,} candidates, {:,} term lookups)".format(
                 datetime.datetime.now().isoformat(),
                 sum(len(match_group) for match_group in matches),
-                len(parsed),
+                n_tokens,
+                self.lookup_stats["ngrams"],
+                self.lookup_stats["candidates"],
+                self.lookup_stats["term_lookups"],
             ),
             file=sys.stderr,
         )
         return True
 
-    def match(self, text, best_match=True, ignore_syntax=False):
-        parsed = self.nlp("{}".format(text))
+    def match(self, text, best_match=True, ignore_syntax=False, chunk_size=None, time_budget_ms=None):
+        """Finds the drugs mentioned in a text.
+
+            Args:
+                text (str): text to be processed.
+                best_match (bool, optional): keeps only the best non-overlapping matches. Defaults to true.
+                ignore_syntax (bool, optional): ignores the syntax when creating ngrams. Defaults to false.
+                chunk_size (int, optional): texts longer than this number of characters are split at paragraph
+                                            or sentence boundaries and matched chunk by chunk, so that memory
+                                            does not grow with the length of the text. A term spanning two chunks
+                                            is matched whole, but the best matches are selected chunk by chunk,
+                                            then across chunks: where overlapping matches cross a boundary, the
+                                            selection can differ from that of the whole text. Defaults to
+                                            chunking only texts longer than the `max_length` of the spaCy
+                                            pipeline.
+                time_budget_ms (float, optional): time allowed to match the text. N-grams are then matched by
+                                            batches; as the budget runs out, the window is shrunk, then only
+                                            exact terms are retrieved, then the rest of the text is skipped.
+                                            A `BudgetedMatches` is returned, which tells whether and how the
+                                            matching was degraded. Defaults to no budget.
+        """
+        text = "{}".format(text)
+        if chunk_size is None and self.nlp is not None and len(text) > self.nlp.max_length:
+            chunk_size = DEFAULT_CHUNK_SIZE
+        if chunk_size is not None and len(text) <= chunk_size:
+            chunk_size = None
+
+        with self._pinned_indexes():
+            if time_budget_ms is not None:
+                return self._match_budgeted(text, best_match, ignore_syntax, chunk_size, TimeBudget(time_budget_ms))
+
+            if self.result_cache is None:
+                return self._match_uncached(text, best_match, ignore_syntax, chunk_size)
+
+            # texts that are not chunked share their entries with `match_many`
+            key = self._cache_key(text, best_match=best_match, ignore_syntax=ignore_syntax, chunk_size=chunk_size)
+            matches = self.result_cache.get(key)
+            if matches is None:
+                matches = self._match_uncached(text, best_match, ignore_syntax, chunk_size)
+                self.result_cache.put(key, matches)
+            return matches
+
+    def _match_budgeted(self, text, best_match, ignore_syntax, chunk_size, budget):
+        """Matches a text as `match` does, degrading the matching as the time budget runs out.
+
+            With enough budget, the matches are the ones of `match`. Complete results are cached as the
+            ones of `match`; partial ones are not.
+
+        """
+        key = None
+        if self.result_cache is not None:
+            key = self._cache_key(text, best_match=best_match, ignore_syntax=ignore_syntax, chunk_size=chunk_size)
+            matches = self.result_cache.get(key)
+            if matches is not None:
+                return BudgetedMatches.from_budget(matches, budget)
+
+        skip = DEGRADATION_LEVELS.index("skip")
+        chunks = [(0, len(text), len(text))]
+        if chunk_size is not None:
+            chunks = iter_chunks(text, chunk_size, overlap_words=self.window)
+
+        matches = []
+        for start, end, parse_end in chunks:
+            if budget.update() >= skip:
+                break
+            chunk = text[start:parse_end]
+            with budget.stage("parse"):
+                doc = chunk if self.tokenizer == "rule" else self._parse(chunk)
+
+            # as in `_match_chunked`, matches starting after the chunk are found, whole, with the next chunk
+            chunk_matches = self._match_doc_budgeted(doc, ignore_syntax, end - start, budget)
+            for match_group in chunk_matches:
+                for match in match_group:
+                    match["start"] += start
+                    match["end"] += start
+            if best_match and chunk_size is not None:
+                chunk_matches = self._select_terms(chunk_matches)
+            matches.extend(chunk_matches)
+
+        if best_match:
+            matches = self._select_terms(matches)
+        matches = BudgetedMatches.from_budget(matches, budget)
+        if key is not None and not matches.partial:
+            self.result_cache.put(key, list(matches))
+        return matches
+
+    def _match_doc_budgeted(self, doc, ignore_syntax, limit, budget):
+        """Matches the n-grams of a document that start before `limit`, by batches of `_BUDGET_CHECK_INTERVAL`.
+
+            The n-grams are generated once for the whole document, as in `match`, and the budget is checked
+            before each batch. Once it reaches the "window" level, the n-grams are generated again with the
+            degraded window, from the first token whose n-grams were not matched yet.
+
+        """
+        skip = DEGRADATION_LEVELS.index("skip")
+        text = doc if isinstance(doc, str) else doc.text
+        window = self.window
+        ngrams = self._make_doc_ngrams(doc, ignore_syntax, window)[0]
+        matches, last_start = [], None
+        while budget.update() < skip:
+            if budget.degradation != "none" and window > DEGRADED_WINDOW:
+                window = DEGRADED_WINDOW
+                ngrams = self._make_doc_ngrams(doc, ignore_syntax, window)[0]
+                if last_start is not None:
+                    ngrams = itertools.dropwhile(lambda ngram, after=last_start: ngram[0] <= after, ngrams)
+
+            with budget.stage("ngrams"):
+                batch = list(itertools.islice(ngrams, _BUDGET_CHECK_INTERVAL))
+                # n-grams are generated by start offset
+                in_chunk = [ngram for ngram in batch if ngram[0] < limit]
+            if len(in_chunk) > 0:
+                last_start = in_chunk[-1][0]
+                with budget.stage("retrieval"):
+                    exact = budget.level >= DEGRADATION_LEVELS.index("exact")
+                    matches.extend(self._get_all_matches_batch([in_chunk], exact, texts=[text])[0])
+            if len(in_chunk) < _BUDGET_CHECK_INTERVAL:
+                break
+        return matches
+
+    def _match_uncached(self, text, best_match, ignore_syntax, chunk_size):
+        if chunk_size is not None:
+            return self._match_chunked(text, best_match, ignore_syntax, chunk_size)
+
+        if self.tokenizer == "rule":
+            return self._match_text(text, best_match, ignore_syntax)
+
+        parsed = self._parse(text)
 
         # pass in parsed spacy doc to get concept matches
         return self._match(parsed, best_match, ignore_syntax)
 
-    def _match(self, doc, best_match=True, ignore_syntax=False):
+    def iter_matches(self, text, best_match=True, ignore_syntax=False, chunk_size=None):
+        """Finds the drugs mentioned in a text, yielding the matches of each sentence as soon as it is matched.
 
-        if ignore_syntax:
-            ngrams = self._make_token_sequences(doc)
+            N-grams are generated over the whole text as in `match`; the n-grams of a sentence are matched,
+            and their overlaps resolved, once the first n-gram of the next sentence is generated. Sentences
+            that an n-gram spans are matched together. The matches yielded are the ones `match` returns,
+            only ordered by sentence; stopping the iteration skips the rest of the text. The result cache
+            is not used.
+
+            Args:
+                text (str): text to be processed.
+                best_match (bool, optional): keeps only the best non-overlapping matches. Defaults to true.
+                ignore_syntax (bool, optional): ignores the syntax when creating ngrams. Defaults to false.
+                chunk_size (int, optional): see `match`.
+
+            Yields:
+                List: the matches of one or more consecutive sentences; sentences without matches are skipped.
+        """
+        # the whole text is matched with the version served when the iteration started
+        indexes = self._acquire_indexes()
+        try:
+            yield from self._iter_matches(text, best_match, ignore_syntax, chunk_size, indexes)
+        finally:
+            indexes.release()
+
+    def _iter_matches(self, text, best_match, ignore_syntax, chunk_size, indexes):
+        text = "{}".format(text)
+        if chunk_size is None and self.nlp is not None and len(text) > self.nlp.max_length:
+            chunk_size = DEFAULT_CHUNK_SIZE
+        if chunk_size is None or len(text) <= chunk_size:
+            doc = text if self.tokenizer == "rule" else self._parse(text)
+            for segment in self._iter_segments(doc, ignore_syntax):
+                matches = self._get_segment_matches(segment, indexes)
+                if best_match:
+                    matches = self._select_terms(matches)
+                if len(matches) > 0:
+                    yield matches
+            return
+
+        # as in `_match_chunked`, overlaps are resolved in each chunk, then between consecutive chunks;
+        # matches are held back until no match of a later sentence can overlap them
+        pending, pending_end = [], 0
+        for start, end, parse_end in iter_chunks(text, chunk_size, overlap_words=self.window):
+            chunk = text[start:parse_end]
+            doc = chunk if self.tokenizer == "rule" else self._parse(chunk)
+            for segment in self._iter_segments(doc, ignore_syntax, limit=end - start):
+                matches = self._get_segment_matches([(s + start, e + start, ngram) for s, e, ngram in segment],
+                                                    indexes)
+                if best_match:
+                    matches = self._select_terms(matches)
+
+                if len(pending) > 0 and segment[0][0] + start >= pending_end:
+                    yield self._select_terms(pending) if best_match else pending
+                    pending = []
+                pending.extend(matches)
+                pending_end = max([pending_end] + [e + start for _, e, _ in segment])
+
+        if len(pending) > 0:
+            yield self._select_terms(pending) if best_match else pending
+
+    def _get_segment_matches(self, ngrams, indexes):
+        # the pin is dropped at every `yield`, so that the caller's thread is free between segments
+        with self._pinned_indexes(indexes):
+            return self._get_all_matches(ngrams)
+
+    def _iter_segments(self, doc, ignore_syntax=False, limit=None):
+        """Yields the n-grams of a document grouped by sentence, merging the sentences an n-gram spans.
+
+            N-grams starting at or after `limit` are skipped.
+
+        """
+        if isinstance(doc, str):
+            sentence_ends = iter_sentence_ends(doc)
+        elif doc.has_annotation("SENT_START"):
+            sentence_ends = (sentence.end_char for sentence in doc.sents)
         else:
-            ngrams = self._make_ngrams(doc)
+            sentence_ends = iter([len(doc.text)])
 
-        matches = self._get_all_matches(ngrams)
+        ngrams, _ = self._make_doc_ngrams(doc, ignore_syntax)
+        segment, segment_end = [], 0
+        sentence_end = next(sentence_ends, None)
+        # n-grams are generated by start offset, so a sentence is complete once an n-gram starts after it
+        for start, end, ngram in ngrams:
+            if limit is not None and start >= limit:
+                break
+            while sentence_end is not None and start >= sentence_end:
+                if len(segment) > 0 and segment_end <= sentence_end:
+                    yield segment
+                    segment = []
+                sentence_end = next(sentence_ends, None)
+            segment.append((start, end, ngram))
+            segment_end = max(segment_end, end)
+
+        if len(segment) > 0:
+            yield segment
+
+    def match_many(self, texts, best_match=True, ignore_syntax=False, columnar=False, batch_size=64):
+        """Matches a collection of texts, parsing them in batches with `nlp.pipe`.
+
+            Args:
+                texts (iterable): texts to be processed.
+                best_match (bool, optional): keeps only the best non-overlapping matches. Defaults to true.
+                ignore_syntax (bool, optional): ignores the syntax when creating ngrams. Defaults to false.
+                columnar (bool, optional): returns a `ColumnarMatches` instead of a list with the matches
+                                            of each text. Defaults to false.
+                batch_size (int, optional): number of texts parsed at once by spaCy. Defaults to 64.
+        """
+        texts = ("{}".format(text) for text in texts)
+        results = ColumnarMatches() if columnar else []
+        # all the texts are matched with the version served when the call started
+        with self._pinned_indexes():
+            while True:
+                batch = list(itertools.islice(texts, batch_size))
+                if len(batch) == 0:
+                    break
+                for matches in self._match_cached_batch(batch, best_match, ignore_syntax):
+                    if columnar:
+                        results.add_document(matches)
+                    else:
+                        results.append(matches)
+
+        if self.result_cache is not None:
+            logging.info("result cache: {hits:,} hits, {misses:,} misses ({hit_rate:.1%}), "
+                         "{entries:,} entries".format(**self.result_cache.stats))
+        if self.doc_cache is not None:
+            logging.info("parse cache: {hits:,} hits, {misses:,} misses ({hit_rate:.1%})".format(
+                **self.doc_cache.stats))
+        if self.shared_cache is not None:
+            logging.info("shared cache (host-wide): {hits:,} hits, {misses:,} misses ({hit_rate:.1%}), "
+                         "{evictions:,} evictions, {oversized:,} values too large for a slot of {slot_size:,} bytes "
+                         "({oversized_rate:.1%})".format(**self.shared_cache.stats))
+        return results
+
+    def count_many(self, texts, best_match=True, ignore_syntax=False, cooccurrence=False, batch_size=64):
+        """Counts the drugs mentioned in a collection of texts, without building match dictionaries.
+
+            Only the drugbank ids of the candidate terms are read, never the drug records. A match counts as
+            a mention of every drug that reaches its best similarity, e.g. of all the drugs of a term that
+            several drugs share. The result cache is not used.
+
+            Args:
+                texts (iterable): texts to be processed.
+                best_match (bool, optional): counts only the best non-overlapping matches. Defaults to true.
+                ignore_syntax (bool, optional): ignores the syntax when creating ngrams. Defaults to false.
+                cooccurrence (bool, optional): also counts the documents mentioning each pair of drugs.
+                                                Defaults to false.
+                batch_size (int, optional): number of texts parsed and matched at once. Defaults to 64.
+
+            Returns:
+                DrugCounts: the counts of the collection, which can be merged with the ones of other
+                    collections, e.g. computed by other processes.
+        """
+        texts = ("{}".format(text) for text in texts)
+        counts = DrugCounts(cooccurrence=cooccurrence)
+        with self._pinned_indexes():
+            while True:
+                batch = list(itertools.islice(texts, batch_size))
+                if len(batch) == 0:
+                    break
+                docs = batch if self.tokenizer == "rule" else self._parse_many(batch)
+                documents, unique_terms = self._retrieve_batch(
+                    [self._make_doc_ngrams(doc, ignore_syntax)[0] for doc in docs],
+                    texts=[doc if isinstance(doc, str) else doc.text for doc in docs],
+                )
+                drug_ids = self._get_drug_ids(unique_terms)
+                for retrieved in documents:
+                    spans = self._score_candidate_ids(retrieved, drug_ids)
+                    if best_match:
+                        spans = self._select_spans(spans)
+                    counts.add_document([drugbank_id for *_, drugbank_ids in spans for drugbank_id in drugbank_ids])
+        return counts
+
+    def _parse(self, text):
+        if self.doc_cache is None:
+            return self.nlp(text)
+        return self.doc_cache.parse(text)
+
+    def _parse_many(self, texts):
+        if self.doc_cache is None:
+            return list(self.nlp.pipe(texts, batch_size=len(texts)))
+        return self.doc_cache.parse_many(texts, batch_size=len(texts))
+
+    def _match_cached_batch(self, texts, best_match, ignore_syntax):
+        """Matches a batch of texts, only parsing the ones that are not in the result cache."""
+        cached, keys = {}, []
+        if self.result_cache is not None:
+            keys = [self._cache_key(text, best_match=best_match, ignore_syntax=ignore_syntax, chunk_size=None)
+                    for text in texts]
+            cached = self.result_cache.get_many(keys)
+
+        missing = [i for i in range(len(texts)) if self.result_cache is None or keys[i] not in cached]
+        computed = {}
+        if len(missing) > 0:
+            docs = [texts[i] for i in missing]
+            if self.tokenizer != "rule":
+                docs = self._parse_many(docs)
+            computed = dict(zip(missing, self._match_batch(docs, best_match, ignore_syntax)))
+            if self.result_cache is not None:
+                self.result_cache.put_many({keys[i]: matches for i, matches in computed.items()})
+
+        return [computed[i] if i in computed else cached[keys[i]] for i in range(len(texts))]
+
+    def _match(self, doc, best_match=True, ignore_syntax=False):
+        return self._match_batch([doc], best_match, ignore_syntax)[0]
+
+    def _match_chunked(self, text, best_match, ignore_syntax, chunk_size):
+        matches = []
+        for start, end, parse_end in iter_chunks(text, chunk_size, overlap_words=self.window):
+            chunk = text[start:parse_end]
+            doc = chunk if self.tokenizer == "rule" else self._parse(chunk)
+            chunk_matches = []
+            for match_group in self._match(doc, best_match=False, ignore_syntax=ignore_syntax):
+                # matches starting after the chunk are found again, whole, with the next chunk
+                if match_group[0]["start"] >= end - start:
+                    continue
+                for match in match_group:
+                    match["start"] += start
+                    match["end"] += start
+                chunk_matches.append(match_group)
+
+            if best_match:
+                chunk_matches = self._select_terms(chunk_matches)
+            matches.extend(chunk_matches)
 
         if best_match:
+            # resolves the overlaps between matches of consecutive chunks
             matches = self._select_terms(matches)
+        return matches
 
-        self._print_verbose_status(doc, matches)
+    def _match_text(self, text, best_match=True, ignore_syntax=False):
+        """Matches raw text with the rule-based tokenizer, without parsing it with spaCy."""
+        return self._match_batch([text], best_match, ignore_syntax)[0]
 
-        return matches
+    def _make_doc_ngrams(self, doc, ignore_syntax=False, window=None):
+        """Returns the n-grams of a spaCy document, or of a raw text for the rule tokenizer,
+            and its number of tokens.
+
+        """
+        window = self.window if window is None else window
+        if isinstance(doc, str):
+            if not ignore_syntax:
+                raise ValueError("The rule tokenizer does not tag the text; call match with ignore_syntax=True")
+            tokens = self.rule_tokenizer.tokenize(doc)
+            limits = None
+            if self.prune_windows:
+                limits = self._window_limits([doc[start:end] for start, end in tokens])
+            ngrams = self.rule_tokenizer.make_token_sequences(doc, window, self.min_match_length, tokens, limits)
+            return ngrams, len(tokens)
+
+        if ignore_syntax:
+            return self._make_token_sequences(doc, window), len(doc)
+        return self._make_ngrams(doc, window), len(doc)
+
+    def _match_batch(self, docs, best_match=True, ignore_syntax=False):
+        ngram_batches, n_tokens = [], 0
+        for doc in docs:
+            ngrams, doc_tokens = self._make_doc_ngrams(doc, ignore_syntax)
+            ngram_batches.append(ngrams)
+            n_tokens += doc_tokens
+
+        texts = [doc if isinstance(doc, str) else doc.text for doc in docs]
+        results = self._get_all_matches_batch(ngram_batches, texts=texts)
+
+        if best_match:
+            results = [self._select_terms(matches) for matches in results]
+
+        self._print_verbose_status(n_tokens, [group for matches in results for group in matches])
+
+        return results
@@ -0,0 +1,79 @@
+import hashlib
+import os
+
+from spacy.tokens import DocBin
+
+from drugfinder.utils import mkdir
+
+
+def model_version(nlp):
+    """Names the spaCy model of `nlp` and its version, e.g. `en_core_web_sm-3.7.1`, to key the caches of its output."""
+    return "{lang}_{name}-{version}".format(**nlp.meta)
+
+
+class DocCache(object):
+    """On-disk cache of the spaCy parses of texts, stored as one `DocBin` file per text.
+
+    Files are kept under a directory per model version and named after the hash of the text, so a
+    corpus re-matched with other matcher options is not parsed again, and a new model never reads
+    the parses of another. The token attributes, lemmas, part of speech tags and dependencies are
+    stored; user data is not. Entries are never evicted. Several processes can share the same cache
+    directory.
+    """
+
+    def __init__(self, path, nlp):
+        self.nlp = nlp
+        self.path = os.path.join(path, model_version(nlp))
+        mkdir(self.path)
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups > 0 else 0.,
+        }
+
+    def _filepath(self, text):
+        digest = hashlib.sha256(text.encode("utf-8", "surrogatepass")).hexdigest()
+        return os.path.join(self.path, digest[:2], digest + ".spacy")
+
+    def get(self, text):
+        """Returns the cached parse of a text, or None."""
+        try:
+            with open(self._filepath(text), "rb") as f:
+                data = f.read()
+        except FileNotFoundError:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        return next(DocBin().from_bytes(data).get_docs(self.nlp.vocab))
+
+    def put(self, text, doc):
+        filepath = self._filepath(text)
+        mkdir(os.path.dirname(filepath))
+        # written aside and renamed, so that other processes never read a partial file
+        tmp_filepath = "{}.{}.tmp".format(filepath, os.getpid())
+        with open(tmp_filepath, "wb") as f:
+            f.write(DocBin(docs=[doc], store_user_data=False).to_bytes())
+        os.replace(tmp_filepath, filepath)
+
+    def parse(self, text):
+        doc = self.get(text)
+        if doc is None:
+            doc = self.nlp(text)
+            self.put(text, doc)
+        return doc
+
+    def parse_many(self, texts, batch_size=64):
+        """Returns the parses of the texts, parsing the ones that are not cached with `nlp.pipe`."""
+        docs = [self.get(text) for text in texts]
+        missing = [i for i, doc in enumerate(docs) if doc is None]
+        for i, doc in zip(missing, self.nlp.pipe((texts[i] for i in missing), batch_size=batch_size)):
+            self.put(texts[i], doc)
+            docs[i] = doc
+        return docs
@@ -0,0 +1,187 @@
+import collections
+import os
+import re
+import struct
+import zlib
+
+# every compact value starts with the magic byte, the format version and the kind of value
+MAGIC = 0xdf
+FORMAT_VERSION = 1
+ZDICT_FILENAME = "records.zdict"
+
+_HEADER = struct.Struct("<BBBH")
+_DRUGBANK_IDS = 1
+_STRING_IDS = 2
+_RECORD = 3
+# a record whose values are compressed together with the preset dictionary
+_COMPRESSED_RECORD = 4
+
+_NONE = 0
+_TEXT = 1
+
+_DRUGBANK_ID_RE = re.compile(r"DB(\d{5})\Z")
+_WORD_RE = re.compile(r"\w+\W*")
+# zlib uses at most 32 KiB; a smaller dictionary is faster to load for every record decompressed
+_ZDICT_SIZE = 16384
+# shorter records do not gain anything from compression
+_MIN_COMPRESSED_LENGTH = 128
+
+_struct_cache = {}
+
+
+def _fields_struct(prefix, n):
+    try:
+        return _struct_cache[prefix, n]
+    except KeyError:
+        _struct_cache[prefix, n] = struct.Struct("<" + prefix * n)
+        return _struct_cache[prefix, n]
+
+
+def train_zdict(texts, size=_ZDICT_SIZE):
+    """Builds a zlib preset dictionary from the words and phrases most frequent in sample texts.
+
+    The most useful strings are placed at the end of the dictionary, where zlib finds them with the
+    shortest distances.
+    """
+    counts = collections.Counter()
+    for text in texts:
+        counts.update(_WORD_RE.findall(text))
+
+    zdict, length = [], 0
+    for word, count in sorted(counts.items(), key=lambda item: item[1] * len(item[0]), reverse=True):
+        if count < 2:
+            break
+        word = word.encode("utf-8")
+        if length + len(word) > size:
+            break
+        zdict.append(word)
+        length += len(word)
+    return b"".join(reversed(zdict))
+
+
+class RecordCodec(object):
+    """Compact, versioned binary encoding of the values of a `DrugBankDB`.
+
+    Term values are lists of drugbank ids; ids of the form `DB#####` are stored as 4 byte integers,
+    other ids as length-prefixed strings. Drug records are a table of (key length, type, value
+    length) entries followed by the keys, then by the values. Records are not compressed unless a preset
+    dictionary `zdict` is given: the values of records longer than 128 bytes are then compressed together
+    with zlib, when that makes them shorter, so that a record is decompressed in a single call.
+    """
+
+    def __init__(self, zdict=None):
+        self.zdict = zdict
+        # there are as many distinct lists of ids as drugs, shared by all the terms of a drug
+        self._decoded_ids = {}
+
+    @classmethod
+    def load(cls, path):
+        """Returns the codec of a database directory, with its preset dictionary if it has one."""
+        zdict_fp = os.path.join(path, ZDICT_FILENAME)
+        if not os.path.exists(zdict_fp):
+            return cls()
+        with open(zdict_fp, "rb") as f:
+            return cls(f.read())
+
+    def save(self, path):
+        if self.zdict is not None:
+            with open(os.path.join(path, ZDICT_FILENAME), "wb") as f:
+                f.write(self.zdict)
+
+    @staticmethod
+    def _header(kind, n):
+        return _HEADER.pack(MAGIC, FORMAT_VERSION, kind, n)
+
+    @staticmethod
+    def _read_header(value):
+        if len(value) < _HEADER.size:
+            raise ValueError("Truncated compact value")
+        magic, version, kind, n = _HEADER.unpack_from(value)
+        if magic != MAGIC:
+            raise ValueError("Not a compact value; was the database installed with another record format?")
+        if version != FORMAT_VERSION:
+            raise ValueError("Unsupported compact record format version {}".format(version))
+        return kind, n
+
+    def encode_ids(self, drugbank_ids):
+        matches = [_DRUGBANK_ID_RE.match(drugbank_id) for drugbank_id in drugbank_ids]
+        if all(m is not None for m in matches):
+            numbers = [int(m.group(1)) for m in matches]
+            return self._header(_DRUGBANK_IDS, len(numbers)) + _fields_struct("I", len(numbers)).pack(*numbers)
+
+        encoded = [drugbank_id.encode("utf-8") for drugbank_id in drugbank_ids]
+        return b"".join(
+            [self._header(_STRING_IDS, len(encoded)), _fields_struct("H", len(encoded)).pack(*map(len, encoded))]
+            + encoded
+        )
+
+    def decode_ids(self, value):
+        try:
+            return self._decoded_ids[value]
+        except KeyError:
+            pass
+        drugbank_ids = self._decode_ids(value)
+        self._decoded_ids[bytes(value)] = drugbank_ids
+        return drugbank_ids
+
+    def _decode_ids(self, value):
+        kind, n = self._read_header(value)
+        if kind == _DRUGBANK_IDS:
+            return tuple("DB%05d" % number for number in _fields_struct("I", n).unpack_from(value, _HEADER.size))
+        if kind != _STRING_IDS:
+            raise ValueError("Compact value is not a list of ids")
+
+        lengths = _fields_struct("H", n).unpack_from(value, _HEADER.size)
+        offset = _HEADER.size + 2 * n
+        drugbank_ids = []
+        for length in lengths:
+            drugbank_ids.append(value[offset:offset + length].decode("utf-8"))
+            offset += length
+        return tuple(drugbank_ids)
+
+    def encode_record(self, drug):
+        table, keys, values = [], [], []
+        for key, value in drug.items():
+            key = key.encode("utf-8")
+            if value is None:
+                value_type, value = _NONE, b""
+            elif isinstance(value, str):
+                value_type, value = _TEXT, value.encode("utf-8")
+            else:
+                raise ValueError("Compact records only hold text and None values, got {!r} for {}".format(
+                    type(value).__name__, key))
+            table.extend((len(key), value_type, len(value)))
+            keys.append(key)
+            values.append(value)
+
+        kind, values = _RECORD, b"".join(values)
+        if self.zdict is not None and len(values) >= _MIN_COMPRESSED_LENGTH:
+            compressor = zlib.compressobj(9, zlib.DEFLATED, -15, zdict=self.zdict)
+            compressed = compressor.compress(values) + compressor.flush()
+            if len(compressed) < len(values):
+                kind, values = _COMPRESSED_RECORD, compressed
+        return b"".join([self._header(kind, len(drug)), _fields_struct("BBI", len(drug)).pack(*table)] + keys + [values])
+
+    def decode_record(self, value):
+        kind, n = self._read_header(value)
+        if kind != _RECORD and kind != _COMPRESSED_RECORD:
+            raise ValueError("Compact value is not a drug record")
+
+        table = _fields_struct("BBI", n).unpack_from(value, _HEADER.size)
+        offset = _HEADER.size + 6 * n
+        keys = []
+        for key_length in table[0::3]:
+            keys.append(value[offset:offset + key_length].decode("utf-8"))
+            offset += key_length
+
+        values = value[offset:]
+        if kind == _COMPRESSED_RECORD:
+            if self.zdict is None:
+                raise ValueError("Compressed record without the preset dictionary {}".format(ZDICT_FILENAME))
+            values = zlib.decompressobj(-15, zdict=self.zdict).decompress(values)
+
+        drug, offset = {}, 0
+        for key, value_type, value_length in zip(keys, table[1::3], table[2::3]):
+            drug[key] = values[offset:offset + value_length].decode("utf-8") if value_type == _TEXT else None
+            offset += value_length
+        return drug
@@ -0,0 +1,341 @@
+import argparse
+import itertools
+import json
+import logging
+import os
+import random
+import sys
+import time
+
+from drugfinder.overlay import read_lexicon
+
+# matcher options swept by the evaluation, with the command line option of each
+GRID_OPTIONS = ("threshold", "window", "similarity_name", "overlapping_criteria")
+SYNTHETIC_TEMPLATES = (
+    "The patient was started on {} 10 mg twice daily.",
+    "{} was discontinued after two weeks because of nausea.",
+    "No adverse events were reported in the {} group.",
+    "She had previously taken {} without improvement.",
+    "Treatment with {} was well tolerated.",
+)
+SYNTHETIC_FILLERS = (
+    "Blood pressure remained stable during the follow-up.",
+    "The primary endpoint was the change from baseline at week 12.",
+    "Laboratory values were within normal limits.",
+)
+
+
+def parse_args():
+    ap = argparse.ArgumentParser(
+        description="Matches an annotated corpus with a grid of DrugFinder configurations and reports "
+                    "precision, recall and F1 next to the throughput of each configuration"
+    )
+    ap.add_argument(
+        "drugbank_fp",
+        help="Location where DrugBank was installed"
+    )
+    ap.add_argument(
+        "corpus_path",
+        nargs="?",
+        help="JSONL file with `text` and `spans` ({start, end, drugbank_id}) fields, or BRAT directory of "
+             ".txt/.ann pairs whose entities are normalized to DrugBank ids"
+    )
+    ap.add_argument(
+        "--synthetic",
+        metavar="LEXICON",
+        help="Generate the corpus from a CSV or JSONL lexicon with `term` and `drugbank_id` columns instead"
+    )
+    ap.add_argument(
+        "--synthetic-documents",
+        type=int,
+        default=200,
+        help="Number of documents of the synthetic corpus"
+    )
+    ap.add_argument(
+        "--threshold",
+        type=float,
+        nargs="+",
+        default=[0.7],
+        help="Minimum similarities between strings to evaluate"
+    )
+    ap.add_argument(
+        "--window",
+        type=int,
+        nargs="+",
+        default=[5],
+        help="Maximum amounts of tokens to consider for matching to evaluate"
+    )
+    ap.add_argument(
+        "--similarity-name",
+        choices=("dice", "jaccard", "cosine", "overlap"),
+        nargs="+",
+        default=["cosine"],
+        help="Similarity measures for string comparison to evaluate"
+    )
+    ap.add_argument(
+        "--overlapping-criteria",
+        choices=("score", "length"),
+        nargs="+",
+        default=["score"],
+        help="Tiebreakers between overlapping matches to evaluate"
+    )
+    ap.add_argument(
+        "--tokenizer",
+        choices=("spacy", "rule"),
+        default="spacy",
+        help="`rule` does not load any spaCy model and implies `--ignore-syntax`"
+    )
+    ap.add_argument(
+        "--ignore-syntax",
+        action="store_true",
+        help="Ignore the syntax when creating n-grams"
+    )
+    ap.add_argument(
+        "--batch-size",
+        type=int,
+        default=64,
+        help="Number of texts matched at once"
+    )
+    ap.add_argument(
+        "--output",
+        metavar="FILEPATH",
+        help="Also write the result of each configuration to a JSONL file"
+    )
+    opts = ap.parse_args()
+    return opts
+
+
+def read_jsonl_corpus(path):
+    """Reads the documents of a JSONL corpus: one object with a `text` and its `spans` per line."""
+    documents = []
+    with open(path, encoding="utf-8") as f:
+        for line_number, line in enumerate(f, 1):
+            if len(line.strip()) == 0:
+                continue
+            record = json.loads(line)
+            spans = {(span["start"], span["end"], span["drugbank_id"]) for span in record.get("spans", [])}
+            documents.append({"id": record.get("id", line_number), "text": record["text"], "spans": spans})
+    return documents
+
+
+def read_brat_annotations(path):
+    """Returns the (start, end, drugbank_id) spans of a BRAT .ann file.
+
+    The DrugBank id of an entity is read from its normalization (`N`) lines, e.g.
+    `N1<TAB>Reference T1 DrugBank:DB00422<TAB>Ritalin`; entities without one are skipped. The span of a
+    discontinuous entity goes from its first start to its last end.
+    """
+    offsets, spans = {}, set()
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            fields = line.rstrip("\n").split("\t")
+            if len(fields) < 2:
+                continue
+            if fields[0].startswith("T"):
+                fragments = fields[1].split(" ", 1)[1].split(";")
+                offsets[fields[0]] = (int(fragments[0].split()[0]), int(fragments[-1].split()[1]))
+            elif fields[0].startswith("N"):
+                _, entity, reference = fields[1].split(" ", 2)
+                drugbank_id = reference.split(":")[-1]
+                if entity in offsets:
+                    spans.add(offsets[entity] + (drugbank_id,))
+                else:
+                    logging.debug("Skipping the normalization of unknown entity %s in %s", entity, path)
+    return spans
+
+
+def read_brat_corpus(path):
+    """Reads the documents of a BRAT directory: each .txt file with the spans of its .ann file."""
+    documents = []
+    for filename in sorted(os.listdir(path)):
+        if not filename.endswith(".txt"):
+            continue
+        name = filename[:-len(".txt")]
+        with open(os.path.join(path, filename), encoding="utf-8") as f:
+            text = f.read()
+        ann_fp = os.path.join(path, name + ".ann")
+        spans = read_brat_annotations(ann_fp) if os.path.exists(ann_fp) else set()
+        documents.append({"id": name, "text": text, "spans": spans})
+    return documents
+
+
+def read_corpus(path):
+    if os.path.isdir(path):
+        return read_brat_corpus(path)
+    return read_jsonl_corpus(path)
+
+
+def make_synthetic_corpus(lexicon_filepaths, n_documents=200, seed=0):
+    """Generates an annotated corpus by inserting the terms of a lexicon into template sentences.
+
+    Every document has a few annotated sentences and unannotated filler sentences, and about one term in
+    five has a typo, so that both the similarity threshold and the window size change the results.
+    """
+    entries = [entry for lexicon_fp in lexicon_filepaths for entry in read_lexicon(lexicon_fp)]
+    if len(entries) == 0:
+        raise ValueError("The lexicon has no entries")
+
+    rnd = random.Random(seed)
+    documents = []
+    for doc_id in range(n_documents):
+        text, spans = "", set()
+        for _ in range(rnd.randint(1, 4)):
+            if rnd.random() < 0.3:
+                text += rnd.choice(SYNTHETIC_FILLERS) + " "
+            entry = rnd.choice(entries)
+            term = entry["term"]
+            if len(term) > 4 and rnd.random() < 0.2:
+                i = rnd.randrange(1, len(term) - 1)
+                term = term[:i] + term[i + 1] + term[i] + term[i + 2:]
+            prefix, suffix = rnd.choice(SYNTHETIC_TEMPLATES).split("{}")
+            if prefix == "":
+                term = term[0].upper() + term[1:]
+            start = len(text) + len(prefix)
+            spans.add((start, start + len(term), entry["drugbank_id"]))
+            text += prefix + term + suffix + " "
+        documents.append({"id": doc_id, "text": text.strip(), "spans": spans})
+    return documents
+
+
+def predicted_spans(matches):
+    """Returns the (start, end, drugbank_ids) of the match groups of a text.
+
+    The ids of a group are the ones of its candidates that reach its best similarity, since the terms
+    shared by several drugs cannot tell them apart.
+    """
+    spans = []
+    for group in matches:
+        best = max(match["similarity"] for match in group)
+        drugbank_ids = {match["drugbank_id"] for match in group if match["similarity"] == best}
+        spans.append((group[0]["start"], group[0]["end"], drugbank_ids))
+    return spans
+
+
+def score(documents, results):
+    """Computes the precision, recall and F1 of the matches of the documents against their spans.
+
+    A match is correct when its offsets are the ones of an annotated span and the id of the span is among
+    the ids of the match.
+    """
+    n_gold, n_predicted, true_positives, found = 0, 0, 0, 0
+    for document, matches in zip(documents, results):
+        gold = document["spans"]
+        spans = predicted_spans(matches)
+        n_gold += len(gold)
+        n_predicted += len(spans)
+        true_positives += sum(1 for start, end, drugbank_ids in spans
+                              if any((start, end, drugbank_id) in gold for drugbank_id in drugbank_ids))
+        found += sum(1 for start, end, drugbank_id in gold
+                     if any((start, end) == (s, e) and drugbank_id in ids for s, e, ids in spans))
+
+    precision = true_positives / n_predicted if n_predicted > 0 else 0.
+    recall = found / n_gold if n_gold > 0 else 0.
+    f1 = 2 * precision * recall / (precision + recall) if precision + recall > 0 else 0.
+    return {"precision": precision, "recall": recall, "f1": f1}
+
+
+def iter_configs(grid):
+    """Yields every combination of the values of a grid, as keyword arguments of `DrugFinder`."""
+    names = [name for name in GRID_OPTIONS if name in grid]
+    for values in itertools.product(*(grid[name] for name in names)):
+        yield dict(zip(names, values))
+
+
+def evaluate_config(drugbank_fp, documents, config, tokenizer="spacy", ignore_syntax=False, batch_size=64):
+    """Matches the documents with one configuration and returns its quality and throughput.
+
+    Loading the matcher is not timed. n-grams and candidates are counted by the matcher for each batch.
+    """
+    from drugfinder.core import DrugFinder
+    matcher = DrugFinder(drugbank_fp, tokenizer=tokenizer, read_only=True, **config)
+    ignore_syntax = ignore_syntax or tokenizer == "rule"
+
+    results, n_ngrams, n_candidates = [], 0, 0
+    start = time.perf_counter()
+    for i in range(0, len(documents), batch_size):
+        texts = [document["text"] for document in documents[i:i + batch_size]]
+        results.extend(matcher.match_many(texts, ignore_syntax=ignore_syntax, batch_size=batch_size))
+        n_ngrams += matcher.lookup_stats["ngrams"]
+        n_candidates += matcher.lookup_stats["candidates"]
+    elapsed = time.perf_counter() - start
+
+    result = dict(config)
+    result.update(score(documents, results))
+    result.update({
+        "documents": len(documents),
+        "seconds": elapsed,
+        "docs_per_second": len(documents) / elapsed if elapsed > 0 else float("inf"),
+        "ngrams_per_doc": n_ngrams / len(documents) if len(documents) > 0 else 0.,
+        "candidates_per_ngram": n_candidates / n_ngrams if n_ngrams > 0 else 0.,
+    })
+    return result
+
+
+def pareto_frontier(results, quality="f1", speed="docs_per_second"):
+    """Returns the results that no other result beats on both quality and speed, from fastest to slowest."""
+    frontier = []
+    for result in sorted(results, key=lambda r: (-r[speed], -r[quality])):
+        if len(frontier) == 0 or result[quality] > frontier[-1][quality]:
+            frontier.append(result)
+    return frontier
+
+
+def format_report(results, frontier):
+    names = [name for name in GRID_OPTIONS if name in results[0]] if len(results) > 0 else []
+    header = names + ["precision", "recall", "f1", "docs/s", "ngrams/doc", "cands/ngram", "pareto"]
+    rows = []
+    on_frontier = {id(result) for result in frontier}
+    for result in sorted(results, key=lambda r: -r["f1"]):
+        rows.append(["{}".format(result[name]) for name in names] + [
+            "{:.3f}".format(result["precision"]),
+            "{:.3f}".format(result["recall"]),
+            "{:.3f}".format(result["f1"]),
+            "{:,.1f}".format(result["docs_per_second"]),
+            "{:.1f}".format(result["ngrams_per_doc"]),
+            "{:.2f}".format(result["candidates_per_ngram"]),
+            "*" if id(result) in on_frontier else "",
+        ])
+    widths = [max(len(row[i]) for row in [header] + rows) for i in range(len(header))]
+    return "\n".join("  ".join(cell.ljust(width) for cell, width in zip(row, widths)).rstrip()
+                     for row in [header] + rows)
+
+
+def main():
+    opts = parse_args()
+    if (opts.corpus_path is None) == (opts.synthetic is None):
+        print("Give either an annotated corpus or `--synthetic`", file=sys.stderr)
+        exit(1)
+
+    if opts.synthetic is not None:
+        documents = make_synthetic_corpus([opts.synthetic], n_documents=opts.synthetic_documents)
+    else:
+        documents = read_corpus(opts.corpus_path)
+    logging.info("{:,} documents with {:,} annotated spans".format(
+        len(documents), sum(len(document["spans"]) for document in documents)))
+
+    grid = {
+        "threshold": opts.threshold,
+        "window": opts.window,
+        "similarity_name": opts.similarity_name,
+        "overlapping_criteria": opts.overlapping_criteria,
+    }
+    results = []
+    for config in iter_configs(grid):
+        result = evaluate_config(opts.drugbank_fp, documents, config,
+                                 tokenizer=opts.tokenizer,
+                                 ignore_syntax=opts.ignore_syntax,
+                                 batch_size=opts.batch_size)
+        logging.info("{}: F1 {:.3f}, {:,.1f} docs/s".format(config, result["f1"], result["docs_per_second"]))
+        results.append(result)
+
+    frontier = pareto_frontier(results)
+    print(format_report(results, frontier))
+    if opts.output is not None:
+        with open(opts.output, "w", encoding="utf-8") as f:
+            for result in results:
+                f.write(json.dumps(dict(result, pareto=any(result is r for r in frontier))))
+                f.write("\n")
+
+
+if __name__ == "__main__":
+    main()
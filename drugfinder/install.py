@@ -1,13 +1,27 @@
+import io
 import os
+import re
 import sys
+import json
+import hashlib
+import itertools
+import mmap
+import multiprocessing
 import shutil
 import time
 import xmlschema
 import tqdm
 import logging
 
-from drugfinder.utils import parse_args, DrugBankDB, mkdir
+from drugfinder.utils import parse_args, DrugBankDB, mkdir, get_drug_terms, safe_unicode, read_record_format
+from drugfinder.utils import TERM_SEPARATOR
+from drugfinder.utils import InstallLock, LOCK_FILENAME, empty_directory
 from drugfinder.simstring import SimstringDBWriter
+from drugfinder.sparse import build_sparse_index, sparse_index_filepath
+from drugfinder.symspell import build_symspell_index, SYMSPELL_CONFIG
+from drugfinder.prefixes import build_prefix_index
+from drugfinder.versions import is_versioned, current_version, new_version_name, version_path, copy_version
+from drugfinder.versions import publish_version
 
 try:
     from unidecode import unidecode
@@ -23,13 +37,14 @@ def get_drugbank_iterator(path, schema):
 
     # parse synonyms of the drug element
     def get_synonyms(_data):
-        return {'synonyms': ';'.join([j for k, v in _data[list(_data.keys())[0]][0][1] if k == 'synonyms' and
-                                      v is not None for i, j in v if i == 'synonym'])}
+        return {'synonyms': TERM_SEPARATOR.join([j for k, v in _data[list(_data.keys())[0]][0][1]
+                                                 if k == 'synonyms' and v is not None for i, j in v if i == 'synonym'])}
 
     # parse product names of the drug element
     def get_products(_data):
-        return {'products': ';'.join(set([y for k, v in _data[list(_data.keys())[0]][0][1] if k == 'products' and
-                                          v is not None for i, j in v if i == 'product' for x, y in j if x == 'name']))}
+        products = [y for k, v in _data[list(_data.keys())[0]][0][1] if k == 'products' and v is not None
+                    for i, j in v if i == 'product' for x, y in j if x == 'name']
+        return {'products': TERM_SEPARATOR.join(dict.fromkeys(products))}
 
     # parse basic data of the drug element
     def get_data(_data):
@@ -99,31 +114,342 @@ def extract_from_drugbank(
     print("Done in {:.2f} s".format(time.time() - start))
 
 
+# top level drugs are the only `drug` elements with a `type` attribute, as in `get_drugbank_iterator`
+_DRUG_START_RE = re.compile(rb"<drug\s[^>]*\btype=")
+_DRUGBANK_END = b"</drugbank>"
+# approximate size of the byte ranges of the XML parsed by each worker of a parallel install
+SHARD_SIZE = 8 * 1024 * 1024
+
+
+def split_drugbank(drugbank_filepath, shard_size=None):
+    """Splits the DrugBank XML in byte ranges of consecutive top level `drug` elements.
+
+    Returns:
+        Tuple: the bytes preceding the first drug (XML declaration and root element), and the
+            (start, end) offsets of the shards.
+    """
+    shard_size = SHARD_SIZE if shard_size is None else shard_size
+    with open(drugbank_filepath, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        first = _DRUG_START_RE.search(data)
+        if first is None:
+            raise ValueError('"{}" has no drug element'.format(drugbank_filepath))
+        end = data.rfind(_DRUGBANK_END)
+        if end < first.start():
+            raise ValueError('"{}" has no closing drugbank element'.format(drugbank_filepath))
+
+        shards, start = [], first.start()
+        while start < end:
+            m = _DRUG_START_RE.search(data, min(start + shard_size, end), end)
+            shard_end = end if m is None else m.start()
+            shards.append((start, shard_end))
+            start = shard_end
+        return data[:first.start()], shards
+
+
+_shard_schema = None
+
+
+def _init_shard_worker(drugbank_schema_filepath):
+    global _shard_schema
+    _shard_schema = xmlschema.XMLSchema(drugbank_schema_filepath)
+
+
+def _parse_shard(args):
+    drugbank_filepath, header, start, end, normalize_unicode = args
+    shard_start = time.time()
+    with open(drugbank_filepath, "rb") as f:
+        f.seek(start)
+        shard = io.BytesIO(header + f.read(end - start) + _DRUGBANK_END)
+
+    contents = []
+    for content in get_drugbank_iterator(path=shard, schema=_shard_schema):
+        if normalize_unicode:
+            content = dict(zip(content.keys(), list(map(unidecode, content.values()))))
+        contents.append(content)
+    return contents, time.time() - shard_start
+
+
+def extract_from_drugbank_parallel(
+        drugbank_filepath,
+        drugbank_schema_filepath,
+        opts
+):
+    """Same as `extract_from_drugbank`, parsing and normalizing shards of the XML in `opts.jobs` processes.
+
+    The drugs are yielded in the order of the file, so that the installation written from them is the
+    same as the one of a serial install.
+    """
+    start = time.time()
+    logging.info("Loading drug data with {} processes...".format(opts.jobs))
+    header, shards = split_drugbank(drugbank_filepath)
+    tasks = [(drugbank_filepath, header, shard_start, shard_end, opts.normalize_unicode)
+             for shard_start, shard_end in shards]
+    with multiprocessing.Pool(opts.jobs, initializer=_init_shard_worker,
+                              initargs=(drugbank_schema_filepath,)) as pool:
+        progress = tqdm.tqdm(total=len(shards), unit="shard")
+        for i, (contents, seconds) in enumerate(pool.imap(_parse_shard, tasks)):
+            logging.info("Shard {}/{}: {:,} drugs ({:,} bytes) parsed in {:.2f} s".format(
+                i + 1, len(shards), len(contents), shards[i][1] - shards[i][0], seconds))
+            progress.update(1)
+            progress.set_postfix(drugs=len(contents))
+            yield from contents
+        progress.close()
+
+    logging.info("Done in {:.2f} s".format(time.time() - start))
+    print("Done in {:.2f} s".format(time.time() - start))
+
+
+def _extract(opts):
+    # more processes than CPUs only add overhead; with a single CPU the XML is parsed sequentially
+    jobs = min(opts.jobs, os.cpu_count() or 1)
+    if jobs < opts.jobs:
+        logging.warning("Parsing with {} processes, the number of CPUs, instead of {}".format(jobs, opts.jobs))
+        opts.jobs = jobs
+    if opts.jobs > 1:
+        return extract_from_drugbank_parallel(opts.drugbank_filepath, opts.drugbank_schema_filepath, opts)
+    return extract_from_drugbank(opts.drugbank_filepath, opts.drugbank_schema_filepath, opts)
+
+
+# number of drugs the compression dictionary of `--compress-records` is trained on
+COMPRESSION_SAMPLE_SIZE = 2000
+
+
+def content_hash(content):
+    return hashlib.sha1(json.dumps(content, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def write_drug_hashes(manifest_fp, drug_hashes):
+    tmp_fp = manifest_fp + ".tmp"
+    with open(tmp_fp, "w") as f:
+        json.dump(drug_hashes, f)
+    os.replace(tmp_fp, manifest_fp)
+
+
+def read_drug_hashes(manifest_fp):
+    with open(manifest_fp) as f:
+        return json.load(f)
+
+
+def write_simstring_terms(simstring_dir, terms, sparse_index=False):
+    mkdir(simstring_dir)
+    simstring_db = SimstringDBWriter(simstring_dir, filename="drug-terms.simstring")
+    for term in terms:
+        simstring_db.insert(term)
+    simstring_db.close()
+    build_prefix_index(terms, simstring_dir, filename="drug-terms.simstring")
+    if sparse_index:
+        build_sparse_index(terms, simstring_dir, filename="drug-terms.simstring")
+
+
+def _replace_directory(path, new_path):
+    old_path = path + ".old"
+    os.rename(path, old_path)
+    os.rename(new_path, path)
+    shutil.rmtree(old_path)
+
+
+def write_symspell_index(symspell_dir, drug_hashes, database_backend, max_term_length, max_distance):
+    build_symspell_index(_term_mapping(drug_hashes), symspell_dir, database_backend, max_term_length, max_distance)
+
+
 def parse_and_encode_ngrams(
     drugbank_iterator,
     simstring_dir,
     drugbank_db_dir,
-    database_backend
+    database_backend,
+    manifest_fp=None,
+    sparse_index=False,
+    record_format="pickle",
+    compress_records=False
 ):
     # create destination directories for simstring dataset
     mkdir(simstring_dir)
     mkdir(drugbank_db_dir)
 
-    simstring_db = SimstringDBWriter(simstring_dir, filename="drug-terms.simstring")
-    drugbank_db = DrugBankDB(drugbank_db_dir, database_backend=database_backend)
+    drugbank_db = DrugBankDB(drugbank_db_dir, database_backend=database_backend, record_format=record_format)
+    if record_format == "compact" and compress_records:
+        # the compression dictionary is trained on the first drugs, then used for all of them
+        sample = list(itertools.islice(drugbank_iterator, COMPRESSION_SAMPLE_SIZE))
+        drugbank_db.train_compression(sample)
+        drugbank_iterator = itertools.chain(sample, drugbank_iterator)
+
+    # content hash and terms of every drug, used by `--upgrade` to find what changed
+    drug_hashes = {}
+    for content in drugbank_iterator:
+        drugbank_id = safe_unicode(content['drugbank_id'])
+        drug_hashes[drugbank_id] = {"hash": content_hash(content), "terms": get_drug_terms(content)}
+        content.pop('drugbank_id')
+        drugbank_db.insert_data(drugbank_id, content)
+
+    # each distinct term is indexed once and mapped to all the drugs it names
+    term_mapping = _term_mapping(drug_hashes)
+    for term, drugbank_ids in term_mapping.items():
+        drugbank_db.insert_term(term, drugbank_ids)
+    drugbank_db.close()
+    write_simstring_terms(simstring_dir, list(term_mapping), sparse_index=sparse_index)
+
+    if manifest_fp is not None:
+        write_drug_hashes(manifest_fp, drug_hashes)
+
+
+def _term_mapping(drug_hashes):
+    """Maps every distinct term to the ids of the drugs it names, in install order."""
+    mapping = {}
+    for drugbank_id, entry in drug_hashes.items():
+        for term in entry["terms"]:
+            drugbank_ids = mapping.setdefault(term, [])
+            if drugbank_id not in drugbank_ids:
+                drugbank_ids.append(drugbank_id)
+    return mapping
+
+
+def upgrade_drugbank(
+    drugbank_iterator,
+    simstring_dir,
+    drugbank_db_dir,
+    database_backend,
+    manifest_fp,
+    symspell_dir=None,
+    record_format="pickle"
+):
+    """Upgrades an installation in place to a new DrugBank release.
+
+    Drugs are compared with the installed ones by drugbank_id and content hash: only new and changed
+    drug records and the term mappings that differ are written, and removed drugs are deleted. The
+    simstring index, and the sparse matrix and deletion index if they were installed, are rebuilt only if
+    the set of terms changed.
+    """
+    if not os.path.exists(manifest_fp):
+        raise IOError(
+            '"{}" not found; the installation predates `--upgrade` and must be '
+            'reinstalled once'.format(manifest_fp)
+        )
+    old_hashes = read_drug_hashes(manifest_fp)
+    drugbank_db = DrugBankDB(drugbank_db_dir, database_backend=database_backend, record_format=record_format)
 
+    new_hashes = {}
+    stats = {"added": 0, "changed": 0, "removed": 0, "terms_changed": 0, "simstring_rebuilt": False}
     for content in drugbank_iterator:
-        simstring_db.insert(content['name'].lower())
-        if len(content['synonyms']) > 0:
-            [simstring_db.insert(synonym.lower()) for synonym in content['synonyms'].split(';')]
-        if len(content['products']) > 0:
-            [simstring_db.insert(product.lower()) for product in content['products'].split(';')]
-        drugbank_db.insert(content)
+        drugbank_id = safe_unicode(content['drugbank_id'])
+        new_hashes[drugbank_id] = {"hash": content_hash(content), "terms": get_drug_terms(content)}
+
+        old_entry = old_hashes.get(drugbank_id)
+        if old_entry is not None and old_entry["hash"] == new_hashes[drugbank_id]["hash"]:
+            continue
+
+        stats["added" if old_entry is None else "changed"] += 1
+        content.pop('drugbank_id')
+        drugbank_db.insert_data(drugbank_id, content, overwrite=True)
+
+    for drugbank_id in set(old_hashes).difference(new_hashes):
+        stats["removed"] += 1
+        drugbank_db.delete_data(drugbank_id)
+
+    old_mapping, new_mapping = _term_mapping(old_hashes), _term_mapping(new_hashes)
+    for term in set(old_mapping).union(new_mapping):
+        drugbank_ids = new_mapping.get(term)
+        if drugbank_ids == old_mapping.get(term):
+            continue
+        stats["terms_changed"] += 1
+        if drugbank_ids is None:
+            drugbank_db.delete_term(term)
+        else:
+            drugbank_db.insert_term(term, drugbank_ids)
+    drugbank_db.close()
+
+    if set(old_mapping) != set(new_mapping):
+        # the simstring writer cannot update a database, so the new one is written aside and swapped in
+        new_simstring_dir = simstring_dir + ".new"
+        if os.path.exists(new_simstring_dir):
+            shutil.rmtree(new_simstring_dir)
+        sparse_index = os.path.exists(sparse_index_filepath(simstring_dir, "drug-terms.simstring"))
+        write_simstring_terms(new_simstring_dir, list(new_mapping), sparse_index=sparse_index)
+        _replace_directory(simstring_dir, new_simstring_dir)
+
+        if symspell_dir is not None and os.path.exists(symspell_dir):
+            with open(os.path.join(symspell_dir, SYMSPELL_CONFIG)) as f:
+                config = json.load(f)
+            new_symspell_dir = symspell_dir + ".new"
+            if os.path.exists(new_symspell_dir):
+                shutil.rmtree(new_symspell_dir)
+            write_symspell_index(new_symspell_dir, new_hashes, database_backend, **config)
+            _replace_directory(symspell_dir, new_symspell_dir)
+        stats["simstring_rebuilt"] = True
+
+    write_drug_hashes(manifest_fp, new_hashes)
+    return stats
+
+
+def acquire_install_lock(destination_path):
+    try:
+        return InstallLock(destination_path, exclusive=True)
+    except IOError as err:
+        print(err, file=sys.stderr)
+        exit(1)
+
+
+def upgrade(opts):
+    versioned = is_versioned(opts.destination_path)
+    installed_path = current_version(opts.destination_path)[1] if versioned else opts.destination_path
+    for flag in ("database_backend.flag", "drugbank-hashes.json"):
+        if not os.path.exists(os.path.join(installed_path, flag)):
+            print('"{}" is not a DrugFinder installation that can be upgraded; missing {}'.format(
+                opts.destination_path, flag), file=sys.stderr)
+            exit(1)
+
+    with open(os.path.join(installed_path, "database_backend.flag")) as f:
+        database_backend = f.read().strip()
+    record_format = read_record_format(installed_path)
+    installed_normalize_unicode = os.path.exists(os.path.join(installed_path, "normalize-unicode.flag"))
+    if installed_normalize_unicode != opts.normalize_unicode:
+        print("`--normalize-unicode` must match the installation being upgraded", file=sys.stderr)
+        exit(1)
+
+    install_lock = acquire_install_lock(opts.destination_path)
+    destination_path = opts.destination_path
+    if versioned:
+        # the current version keeps being served while a copy of it is upgraded; only the database of drugs
+        # is updated in place, the indexes are rebuilt aside and swapped in
+        version = new_version_name()
+        destination_path = copy_version(opts.destination_path, current_version(opts.destination_path)[0], version,
+                                        modified=("drugbank-db.db",))
+
+    start = time.time()
+    drugbank_iterator = _extract(opts)
+    stats = upgrade_drugbank(
+        drugbank_iterator,
+        os.path.join(destination_path, "drugbank-simstring.db"),
+        os.path.join(destination_path, "drugbank-db.db"),
+        database_backend=database_backend,
+        manifest_fp=os.path.join(destination_path, "drugbank-hashes.json"),
+        symspell_dir=os.path.join(destination_path, "drugbank-symspell.db"),
+        record_format=record_format
+    )
+    msg = ("Upgrade done in {:.2f} s: {added:,} drugs added, {changed:,} changed, {removed:,} removed, "
+           "{terms_changed:,} term mappings updated, simstring index rebuilt: {simstring_rebuilt}").format(
+        time.time() - start, **stats)
+    if versioned:
+        publish_version(opts.destination_path, version, keep=opts.keep_versions)
+        msg += "; version {} is now current".format(version)
+    install_lock.release()
+    logging.info(msg)
+    print(msg)
 
 
 def main():
     opts = parse_args()
 
+    if opts.jobs < 1:
+        print("`--jobs` must be positive", file=sys.stderr)
+        exit(1)
+    if opts.keep_versions < 1:
+        print("`--keep-versions` must be positive", file=sys.stderr)
+        exit(1)
+
+    if opts.upgrade:
+        upgrade(opts)
+        return
+
     if not os.path.exists(opts.destination_path):
         msg = 'Directory "{}" does not exists; should I create it? [y/N] ' "".format(
             opts.destination_path
@@ -136,18 +462,30 @@ def main():
             print("Aborting")
             exit(1)
 
-    if len(os.listdir(opts.destination_path)) > 0:
+    # processes reading the directory must not see it half-written
+    install_lock = acquire_install_lock(opts.destination_path)
+
+    # a versioned install is written in a new version directory, made current once it is complete
+    versioned = opts.versioned or is_versioned(opts.destination_path)
+
+    if not is_versioned(opts.destination_path) and \
+            len([f for f in os.listdir(opts.destination_path) if f != LOCK_FILENAME]) > 0:
         msg = 'Directory "{}" is not empty; should I empty it? [y/N] ' "".format(
             opts.destination_path
         )
         empty = input(msg).lower().strip() == "y"
         if empty:
-            shutil.rmtree(opts.destination_path)
-            os.mkdir(opts.destination_path)
+            empty_directory(opts.destination_path)
         else:
             print("Aborting")
             exit(1)
 
+    destination_path = opts.destination_path
+    if versioned:
+        version = new_version_name()
+        destination_path = version_path(opts.destination_path, version)
+        mkdir(destination_path)
+
     if opts.normalize_unicode:
         try:
             unidecode
@@ -160,25 +498,48 @@ def main():
             print(err, file=sys.stderr)
             exit(1)
 
-        flag_fp = os.path.join(opts.destination_path, "normalize-unicode.flag")
+        flag_fp = os.path.join(destination_path, "normalize-unicode.flag")
         open(flag_fp, "w").close()
 
-    flag_fp = os.path.join(opts.destination_path, "database_backend.flag")
+    if opts.compress_records and opts.record_format != "compact":
+        print("`--compress-records` requires `--record-format compact`", file=sys.stderr)
+        exit(1)
+    if opts.symspell and (opts.symspell_max_length < 1 or opts.symspell_max_distance < 1):
+        print("`--symspell-max-length` and `--symspell-max-distance` must be positive", file=sys.stderr)
+        exit(1)
+
+    flag_fp = os.path.join(destination_path, "database_backend.flag")
     with open(flag_fp, "w") as f:
         f.write(opts.database_backend)
+    flag_fp = os.path.join(destination_path, "record-format.flag")
+    with open(flag_fp, "w") as f:
+        f.write(opts.record_format)
 
-    drugbank_path = os.path.join(opts.drugbank_filepath)
-    drugbank_schema = os.path.join(opts.drugbank_schema_filepath)
-    simstring_dir = os.path.join(opts.destination_path, "drugbank-simstring.db")
-    drugbank_db_dir = os.path.join(opts.destination_path, "drugbank-db.db")
+    simstring_dir = os.path.join(destination_path, "drugbank-simstring.db")
+    drugbank_db_dir = os.path.join(destination_path, "drugbank-db.db")
 
-    drugbank_iterator = extract_from_drugbank(drugbank_path, drugbank_schema, opts)
+    drugbank_iterator = _extract(opts)
     parse_and_encode_ngrams(
         drugbank_iterator,
         simstring_dir,
         drugbank_db_dir,
-        database_backend=opts.database_backend
+        database_backend=opts.database_backend,
+        manifest_fp=os.path.join(destination_path, "drugbank-hashes.json"),
+        sparse_index=opts.sparse_index,
+        record_format=opts.record_format,
+        compress_records=opts.compress_records
     )
+    if opts.symspell:
+        write_symspell_index(
+            os.path.join(destination_path, "drugbank-symspell.db"),
+            read_drug_hashes(os.path.join(destination_path, "drugbank-hashes.json")),
+            database_backend=opts.database_backend,
+            max_term_length=opts.symspell_max_length,
+            max_distance=opts.symspell_max_distance
+        )
+    if versioned:
+        publish_version(opts.destination_path, version, keep=opts.keep_versions)
+    install_lock.release()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,376 @@
+import argparse
+import hashlib
+import json
+import logging
+import multiprocessing
+import os
+import sys
+import time
+
+from drugfinder.utils import mkdir
+
+JOB_FILENAME = "job.json"
+INPUTS_DIRNAME = "inputs"
+DEFAULT_PARTITIONS = 64
+DEFAULT_BATCH_SIZE = 64
+
+
+def parse_args():
+    ap = argparse.ArgumentParser(
+        description="Matches a corpus partition by partition, so that an interrupted job resumes where it stopped"
+    )
+    ap.add_argument(
+        "drugbank_fp",
+        help="Location where DrugBank was installed"
+    )
+    ap.add_argument(
+        "output_path",
+        help="Directory of the job: partition outputs, checkpoints and the job configuration"
+    )
+    ap.add_argument(
+        "input_filepaths",
+        nargs="*",
+        help="JSONL files with a `text` field (and optionally an `id` field), or text files with one document "
+             "per line; only needed when the job is created"
+    )
+    ap.add_argument(
+        "-p",
+        "--partitions",
+        type=int,
+        default=None,
+        help="Number of partitions the documents are hashed into, by id (default: {})".format(DEFAULT_PARTITIONS)
+    )
+    ap.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=1,
+        help="Number of worker processes, each matching one partition at a time"
+    )
+    ap.add_argument(
+        "--slice",
+        default="0/1",
+        help="`i/k` to only process the partitions whose number modulo k is i, e.g. on one of k machines"
+    )
+    ap.add_argument(
+        "--threshold",
+        type=float,
+        default=0.7,
+        help="Minimum similarity between strings"
+    )
+    ap.add_argument(
+        "--window",
+        type=int,
+        default=5,
+        help="Maximum amount of tokens to consider for matching"
+    )
+    ap.add_argument(
+        "--similarity-name",
+        choices=("dice", "jaccard", "cosine", "overlap"),
+        default="cosine",
+        help="Similarity measure for string comparison"
+    )
+    ap.add_argument(
+        "--tokenizer",
+        choices=("spacy", "rule"),
+        default="spacy",
+        help="`rule` does not load any spaCy model and implies `--ignore-syntax`"
+    )
+    ap.add_argument(
+        "--ignore-syntax",
+        action="store_true",
+        help="Ignore the syntax when creating n-grams"
+    )
+    ap.add_argument(
+        "--all-matches",
+        action="store_true",
+        help="Keep every candidate instead of the best non-overlapping matches"
+    )
+    ap.add_argument(
+        "--with-data",
+        action="store_true",
+        help="Include the drug records in the output; by default only drugbank ids are written"
+    )
+    ap.add_argument(
+        "--batch-size",
+        type=int,
+        default=DEFAULT_BATCH_SIZE,
+        help="Number of texts matched at once; unlike the matcher options, it can change when a job is resumed"
+    )
+    ap.add_argument(
+        "--merge",
+        metavar="FILEPATH",
+        help="Concatenate the outputs of the finished partitions, in partition order, into a JSONL file"
+    )
+    opts = ap.parse_args()
+    return opts
+
+
+def partition_of(doc_id, n_partitions):
+    """Returns the partition of a document; it only depends on its id and on the number of partitions."""
+    digest = hashlib.sha1("{}".format(doc_id).encode("utf-8")).digest()
+    return int.from_bytes(digest[:8], "big") % n_partitions
+
+
+def read_documents(input_filepaths):
+    """Yields the (id, text) of the documents of the input files.
+
+    Documents of JSONL files without an `id` field, and lines of text files, are identified by the name
+    of their file and their line number.
+    """
+    for input_fp in input_filepaths:
+        name = os.path.basename(input_fp)
+        is_jsonl = input_fp.endswith(".jsonl")
+        with open(input_fp, encoding="utf-8") as f:
+            for line_number, line in enumerate(f, 1):
+                line = line.rstrip("\n")
+                if len(line.strip()) == 0:
+                    continue
+                if not is_jsonl:
+                    yield "{}:{}".format(name, line_number), line
+                    continue
+                record = json.loads(line)
+                yield record.get("id", "{}:{}".format(name, line_number)), record["text"]
+
+
+def partition_filepath(output_path, partition):
+    return os.path.join(output_path, "partition-{:05d}.jsonl".format(partition))
+
+
+def checkpoint_filepath(output_path, partition):
+    return os.path.join(output_path, "partition-{:05d}.done.json".format(partition))
+
+
+def input_filepath(output_path, partition):
+    return os.path.join(output_path, INPUTS_DIRNAME, "partition-{:05d}.jsonl".format(partition))
+
+
+def is_done(output_path, partition):
+    return os.path.exists(checkpoint_filepath(output_path, partition))
+
+
+def _write_atomic(filepath, lines):
+    # written aside and renamed: a partition file is either complete or absent
+    tmp_fp = "{}.{}.tmp".format(filepath, os.getpid())
+    with open(tmp_fp, "w", encoding="utf-8") as f:
+        for line in lines:
+            f.write(line)
+            f.write("\n")
+    os.replace(tmp_fp, filepath)
+
+
+def load_job(output_path, input_filepaths=None, n_partitions=None, options=None):
+    """Creates the job in `output_path`, or reads the configuration of the job already there.
+
+    The input files, number of partitions and matcher options of a job cannot change once it is created,
+    since finished partitions would no longer match the others. The documents are split into the input
+    files of the partitions when the job is created, so that resumed runs do not read the inputs again;
+    a ValueError is raised if two documents have the same id.
+    """
+    job_fp = os.path.join(output_path, JOB_FILENAME)
+    requested = {
+        "inputs": [os.path.abspath(fp) for fp in input_filepaths] if input_filepaths else None,
+        "partitions": n_partitions,
+        "options": options,
+    }
+    if os.path.exists(job_fp):
+        with open(job_fp) as f:
+            job = json.load(f)
+        # jobs created before the batch size became an option of each run
+        job["options"].pop("batch_size", None)
+        for key, value in requested.items():
+            if value is not None and value != job[key]:
+                raise ValueError('The {} of the job in "{}" are {}, not {}'.format(key, output_path, job[key], value))
+        return job
+
+    if requested["inputs"] is None:
+        raise ValueError('"{}" has no job yet; give its input files'.format(output_path))
+    if requested["partitions"] is None:
+        requested["partitions"] = DEFAULT_PARTITIONS
+    mkdir(output_path)
+    split_inputs(requested, output_path, range(requested["partitions"]))
+    _write_atomic(job_fp, [json.dumps(requested, indent=2)])
+    return requested
+
+
+def split_inputs(job, output_path, partitions):
+    """Writes the documents of the given partitions to their input files, reading the inputs once.
+
+    Partitions whose input file was already written are skipped. Raises a ValueError, without writing
+    any input file, if two documents have the same id.
+    """
+    mkdir(os.path.join(output_path, INPUTS_DIRNAME))
+    partitions = [p for p in partitions if not os.path.exists(input_filepath(output_path, p))]
+    if len(partitions) == 0:
+        return
+
+    # each partition is streamed to a temporary file, renamed once the inputs are read
+    files = {p: open("{}.{}.tmp".format(input_filepath(output_path, p), os.getpid()), "w", encoding="utf-8")
+             for p in partitions}
+    # ids are compared as partitioned: as strings
+    seen_ids = set()
+    try:
+        for doc_id, text in read_documents(job["inputs"]):
+            key = "{}".format(doc_id)
+            if key in seen_ids:
+                raise ValueError('Document id "{}" appears more than once in the inputs of the job; '
+                                 'ids must be unique'.format(doc_id))
+            seen_ids.add(key)
+            f = files.get(partition_of(doc_id, job["partitions"]))
+            if f is not None:
+                f.write(json.dumps({"id": doc_id, "text": text}))
+                f.write("\n")
+    except BaseException:
+        for f in files.values():
+            f.close()
+            os.remove(f.name)
+        raise
+    for f in files.values():
+        f.close()
+    for partition, f in files.items():
+        os.replace(f.name, input_filepath(output_path, partition))
+
+
+_matcher = None
+
+
+def _init_worker(drugbank_fp, options):
+    global _matcher
+    # only the workers load the spaCy pipeline and the installed files
+    from drugfinder.core import DrugFinder
+    _matcher = DrugFinder(drugbank_fp,
+                          threshold=options["threshold"],
+                          window=options["window"],
+                          similarity_name=options["similarity_name"],
+                          tokenizer=options["tokenizer"],
+                          read_only=True)
+
+
+def run_partition(output_path, partition, options, batch_size=DEFAULT_BATCH_SIZE):
+    """Matches the documents of a partition, then writes its output and its checkpoint.
+
+    Returns:
+        Dict: the content of the checkpoint: number of documents and of matches, and elapsed seconds.
+    """
+    start = time.time()
+    with open(input_filepath(output_path, partition), encoding="utf-8") as f:
+        documents = [json.loads(line) for line in f]
+
+    results = _matcher.match_many([document["text"] for document in documents],
+                                  best_match=not options["all_matches"],
+                                  ignore_syntax=options["ignore_syntax"],
+                                  batch_size=batch_size)
+    lines = []
+    for document, matches in zip(documents, results):
+        if not options["with_data"]:
+            matches = [[{k: v for k, v in match.items() if k != "data"} for match in group] for group in matches]
+        lines.append(json.dumps({"id": document["id"], "matches": matches}))
+    _write_atomic(partition_filepath(output_path, partition), lines)
+
+    checkpoint = {
+        "partition": partition,
+        "documents": len(documents),
+        "matches": sum(len(matches) for matches in results),
+        "seconds": time.time() - start,
+    }
+    _write_atomic(checkpoint_filepath(output_path, partition), [json.dumps(checkpoint)])
+    return checkpoint
+
+
+def _run_partition(args):
+    return run_partition(*args)
+
+
+def run_job(drugbank_fp, output_path, partitions, options, jobs=1, batch_size=DEFAULT_BATCH_SIZE):
+    """Runs the given partitions of a job that are not done yet, with `jobs` worker processes.
+
+    Returns:
+        List: the checkpoints of the partitions run.
+    """
+    job = load_job(output_path)
+    pending = [p for p in partitions if not is_done(output_path, p)]
+    logging.info("{:,} of {:,} partitions to run".format(len(pending), len(partitions)))
+    if len(pending) == 0:
+        return []
+    # only jobs created before the inputs were split at creation read them here
+    split_inputs(job, output_path, pending)
+
+    tasks = [(output_path, partition, options, batch_size) for partition in pending]
+    checkpoints = []
+    with multiprocessing.Pool(jobs, initializer=_init_worker, initargs=(drugbank_fp, options)) as pool:
+        for checkpoint in pool.imap_unordered(_run_partition, tasks):
+            logging.info("Partition {partition}: {documents:,} documents, {matches:,} matches in "
+                         "{seconds:.2f} s".format(**checkpoint))
+            checkpoints.append(checkpoint)
+    return checkpoints
+
+
+def merge_outputs(output_path, destination_fp):
+    """Concatenates the outputs of the partitions of a job, in partition order, into one JSONL file.
+
+    Returns:
+        Int: number of partitions merged; partitions that are not done are skipped.
+    """
+    job = load_job(output_path)
+    merged = 0
+    tmp_fp = destination_fp + ".tmp"
+    with open(tmp_fp, "w", encoding="utf-8") as out:
+        for partition in range(job["partitions"]):
+            if not is_done(output_path, partition):
+                continue
+            with open(partition_filepath(output_path, partition), encoding="utf-8") as f:
+                for line in f:
+                    out.write(line)
+            merged += 1
+    os.replace(tmp_fp, destination_fp)
+    return merged
+
+
+def parse_slice(value):
+    i, k = (int(x) for x in value.split("/"))
+    if k < 1 or not 0 <= i < k:
+        raise ValueError("`--slice` must be i/k with 0 <= i < k")
+    return i, k
+
+
+def main():
+    opts = parse_args()
+
+    if opts.merge is not None:
+        merged = merge_outputs(opts.output_path, opts.merge)
+        print("{:,} partitions merged into {}".format(merged, opts.merge))
+        return
+
+    if (opts.partitions is not None and opts.partitions < 1) or opts.jobs < 1:
+        print("`--partitions` and `--jobs` must be positive", file=sys.stderr)
+        exit(1)
+
+    options = {
+        "threshold": opts.threshold,
+        "window": opts.window,
+        "similarity_name": opts.similarity_name,
+        "tokenizer": opts.tokenizer,
+        "ignore_syntax": opts.ignore_syntax or opts.tokenizer == "rule",
+        "all_matches": opts.all_matches,
+        "with_data": opts.with_data,
+    }
+    try:
+        i, k = parse_slice(opts.slice)
+        job = load_job(opts.output_path, opts.input_filepaths, opts.partitions, options)
+    except ValueError as err:
+        print(err, file=sys.stderr)
+        exit(1)
+
+    start = time.time()
+    partitions = [p for p in range(job["partitions"]) if p % k == i]
+    checkpoints = run_job(opts.drugbank_fp, opts.output_path, partitions, job["options"], jobs=opts.jobs,
+                          batch_size=opts.batch_size)
+    done = sum(1 for p in partitions if is_done(opts.output_path, p))
+    msg = "{:,} partitions run ({:,} documents) in {:.2f} s; {:,} of {:,} partitions of this slice done".format(
+        len(checkpoints), sum(c["documents"] for c in checkpoints), time.time() - start, done, len(partitions))
+    logging.info(msg)
+    print(msg)
+
+
+if __name__ == "__main__":
+    main()
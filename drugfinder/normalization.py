@@ -0,0 +1,76 @@
+import unicodedata
+
+from unidecode import unidecode
+
+# the lowercase of a capital sigma depends on the letters around it, so it cannot be computed piecewise
+_CONTEXTUAL_LOWERCASE = "Σ"
+
+
+def transliterate(text, normalize_unicode=False):
+    """Returns the text the similarity of an n-gram is computed on: its closest ASCII form with `normalize_unicode`."""
+    if not normalize_unicode or text.isascii():
+        return text
+    return unidecode(text)
+
+
+def normalize_term(text, normalize_unicode=False):
+    """Returns the form under which terms are installed and looked up: transliterated, lowercased, then NFKD.
+
+    ASCII texts are only lowercased, since transliteration and NFKD leave them unchanged.
+    """
+    if text.isascii():
+        return text.lower()
+    return unicodedata.normalize("NFKD", transliterate(text, normalize_unicode).lower())
+
+
+class NormalizedText(object):
+    """Transliterated and normalized forms of a whole text, computed once for all of its n-grams.
+
+    The forms of a slice of the text are read with offset maps from the characters of the text to the
+    ones of each form. The text is normalized by clusters of a character and the combining characters
+    following it, so that NFKD gives the same result as on a whole n-gram. ASCII texts need no map.
+    """
+
+    def __init__(self, text, normalize_unicode=False):
+        self.text = text
+        self.is_ascii = text.isascii()
+        if self.is_ascii:
+            self.transliterated, self.normalized = text, text.lower()
+            self._offsets = None
+            return
+
+        self.transliterated, self.normalized = None, None
+        self._offsets = None
+        if _CONTEXTUAL_LOWERCASE in text:
+            return
+
+        transliterated, normalized = [], []
+        # offsets in both forms of the characters of the text that start a cluster, else None
+        offsets = [None] * (len(text) + 1)
+        transliterated_length, normalized_length = 0, 0
+        start = 0
+        for end in range(1, len(text) + 1):
+            if end < len(text) and unicodedata.combining(text[end]):
+                continue
+            offsets[start] = (transliterated_length, normalized_length)
+            cluster = transliterate(text[start:end], normalize_unicode)
+            transliterated.append(cluster)
+            normalized.append(normalize_term(cluster))
+            transliterated_length += len(cluster)
+            normalized_length += len(normalized[-1])
+            start = end
+        offsets[len(text)] = (transliterated_length, normalized_length)
+
+        self.transliterated, self.normalized = "".join(transliterated), "".join(normalized)
+        self._offsets = offsets
+
+    def get(self, start, end):
+        """Returns the transliterated and normalized forms of `text[start:end]`, or None if they cannot be
+        read from the ones of the whole text.
+        """
+        if self.is_ascii:
+            return self.transliterated[start:end], self.normalized[start:end]
+        if self._offsets is None or self._offsets[start] is None or self._offsets[end] is None:
+            return None
+        (t_start, n_start), (t_end, n_end) = self._offsets[start], self._offsets[end]
+        return self.transliterated[t_start:t_end], self.normalized[n_start:n_end]
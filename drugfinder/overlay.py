@@ -0,0 +1,213 @@
+import argparse
+import csv
+import json
+import logging
+import os
+import sys
+import time
+
+from drugfinder.utils import DrugBankDB, InstallLock, LOCK_FILENAME, empty_directory, mkdir
+from drugfinder.simstring import SimstringDBWriter, SimstringDBReader
+from drugfinder.prefixes import build_prefix_index
+from drugfinder.normalization import normalize_term
+
+# marks the directories written by `build_overlay`, which it may empty to build a new overlay
+OVERLAY_FLAG = "overlay.flag"
+
+
+def parse_args():
+    ap = argparse.ArgumentParser(
+        description="Builds a lexicon overlay that DrugFinder queries together with the DrugBank install"
+    )
+    ap.add_argument(
+        "lexicon_filepaths",
+        nargs="+",
+        help="CSV or JSONL files with `term`, `drugbank_id` and optionally `name` columns"
+    )
+    ap.add_argument(
+        "destination_path",
+        help="Location where the overlay files are installed"
+    )
+    ap.add_argument(
+        '-U',
+        '--normalize-unicode',
+        action='store_true',
+        help="Normalize unicode strings to their closes ASCII representation (use the same setting as the "
+             "DrugBank install)"
+    )
+    ap.add_argument(
+        "-d",
+        "--database-backend",
+        choices=("leveldb", "unqlite"),
+        default="unqlite",
+        help="Key-Value database used to store drugbank-ids and drug data",
+    )
+    opts = ap.parse_args()
+    return opts
+
+
+def read_lexicon(path):
+    """Reads the entries of a CSV (with header) or JSONL lexicon file.
+
+    Each entry must have a `term` and a `drugbank_id`; the id can be a DrugBank id or a custom id.
+    An optional `name` is used as the drug name for custom ids.
+    """
+    with open(path, encoding="utf-8") as f:
+        if path.endswith(".jsonl") or path.endswith(".json"):
+            rows = (json.loads(line) for line in f if len(line.strip()) > 0)
+        else:
+            rows = csv.DictReader(f)
+
+        for row in rows:
+            term, drugbank_id = row.get("term"), row.get("drugbank_id")
+            if not term or not drugbank_id:
+                logging.debug("Skipping invalid lexicon entry: %s", row)
+                continue
+            yield {"term": term.strip(), "drugbank_id": drugbank_id.strip(), "name": row.get("name") or None}
+
+
+def build_overlay(lexicon_filepaths, destination_path, database_backend="unqlite", normalize_unicode=False):
+    """Builds an overlay, replacing any overlay previously installed in `destination_path`.
+
+    Any other directory must be empty or missing: an IOError is raised instead of overwriting it.
+
+    The overlay has the same layout as a DrugBank install: a simstring index of the terms and a
+    key-value store mapping terms to ids. Drug records are stored for custom ids and for entries
+    with a `name`; other DrugBank ids are resolved against the base install at query time.
+    """
+    start = time.time()
+    mkdir(destination_path)
+    if not is_overlay(destination_path) and \
+            len([f for f in os.listdir(destination_path) if f != LOCK_FILENAME]) > 0:
+        raise IOError('"{}" is not empty and is not a lexicon overlay; refusing to overwrite it'.format(
+            destination_path))
+    install_lock = InstallLock(destination_path, exclusive=True)
+    empty_directory(destination_path)
+
+    open(os.path.join(destination_path, OVERLAY_FLAG), "w").close()
+    if normalize_unicode:
+        open(os.path.join(destination_path, "normalize-unicode.flag"), "w").close()
+    with open(os.path.join(destination_path, "database_backend.flag"), "w") as f:
+        f.write(database_backend)
+
+    simstring_dir = os.path.join(destination_path, "drugbank-simstring.db")
+    drugbank_db_dir = os.path.join(destination_path, "drugbank-db.db")
+    mkdir(simstring_dir)
+    mkdir(drugbank_db_dir)
+
+    simstring_db = SimstringDBWriter(simstring_dir, filename="drug-terms.simstring")
+    drugbank_db = DrugBankDB(drugbank_db_dir, database_backend=database_backend)
+
+    n_terms = 0
+    term_mapping = {}
+    for lexicon_fp in lexicon_filepaths:
+        for entry in read_lexicon(lexicon_fp):
+            drugbank_ids = term_mapping.setdefault(normalize_term(entry["term"], normalize_unicode), [])
+            if entry["drugbank_id"] not in drugbank_ids:
+                drugbank_ids.append(entry["drugbank_id"])
+            if entry["name"] is not None or not is_drugbank_id(entry["drugbank_id"]):
+                drugbank_db.insert_data(entry["drugbank_id"], {"name": entry["name"] or entry["term"]})
+            n_terms += 1
+
+    # each distinct term is indexed once and mapped to all the ids given for it
+    for term, drugbank_ids in term_mapping.items():
+        simstring_db.insert(term)
+        drugbank_db.insert_term(term, drugbank_ids)
+    simstring_db.close()
+    build_prefix_index(list(term_mapping), simstring_dir, filename="drug-terms.simstring")
+    drugbank_db.close()
+    install_lock.release()
+    logging.info("Overlay with {:,} terms built in {:.2f} s".format(n_terms, time.time() - start))
+    return n_terms
+
+
+def is_overlay(path):
+    return os.path.exists(os.path.join(path, OVERLAY_FLAG))
+
+
+def is_drugbank_id(drugbank_id):
+    return drugbank_id.startswith("DB") and drugbank_id[2:].isdigit()
+
+
+class LexiconOverlay(object):
+    """Read side of an overlay built with `build_overlay`."""
+
+    def __init__(self, path, similarity_name, threshold, read_only=False):
+        if not (os.path.exists(path) or os.path.isdir(path)):
+            err_msg = '"{}" is not a valid directory'.format(path)
+            raise IOError(err_msg)
+
+        # taken in every mode, so that the overlay is not rebuilt while it is open
+        self._install_lock = InstallLock(path)
+
+        database_backend_fp = os.path.join(path, "database_backend.flag")
+        if os.path.exists(database_backend_fp):
+            with open(database_backend_fp) as f:
+                database_backend = f.read().strip()
+        else:
+            database_backend = 'unqlite'
+
+        self.simstring_db = SimstringDBReader(path=os.path.join(path, "drugbank-simstring.db"),
+                                              similarity_name=similarity_name,
+                                              threshold=threshold,
+                                              filename='drug-terms.simstring',
+                                              read_only=read_only)
+        self.drugbank_db = DrugBankDB(path=os.path.join(path, "drugbank-db.db"),
+                                      database_backend=database_backend,
+                                      read_only=read_only)
+
+    def close(self):
+        self.simstring_db.close()
+        self.drugbank_db.close()
+        self._install_lock.release()
+
+    def get_all(self, term, base_drugbank_db):
+        """Returns the (drugbank_id, data) pairs of a term of the overlay.
+
+        The drug record of DrugBank ids is read from `base_drugbank_db` unless the overlay has its own.
+        """
+        return self.get_many([term], base_drugbank_db).get(term, [])
+
+    def get(self, term, base_drugbank_db):
+        """Returns the (drugbank_id, data) pair of the first id of a term of the overlay, or None."""
+        items = self.get_all(term, base_drugbank_db)
+        return items[0] if len(items) > 0 else None
+
+    def get_ids_many(self, terms, normalized=False):
+        """Returns the tuple of ids of each term of the overlay found among `terms`, without reading records."""
+        return self.drugbank_db.get_ids_many(terms, normalized)
+
+    def get_many(self, terms, base_drugbank_db, normalized=False):
+        """Returns the list of (drugbank_id, data) pairs of each term of the overlay found among `terms`.
+
+        The ids of all the terms are read at once, then the records the overlay has, then the other
+        ones from `base_drugbank_db`.
+        """
+        drugbank_ids = self.get_ids_many(terms, normalized)
+        all_ids = {drugbank_id for ids in drugbank_ids.values() for drugbank_id in ids}
+        records = self.drugbank_db.get_data_many(all_ids)
+        records.update(base_drugbank_db.get_data_many(all_ids.difference(records)))
+
+        drugs = {}
+        for term, ids in drugbank_ids.items():
+            items = [(drugbank_id, records[drugbank_id]) for drugbank_id in ids if drugbank_id in records]
+            if len(items) > 0:
+                drugs[term] = items
+        return drugs
+
+
+def main():
+    opts = parse_args()
+    try:
+        n_terms = build_overlay(opts.lexicon_filepaths,
+                                opts.destination_path,
+                                database_backend=opts.database_backend,
+                                normalize_unicode=opts.normalize_unicode)
+    except IOError as err:
+        print(err, file=sys.stderr)
+        exit(1)
+    print("Overlay with {:,} terms installed in {}".format(n_terms, opts.destination_path))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+import json
+import os
+import re
+
+# tokens of the terms in the prefix index: runs of word characters and single symbols, which neither the
+# spaCy nor the rule tokenizer split further except for word/number boundaries
+_TOKEN_RE = re.compile(r"\w+|[^\w\s]")
+# number of distinct start tokens whose limit is memoized
+_CACHE_SIZE = 100000
+
+
+def count_tokens(text):
+    return len(_TOKEN_RE.findall(text))
+
+
+def prefix_keys(token, n=3):
+    """Returns the keys of a first token in the prefix index: its n-grams, or itself if it is shorter."""
+    if len(token) <= n:
+        return [token]
+    return [token[i:i + n] for i in range(len(token) - n + 1)]
+
+
+def prefix_index_filepath(path, filename):
+    return os.path.join(path, filename + ".prefixes.json")
+
+
+def build_prefix_index(terms, path, filename="drug-terms.simstring", n=3):
+    """Writes, next to the simstring database, the map from the n-grams of the first token of the terms to
+    the largest number of tokens of the terms starting with a token that has them.
+    """
+    index = {}
+    for term in terms:
+        tokens = _TOKEN_RE.findall(term)
+        if len(tokens) == 0:
+            continue
+        for key in prefix_keys(tokens[0], n):
+            index[key] = max(index.get(key, 0), len(tokens))
+
+    filepath = prefix_index_filepath(path, filename)
+    with open(filepath + ".tmp", "w") as f:
+        json.dump({"n": n, "max_tokens": index}, f)
+    os.replace(filepath + ".tmp", filepath)
+
+
+class PrefixIndex(object):
+    """Read side of `build_prefix_index`, used by `DrugFinder(prune_windows=True)`.
+
+    A token sharing no n-gram with the first token of any term cannot start a match, and a match starting
+    with it has no more tokens than the longest term whose first token shares one of its n-grams.
+    """
+
+    def __init__(self, path, filename="drug-terms.simstring"):
+        filepath = prefix_index_filepath(path, filename)
+        if not os.path.exists(filepath):
+            err_msg = '"{}" does not exist; the installation predates window pruning and must be ' \
+                      'reinstalled'.format(filepath)
+            raise IOError(err_msg)
+
+        with open(filepath) as f:
+            index = json.load(f)
+        self.n = index["n"]
+        self._max_tokens = index["max_tokens"]
+        self._cache = {}
+
+    def max_tokens(self, word):
+        """Returns the largest number of tokens of a term that could start with the normalized token `word`
+        of a text, 0 if none could.
+        """
+        try:
+            return self._cache[word]
+        except KeyError:
+            pass
+
+        if len(self._cache) >= _CACHE_SIZE:
+            self._cache.clear()
+        tokens = _TOKEN_RE.findall(word)
+        limit = 0
+        if len(tokens) > 0:
+            limit = max(self._max_tokens.get(key, 0) for key in prefix_keys(tokens[0], self.n))
+        self._cache[word] = limit
+        return limit
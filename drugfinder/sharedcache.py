@@ -0,0 +1,244 @@
+import fcntl
+import hashlib
+import os
+import pickle
+import struct
+import tempfile
+import threading
+import time
+from multiprocessing import resource_tracker, shared_memory
+
+MAGIC = b"DFSHM001"
+# magic, number of slots, slot size, then the host-wide hits, misses, inserts, evictions and oversized values
+_HEADER = struct.Struct("<8sQQQQQQQ")
+_HEADER_SIZE = 128
+_COUNTERS = ("hits", "misses", "inserts", "evictions", "oversized")
+# sequence number (odd while the slot is written), reference bit, key hash and length of the payload
+_SLOT = struct.Struct("<IB3xQI")
+# slots of a bucket, among which a key can be stored
+WAYS = 4
+# writers lock one of these byte ranges of the lock file, chosen by bucket; the last one guards the counters
+N_STRIPES = 64
+DEFAULT_SLOTS = 65536
+DEFAULT_SLOT_SIZE = 1024
+# number of lookups after which a process adds its counters to the host-wide ones
+_FLUSH_INTERVAL = 4096
+
+
+def _key_hash(key):
+    # 0 marks the empty slots
+    digest = hashlib.blake2b(key.encode("utf-8", "surrogatepass"), digest_size=8).digest()
+    return int.from_bytes(digest, "little") or 1
+
+
+def _open_shared_memory(name, size):
+    try:
+        shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+        created = True
+    except FileExistsError:
+        shm = shared_memory.SharedMemory(name=name)
+        created = False
+    # the segment outlives the processes using it: it is only removed by `unlink`
+    resource_tracker.unregister(shm._name, "shared_memory")
+    return shm, created
+
+
+class SharedCache(object):
+    """Fixed-size hash table in shared memory, shared by all the processes of a host that open the same name.
+
+    Each key hashes to a bucket of `WAYS` slots of `slot_size` bytes, holding the pickled key and value.
+    Readers take no lock: a slot has a sequence number that writers make odd while they write it, and a
+    read is discarded if the number was odd or changed meanwhile. Writers lock the stripe of their bucket
+    with a byte-range lock of a file next to the segment. When a bucket is full, the first slot not
+    referenced since the last eviction pass over it is replaced (CLOCK eviction). Values that do not fit
+    in a slot are not cached.
+
+    Hits, misses, inserts, evictions and oversized values are counted by each process, and added to the
+    host-wide counters of the segment every `_FLUSH_INTERVAL` lookups and when `stats` is read.
+
+    The segment stays in memory until `unlink` is called, even when no process uses it.
+    """
+
+    def __init__(self, name, n_slots=DEFAULT_SLOTS, slot_size=DEFAULT_SLOT_SIZE):
+        assert n_slots >= WAYS and slot_size > _SLOT.size, "the shared cache is too small"
+        self.name = name
+        n_slots -= n_slots % WAYS
+        self.shm, created = _open_shared_memory(name, _HEADER_SIZE + n_slots * slot_size)
+        self.buf = self.shm.buf
+
+        self._lock_file = open(os.path.join(tempfile.gettempdir(), "{}.lock".format(name)), "a+b")
+        # byte-range locks only exclude other processes
+        self._thread_lock = threading.Lock()
+        if created:
+            _HEADER.pack_into(self.buf, 0, MAGIC, n_slots, slot_size, 0, 0, 0, 0, 0)
+        else:
+            # the creator may not have written the header yet
+            start = time.time()
+            while bytes(self.buf[:len(MAGIC)]) != MAGIC:
+                if time.time() - start > 5.:
+                    raise IOError('"{}" is not a shared cache'.format(name))
+                time.sleep(0.01)
+        _, self.n_slots, self.slot_size, *_ = _HEADER.unpack_from(self.buf, 0)
+        self.n_buckets = self.n_slots // WAYS
+        self._counters = dict.fromkeys(_COUNTERS, 0)
+        self._lookups = 0
+
+    def close(self):
+        self.flush_stats()
+        self.buf.release()
+        self.buf = None
+        self.shm.close()
+        self._lock_file.close()
+
+    def unlink(self):
+        """Removes the segment from the host; processes that opened it can use it until they close it."""
+        # `SharedMemory.unlink` also unregisters the segment from the resource tracker
+        resource_tracker.register(self.shm._name, "shared_memory")
+        self.shm.unlink()
+        try:
+            os.remove(self._lock_file.name)
+        except FileNotFoundError:
+            pass
+
+    def _slot_offset(self, slot):
+        return _HEADER_SIZE + slot * self.slot_size
+
+    def _locked(self, stripe):
+        return _StripeLock(self, stripe)
+
+    def flush_stats(self):
+        """Adds the counters of this process to the host-wide ones."""
+        if not any(self._counters.values()):
+            return
+        with self._locked(N_STRIPES - 1):
+            header = list(_HEADER.unpack_from(self.buf, 0))
+            for i, name in enumerate(_COUNTERS):
+                header[3 + i] += self._counters[name]
+            _HEADER.pack_into(self.buf, 0, *header)
+        self._counters = dict.fromkeys(_COUNTERS, 0)
+
+    @property
+    def stats(self):
+        """Host-wide counters of the cache, with its geometry."""
+        self.flush_stats()
+        counters = dict(zip(_COUNTERS, _HEADER.unpack_from(self.buf, 0)[3:]))
+        lookups = counters["hits"] + counters["misses"]
+        puts = counters["inserts"] + counters["oversized"]
+        counters.update({
+            "hit_rate": counters["hits"] / lookups if lookups > 0 else 0.,
+            # share of the values that could not be cached
+            "oversized_rate": counters["oversized"] / puts if puts > 0 else 0.,
+            "slots": self.n_slots,
+            "slot_size": self.slot_size,
+        })
+        return counters
+
+    def _read(self, slot, key, key_hash):
+        offset = self._slot_offset(slot)
+        seq, _, slot_hash, length = _SLOT.unpack_from(self.buf, offset)
+        if slot_hash != key_hash or seq % 2 == 1:
+            return False, None
+        payload = bytes(self.buf[offset + _SLOT.size:offset + _SLOT.size + length])
+        if _SLOT.unpack_from(self.buf, offset)[0] != seq:
+            return False, None
+        try:
+            slot_key, value = pickle.loads(payload)
+        except Exception:
+            return False, None
+        if slot_key != key:
+            return False, None
+        # the reference bit is only a hint to the eviction: concurrent updates do not matter
+        self.buf[offset + 4] = 1
+        return True, value
+
+    def get(self, key):
+        """Returns whether the key was found, and its value."""
+        key_hash = _key_hash(key)
+        bucket = key_hash % self.n_buckets
+        for slot in range(bucket * WAYS, bucket * WAYS + WAYS):
+            found, value = self._read(slot, key, key_hash)
+            if found:
+                self._count("hits")
+                return True, value
+        self._count("misses")
+        return False, None
+
+    def _count(self, name):
+        self._counters[name] += 1
+        self._lookups += 1
+        if self._lookups % _FLUSH_INTERVAL == 0:
+            self.flush_stats()
+
+    def put(self, key, value):
+        """Stores the value of a key, replacing a slot of its bucket if it is full. Returns whether it fits."""
+        payload = pickle.dumps((key, value), protocol=pickle.HIGHEST_PROTOCOL)
+        if len(payload) > self.slot_size - _SLOT.size:
+            self._counters["oversized"] += 1
+            return False
+
+        key_hash = _key_hash(key)
+        bucket = key_hash % self.n_buckets
+        with self._locked(bucket % (N_STRIPES - 1)):
+            slots = range(bucket * WAYS, bucket * WAYS + WAYS)
+            target = None
+            for slot in slots:
+                slot_hash = _SLOT.unpack_from(self.buf, self._slot_offset(slot))[2]
+                if slot_hash == key_hash or slot_hash == 0:
+                    target = slot
+                    break
+            if target is None:
+                # CLOCK: the reference bits of the slots passed over are cleared
+                for slot in slots:
+                    offset = self._slot_offset(slot)
+                    if self.buf[offset + 4] == 0:
+                        target = slot
+                        break
+                    self.buf[offset + 4] = 0
+                if target is None:
+                    target = slots[0]
+                self._counters["evictions"] += 1
+
+            offset = self._slot_offset(target)
+            seq = _SLOT.unpack_from(self.buf, offset)[0]
+            _SLOT.pack_into(self.buf, offset, seq + 1, 0, 0, 0)
+            self.buf[offset + _SLOT.size:offset + _SLOT.size + len(payload)] = payload
+            _SLOT.pack_into(self.buf, offset, (seq + 2) % (1 << 32), 1, key_hash, len(payload))
+        self._counters["inserts"] += 1
+        return True
+
+    def get_many(self, keys, compute_many, namespace=""):
+        """Returns the values of the keys, computing the missing ones at once with `compute_many`.
+
+        Args:
+            keys (list): keys to look up.
+            compute_many (callable): returns the list of the values of a list of keys.
+            namespace (str, optional): prefix of the keys in the cache, e.g. the options and the version
+                of the index the values come from. Defaults to none.
+        """
+        values, missing = {}, []
+        for key in dict.fromkeys(keys):
+            found, value = self.get(namespace + key)
+            if found:
+                values[key] = value
+            else:
+                missing.append(key)
+
+        if len(missing) > 0:
+            for key, value in zip(missing, compute_many(missing)):
+                values[key] = value
+                self.put(namespace + key, value)
+        return [values[key] for key in keys]
+
+
+class _StripeLock(object):
+    def __init__(self, cache, stripe):
+        self.cache = cache
+        self.stripe = stripe
+
+    def __enter__(self):
+        self.cache._thread_lock.acquire()
+        fcntl.lockf(self.cache._lock_file, fcntl.LOCK_EX, 1, self.stripe)
+
+    def __exit__(self, *args):
+        fcntl.lockf(self.cache._lock_file, fcntl.LOCK_UN, 1, self.stripe)
+        self.cache._thread_lock.release()
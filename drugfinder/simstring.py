@@ -3,7 +3,8 @@ from __future__ import division, print_function, unicode_literals
 import os
 
 from quickumls_simstring import simstring
-from drugfinder.utils import safe_unicode
+from drugfinder.utils import safe_unicode, InstallLock
+from drugfinder.normalization import normalize_term
 
 
 class SimstringDBWriter(object):
@@ -29,19 +30,37 @@ class SimstringDBWriter(object):
         term = safe_unicode(term)
         self.db.insert(term)
 
+    def close(self):
+        self.db.close()
+
 
 class SimstringDBReader(object):
-    def __init__(self, path, similarity_name, threshold, filename="umls-terms.simstring"):
+    def __init__(self, path, similarity_name, threshold, filename="umls-terms.simstring", read_only=False):
         if not (os.path.exists(path)) or not (os.path.isdir(path)):
             err_msg = '"{}" does not exists or it is not a directory.'.format(path)
             raise IOError(err_msg)
 
+        # the reader never writes; in read-only mode it also makes sure no installer is running
+        self._install_lock = None
+        if read_only:
+            self._install_lock = InstallLock(os.path.dirname(os.path.abspath(path)))
+
         self.db = simstring.reader(
             os.path.join(path, filename)
         )
         self.db.measure = getattr(simstring, similarity_name)
         self.db.threshold = threshold
 
-    def get(self, term):
-        term = safe_unicode(term.lower())
+    def get(self, term, normalized=False):
+        """Returns the indexed terms similar to a term; `normalized` terms are looked up as they are."""
+        if not normalized:
+            term = normalize_term(term)
         return self.db.retrieve(term)
+
+    def get_many(self, terms, normalized=False):
+        return [self.get(term, normalized) for term in terms]
+
+    def close(self):
+        self.db.close()
+        if self._install_lock is not None:
+            self._install_lock.release()
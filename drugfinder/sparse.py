@@ -0,0 +1,253 @@
+from __future__ import division
+
+import os
+
+import numpy
+
+from drugfinder.simstring import SimstringDBReader
+from drugfinder.utils import safe_unicode
+from drugfinder.normalization import normalize_term
+
+try:
+    import scipy.sparse
+    SCIPY_AVAILABLE = True
+except ImportError:
+    SCIPY_AVAILABLE = False
+
+# simstring pads strings shorter than n with this mark
+_MARK = "\x01"
+# upper bound on the number of (query, term) candidate pairs checked at once
+_BLOCK_PAIRS = 500000
+
+
+def _ngram_counts(term, n):
+    if len(term) < n:
+        term = term + _MARK * (n - len(term))
+
+    counts = {}
+    for i in range(len(term) - n + 1):
+        ngram = term[i:i + n]
+        counts[ngram] = counts.get(ngram, 0) + 1
+    return counts
+
+
+def _features(counts):
+    features = []
+    for ngram in sorted(counts):
+        features.append(ngram)
+        features.extend("{}{}".format(ngram, i) for i in range(2, counts[ngram] + 1))
+    return features
+
+
+def simstring_features(term, n=3):
+    """Returns the n-gram features simstring extracts from a term (without begin/end marks).
+
+    N-grams occurring more than once are made unique by appending their occurrence number.
+    """
+    return _features(_ngram_counts(term, n))
+
+
+def sparse_index_filepath(path, filename):
+    return os.path.join(path, filename + ".sparse.npz")
+
+
+def build_sparse_index(terms, path, filename="drug-terms.simstring", n=3):
+    """Writes the term x n-gram matrix used by `SparseDBReader`, next to the simstring database.
+
+    `terms` must be given in the order they were inserted in the simstring database.
+    """
+    vocabulary = {}
+    indptr, indices = [0], []
+    normalized_terms = []
+    for term in terms:
+        term = safe_unicode(term)
+        normalized_terms.append(term)
+        indices.extend(vocabulary.setdefault(feature, len(vocabulary)) for feature in simstring_features(term, n))
+        indptr.append(len(indices))
+
+    numpy.savez(
+        sparse_index_filepath(path, filename),
+        n=numpy.array(n),
+        indptr=numpy.array(indptr, dtype=numpy.int64),
+        indices=numpy.array(indices, dtype=numpy.int32),
+        terms=numpy.array(normalized_terms, dtype=str),
+        features=numpy.array(sorted(vocabulary, key=vocabulary.get), dtype=str),
+    )
+
+
+def _min_size(similarity_name, qsize, alpha):
+    if similarity_name == "cosine":
+        return numpy.ceil(alpha * alpha * qsize)
+    elif similarity_name == "dice":
+        return numpy.ceil(alpha / (2. - alpha) * qsize)
+    elif similarity_name == "jaccard":
+        return numpy.ceil(alpha * qsize)
+    return numpy.ones_like(qsize)
+
+
+def _max_size(similarity_name, qsize, alpha):
+    if similarity_name == "cosine":
+        return numpy.floor(qsize / (alpha * alpha))
+    elif similarity_name == "dice":
+        return numpy.floor((2. - alpha) * qsize / alpha)
+    elif similarity_name == "jaccard":
+        return numpy.floor(qsize / alpha)
+    return numpy.full_like(qsize, numpy.inf)
+
+
+def _min_match(similarity_name, qsize, rsize, alpha):
+    if similarity_name == "cosine":
+        return numpy.ceil(alpha * numpy.sqrt(qsize * rsize))
+    elif similarity_name == "dice":
+        return numpy.ceil(0.5 * alpha * (qsize + rsize))
+    elif similarity_name == "jaccard":
+        return numpy.ceil(alpha * (qsize + rsize) / (1. + alpha))
+    return numpy.ceil(alpha * numpy.minimum(qsize, rsize))
+
+
+class SparseDBReader(object):
+    """Batch retrieval engine returning the same candidates as `SimstringDBReader`, sorted by size.
+
+    The n-grams of a batch of queries become a sparse query x feature matrix, which is multiplied by
+    the transposed term x feature matrix built at install time. As in simstring, a term can only reach
+    the minimum overlap `t` with a query of `q` features if it has one of any `q - t + 1` of them, so only
+    the rarest ones are multiplied to generate the candidate pairs. The exact overlap of the candidates
+    is then computed and the similarity thresholds of simstring are applied to all pairs at once.
+
+    Queries repeating an n-gram (e.g. `ivermectinivermectin`) are not scored by simstring as plain
+    feature sets, so they are passed on to the simstring database; they are rare in running text.
+    """
+
+    def __init__(self, path, similarity_name, threshold, filename="umls-terms.simstring", read_only=False):
+        if not SCIPY_AVAILABLE:
+            raise ImportError(
+                "The sparse retrieval engine needs scipy, which is not installed. Please install it via "
+                "`pip install drugfinder[sparse]` or `pip install scipy`, or use `retrieval_engine='simstring'`"
+            )
+        self._simstring_db = SimstringDBReader(path, similarity_name, threshold, filename=filename,
+                                               read_only=read_only)
+        filepath = sparse_index_filepath(path, filename)
+        if not os.path.exists(filepath):
+            err_msg = '"{}" does not exist; install DrugBank with `--sparse-index`'.format(filepath)
+            raise IOError(err_msg)
+
+        self.similarity_name = similarity_name
+        self.threshold = threshold
+
+        with numpy.load(filepath, allow_pickle=False) as index:
+            self.n = int(index["n"])
+            self.terms = index["terms"].tolist()
+            indptr, indices = index["indptr"], index["indices"]
+            self._features = {feature: i for i, feature in enumerate(index["features"].tolist())}
+
+        self._matrix = scipy.sparse.csr_matrix(
+            (numpy.ones(len(indices), dtype=numpy.int32), indices, indptr),
+            shape=(len(self.terms), len(self._features)),
+        )
+        self._matrix_t = self._matrix.T.tocsr()
+        self._term_sizes = numpy.diff(indptr).astype(numpy.float64)
+        self._posting_sizes = numpy.diff(self._matrix_t.indptr).tolist()
+
+    def close(self):
+        self._simstring_db.close()
+
+    def get(self, term, normalized=False):
+        return self.get_many([term], normalized)[0]
+
+    def get_many(self, terms, normalized=False):
+        """Returns, for each term, the tuple of indexed terms similar to it.
+
+        `normalized` terms are looked up as they are.
+        """
+        # n-grams repeat a lot in running text; each distinct one is a single row of the query matrix
+        unique_terms = list(dict.fromkeys(terms))
+        results = dict(zip(unique_terms, self._get_unique(unique_terms, normalized)))
+        return [results[term] for term in terms]
+
+    def _get_unique(self, terms, normalized=False):
+        alpha = self.threshold
+        query_features, query_sizes = [], []
+        repeating = []
+        for i, term in enumerate(terms):
+            if not normalized:
+                term = normalize_term(term)
+            if len(term) < self.n:
+                term = term + _MARK * (self.n - len(term))
+            ngrams = [term[j:j + self.n] for j in range(len(term) - self.n + 1)]
+            features = set(ngrams)
+            if len(features) < len(ngrams):
+                repeating.append(i)
+                features = set()
+            # features that no indexed term has still count in the size of the query
+            known = sorted((self._features[f] for f in features if f in self._features),
+                           key=self._posting_sizes.__getitem__)
+            query_sizes.append(len(features))
+            query_features.append(known)
+
+        # a term of the smallest size allowed needs the smallest overlap, which bounds the prefix length
+        query_sizes = numpy.array(query_sizes, dtype=numpy.float64)
+        min_overlap = _min_match(self.similarity_name, query_sizes,
+                                 _min_size(self.similarity_name, query_sizes, alpha), alpha)
+        n_unknown = query_sizes - numpy.array([len(known) for known in query_features])
+        n_prefix = (query_sizes - numpy.maximum(min_overlap, 1) + 1 - n_unknown).clip(min=0).astype(int).tolist()
+        prefix_features = [known[:n] for known, n in zip(query_features, n_prefix)]
+        suffix_features = [known[n:] for known, n in zip(query_features, n_prefix)]
+
+        prefixes = _csr_matrix(prefix_features, len(self._features))
+        suffixes = _csr_matrix(suffix_features, len(self._features))
+
+        # candidates are generated and checked by blocks of queries with at most `_BLOCK_PAIRS` of them
+        pairs = numpy.cumsum([sum(self._posting_sizes[f] for f in features) for features in prefix_features])
+        selected = [(numpy.zeros(0, dtype=numpy.int64),) * 2 + (numpy.zeros(0),)]
+        block_start = 0
+        while block_start < len(terms):
+            offset = pairs[block_start - 1] if block_start > 0 else 0
+            block_end = max(block_start + 1, int(numpy.searchsorted(pairs, offset + _BLOCK_PAIRS, side="right")))
+            rows, cols, rsize = self._select(
+                prefixes[block_start:block_end], suffixes[block_start:block_end], query_sizes[block_start:block_end]
+            )
+            selected.append((rows + block_start, cols, rsize))
+            block_start = block_end
+        rows, cols, rsize = (numpy.concatenate(column) for column in zip(*selected))
+
+        # by number of features like simstring; within a size simstring's order depends on the query
+        order = numpy.lexsort((cols, rsize, rows))
+        results = [[] for _ in terms]
+        for row, col in zip(rows[order].tolist(), cols[order].tolist()):
+            results[row].append(self.terms[col])
+        results = [tuple(result) for result in results]
+
+        for i in repeating:
+            results[i] = self._simstring_db.get(terms[i], normalized)
+        return results
+
+    def _select(self, prefixes, suffixes, query_sizes):
+        alpha = self.threshold
+        candidates = (prefixes @ self._matrix_t).tocoo()
+        rows, cols = candidates.row.astype(numpy.int64), candidates.col.astype(numpy.int64)
+        qsize, rsize = query_sizes[rows], self._term_sizes[cols]
+        min_match = _min_match(self.similarity_name, qsize, rsize, alpha)
+
+        # pairs that cannot reach the minimum overlap even sharing every other feature are dropped
+        n_suffix = numpy.diff(suffixes.indptr)[rows]
+        possible = (
+            (rsize >= _min_size(self.similarity_name, qsize, alpha))
+            & (rsize <= _max_size(self.similarity_name, qsize, alpha))
+            & (candidates.data + n_suffix >= min_match)
+        )
+        rows, cols, rsize = rows[possible], cols[possible], rsize[possible]
+
+        matches = candidates.data[possible] + numpy.asarray(
+            suffixes[rows].multiply(self._matrix[cols]).sum(axis=1)
+        ).ravel()
+        selected = matches >= min_match[possible]
+        return rows[selected], cols[selected], rsize[selected]
+
+
+def _csr_matrix(rows, n_columns):
+    indptr = numpy.cumsum([0] + [len(row) for row in rows])
+    indices = numpy.fromiter((i for row in rows for i in row), dtype=numpy.int32, count=indptr[-1])
+    return scipy.sparse.csr_matrix(
+        (numpy.ones(len(indices), dtype=numpy.int32), indices, indptr),
+        shape=(len(rows), n_columns),
+    )
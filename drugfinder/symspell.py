@@ -0,0 +1,195 @@
+import json
+import os
+import pickle
+
+from drugfinder.utils import safe_unicode, db_key_encode, mkdir, InstallLock, _open_leveldb, _leveldb_snapshot, \
+    _read_only
+from drugfinder.utils import UNQLITE_OPEN_READONLY, UNQLITE_OPEN_MMAP
+from drugfinder.normalization import normalize_term
+
+try:
+    import unqlite
+    UNQLITE_AVAILABLE = True
+except ImportError:
+    UNQLITE_AVAILABLE = False
+
+try:
+    import leveldb
+    LEVELDB_AVAILABLE = True
+except ImportError:
+    LEVELDB_AVAILABLE = False
+
+SYMSPELL_CONFIG = "symspell.json"
+
+
+def deletes(term, max_distance):
+    """Returns the non-empty strings obtained by deleting up to `max_distance` characters of a term, itself included."""
+    results = {term}
+    frontier = {term}
+    for _ in range(max_distance):
+        frontier = {word[:i] + word[i + 1:] for word in frontier if len(word) > 1 for i in range(len(word))}
+        results.update(frontier)
+    return results
+
+
+def edit_distance(a, b, max_distance):
+    """Optimal string alignment distance between two strings, or None if it exceeds `max_distance`."""
+    if abs(len(a) - len(b)) > max_distance:
+        return None
+
+    previous_previous, previous = None, list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        current = [i] + [0] * len(b)
+        for j in range(1, len(b) + 1):
+            cost = 0 if a[i - 1] == b[j - 1] else 1
+            current[j] = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + cost)
+            if i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                current[j] = min(current[j], previous_previous[j - 2] + 1)
+        if min(current) > max_distance:
+            return None
+        previous_previous, previous = previous, current
+
+    return previous[-1] if previous[-1] <= max_distance else None
+
+
+def edit_similarity(a, b, distance):
+    return 1. - distance / max(len(a), len(b), 1)
+
+
+def build_symspell_index(terms, path, database_backend, max_term_length, max_distance):
+    """Writes the symmetric deletion index of the terms of at most `max_term_length` characters.
+
+    Every deletion of up to `max_distance` characters of a term is a key listing the terms it comes
+    from, so that the terms within `max_distance` edits of a query share a key with one of its own
+    deletions.
+    """
+    index = {}
+    for term in dict.fromkeys(safe_unicode(term) for term in terms):
+        if len(term) > max_term_length:
+            continue
+        for delete in deletes(term, max_distance):
+            index.setdefault(delete, []).append(term)
+
+    mkdir(path)
+    symspell_db = SymSpellDB(path, database_backend=database_backend, config={
+        "max_term_length": max_term_length,
+        "max_distance": max_distance,
+    })
+    for delete, delete_terms in index.items():
+        symspell_db.insert(delete, delete_terms)
+    symspell_db.close()
+
+
+class SymSpellDB(object):
+    """Bounded edit distance lookups in the deletion index built by `drugfinder.install --symspell`.
+
+    A lookup reads the keys of the deletions of the query, whose number only depends on its length
+    and `max_distance`, and keeps the terms within `max_distance` edits (insertions, deletions,
+    substitutions and transpositions) of the query.
+    """
+
+    def __init__(self, path, database_backend="unqlite", read_only=False, config=None):
+        if not (os.path.exists(path) and os.path.isdir(path)):
+            err_msg = '"{}" does not exist; install DrugBank with `--symspell`'.format(path)
+            raise IOError(err_msg)
+
+        config_fp = os.path.join(path, SYMSPELL_CONFIG)
+        if config is None:
+            with open(config_fp) as f:
+                config = json.load(f)
+        else:
+            with open(config_fp, "w") as f:
+                json.dump(config, f)
+        self.max_term_length = config["max_term_length"]
+        self.max_distance = config["max_distance"]
+
+        self._install_lock = None
+        if read_only:
+            self._install_lock = InstallLock(os.path.dirname(os.path.abspath(path)))
+
+        if database_backend == "unqlite":
+            assert UNQLITE_AVAILABLE, (
+                "You selected unqlite as database backend, but it is not "
+                "installed. Please install it via `pip install unqlite`"
+            )
+            if read_only:
+                flags = UNQLITE_OPEN_READONLY | UNQLITE_OPEN_MMAP
+                self.db = unqlite.UnQLite(os.path.join(path, "deletes.unqlite"), flags=flags)
+            else:
+                self.db = unqlite.UnQLite(os.path.join(path, "deletes.unqlite"))
+            self.db_put = self.db.store
+            self.db_get = self.db.fetch
+        elif database_backend == "leveldb":
+            assert LEVELDB_AVAILABLE, (
+                "You selected leveldb as database backend, but it is not "
+                "installed. Please install it via `pip install leveldb`"
+            )
+            if read_only:
+                # the lock of leveldb cannot be shared, so the index is loaded in memory from a private snapshot
+                with _leveldb_snapshot(os.path.join(path, "deletes.leveldb")) as db:
+                    index = {bytes(k): bytes(v) for k, v in db.RangeIter()}
+                self.db = None
+                self.db_get = index.__getitem__
+            else:
+                self.db = _open_leveldb(os.path.join(path, "deletes.leveldb"))
+                self.db_put = self.db.Put
+                self.db_get = self.db.Get
+        else:
+            raise ValueError(f"database_backend {database_backend} not recognized")
+
+        if read_only:
+            self.db_put = _read_only
+
+    def close(self):
+        if self.db is not None and hasattr(self.db, "close"):
+            self.db.close()
+        if self._install_lock is not None:
+            self._install_lock.release()
+
+    def insert(self, delete, terms):
+        self.db_put(db_key_encode(delete), pickle.dumps(terms))
+
+    def _get_terms(self, delete):
+        try:
+            return pickle.loads(self.db_get(db_key_encode(delete)))
+        except KeyError:
+            return []
+
+    def lookup(self, term, max_distance=None):
+        """Returns the (term, distance) pairs of the indexed terms within `max_distance` edits of `term`.
+
+        Args:
+            term (str): query; it is lowercased and normalized like the indexed terms.
+            max_distance (int, optional): at most the distance the index was built with. Defaults to it.
+
+        Returns:
+            List: (term, distance) pairs sorted by distance. Terms with no character in common with the
+                query are not returned.
+        """
+        return self.lookup_many([term], max_distance)[0]
+
+    def lookup_many(self, terms, max_distance=None, normalized=False):
+        """Same as `lookup` for several queries, reading each distinct deletion key only once.
+
+        `normalized` queries are looked up as they are.
+        """
+        max_distance = self.max_distance if max_distance is None else min(max_distance, self.max_distance)
+        queries = {term: term if normalized else normalize_term(term) for term in terms}
+        query_deletes = {
+            query: deletes(query, max_distance) for query in set(queries.values())
+            if len(query) <= self.max_term_length + max_distance
+        }
+        candidates = {delete: self._get_terms(delete) for delete in set().union(*query_deletes.values())}
+
+        results = {}
+        for query, keys in query_deletes.items():
+            distances = {}
+            for delete in keys:
+                for candidate in candidates[delete]:
+                    if candidate not in distances:
+                        distances[candidate] = edit_distance(query, candidate, max_distance)
+            results[query] = sorted(
+                ((candidate, distance) for candidate, distance in distances.items() if distance is not None),
+                key=lambda item: item[1],
+            )
+        return [results.get(queries[term], []) for term in terms]
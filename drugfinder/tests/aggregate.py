@@ -0,0 +1,35 @@
+import pickle
+from unittest import TestCase, main
+
+from drugfinder.aggregate import DrugCounts
+
+
+class TestDrugCounts(TestCase):
+
+    def test_counts(self):
+        counts = DrugCounts(cooccurrence=True)
+        counts.add_document(['DB00422', 'DB00001', 'DB00422'])
+        counts.add_document([])
+        counts.add_document(['DB00422'])
+        self.assertEqual(counts.mentions['DB00422'], 3)
+        self.assertEqual(counts.documents['DB00422'], 2)
+        self.assertEqual(counts.presence('DB00422').tolist(), [True, False, True])
+        self.assertEqual(counts.presence('DB00602').tolist(), [False, False, False])
+        self.assertEqual(counts.cooccurrences[('DB00001', 'DB00422')], 1)
+
+    def test_merge(self):
+        first, second = DrugCounts(), DrugCounts()
+        first.add_document(['DB00422'])
+        second.add_document(['DB00001'])
+        second.add_document(['DB00422', 'DB00001'])
+        # partial counts are sent back by worker processes
+        merged = first.merge(pickle.loads(pickle.dumps(second)))
+        self.assertEqual(merged.n_documents, 3)
+        self.assertEqual(merged.document_indexes('DB00422').tolist(), [0, 2])
+        self.assertEqual(merged.document_indexes('DB00001').tolist(), [1, 2])
+        self.assertEqual(merged.mentions['DB00001'], 2)
+        self.assertRaises(ValueError, merged.merge, DrugCounts(cooccurrence=True))
+
+
+if __name__ == '__main__':
+    main()
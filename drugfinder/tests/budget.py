@@ -0,0 +1,107 @@
+import os
+import shutil
+import tempfile
+import time
+from unittest import TestCase, main
+
+from drugfinder.budget import BudgetedMatches, TimeBudget
+from drugfinder.core import DrugFinder
+from drugfinder.install import parse_and_encode_ngrams
+import spacy
+
+
+def drugs():
+    yield {'drugbank_id': 'DB00422', 'name': 'Methylphenidate', 'synonyms': 'Ritalin', 'products': 'Ritalin SR'}
+    yield {'drugbank_id': 'DB00602', 'name': 'Ivermectin', 'synonyms': '', 'products': 'Stromectol'}
+    yield {'drugbank_id': 'DB00001', 'name': 'Lepirudin', 'synonyms': '', 'products': 'Refludan'}
+
+
+class _FixedBudget(TimeBudget):
+    """Budget stuck at a degradation level."""
+
+    def __init__(self, level):
+        super().__init__(60000)
+        self.level = level
+
+    def update(self):
+        return self.level
+
+
+class TestTimeBudget(TestCase):
+
+    def test_levels(self):
+        budget = TimeBudget(60000)
+        self.assertEqual(budget.update(), 0)
+        self.assertEqual(budget.degradation, 'none')
+
+        budget = TimeBudget(1)
+        time.sleep(0.002)
+        self.assertEqual(budget.update(), 3)
+        self.assertEqual(budget.degradation, 'skip')
+        self.assertRaises(AssertionError, TimeBudget, 0)
+
+    def test_stages(self):
+        budget = TimeBudget(60000)
+        for _ in range(2):
+            with budget.stage('retrieval'):
+                time.sleep(0.001)
+        self.assertGreaterEqual(budget.stage_seconds['retrieval'], 0.002)
+
+        matches = BudgetedMatches.from_budget([[{'term': 'ritalin'}]], budget)
+        self.assertEqual(matches, [[{'term': 'ritalin'}]])
+        self.assertFalse(matches.partial)
+        self.assertEqual(matches.degradation, 'none')
+        self.assertGreater(matches.elapsed_ms, 0)
+
+
+
+class TestBudgetedMatch(TestCase):
+
+    # n-grams such as `Ivermectin. Refludan` span two sentences
+    sentence = 'Patients took Ritalin SR and Ivermectin. Refludan was given daily. '
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        parse_and_encode_ngrams(drugs(), os.path.join(self.path, 'drugbank-simstring.db'),
+                                os.path.join(self.path, 'drugbank-db.db'), database_backend='unqlite')
+        self.matcher = DrugFinder(self.path, tokenizer='rule', threshold=0.5)
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def test_same_matches_as_match(self):
+        # more n-grams than a batch of `_BUDGET_CHECK_INTERVAL`
+        text = self.sentence * 40
+        for chunk_size in (None, 300):
+            for best_match in (True, False):
+                expected = self.matcher.match(text, best_match=best_match, ignore_syntax=True, chunk_size=chunk_size)
+                matches = self.matcher.match(text, best_match=best_match, ignore_syntax=True, chunk_size=chunk_size,
+                                             time_budget_ms=60000)
+                self.assertFalse(matches.partial)
+                self.assertEqual(list(matches), expected)
+
+    def test_same_matches_as_match_with_spacy(self):
+        matcher = DrugFinder(self.path, spacy_component=True, threshold=0.5)
+        matcher.nlp = spacy.blank('en')
+        matcher.nlp.add_pipe('sentencizer')
+        text = self.sentence * 40
+        for ignore_syntax in (False, True):
+            for best_match in (True, False):
+                expected = matcher.match(text, best_match=best_match, ignore_syntax=ignore_syntax)
+                matches = matcher.match(text, best_match=best_match, ignore_syntax=ignore_syntax,
+                                        time_budget_ms=60000)
+                self.assertFalse(matches.partial)
+                self.assertEqual(list(matches), expected)
+
+    def test_degraded_window(self):
+        text = self.sentence * 40
+        matches = self.matcher._match_doc_budgeted(text, True, len(text), _FixedBudget(1))
+        ngrams = [(group[0]['start'], group[0]['end']) for group in matches]
+        self.assertEqual(len(ngrams), len(set(ngrams)))
+        # n-grams of at most two tokens: `Ritalin SR` is found, not `Ritalin SR and Ivermectin`
+        self.assertIn('Ritalin SR', {group[0]['ngram'] for group in matches})
+        self.assertTrue(all(len(group[0]['ngram'].split()) <= 2 for group in matches))
+
+
+if __name__ == '__main__':
+    main()
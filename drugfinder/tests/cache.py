@@ -0,0 +1,78 @@
+import os
+import shutil
+import tempfile
+from unittest import TestCase, main, mock
+
+from drugfinder.cache import ResultCache, cache_key
+from drugfinder.core import DrugFinder
+from drugfinder.install import parse_and_encode_ngrams
+
+
+def drugs():
+    yield {'drugbank_id': 'DB00422', 'name': 'Methylphenidate', 'synonyms': 'Ritalin', 'products': 'Ritalin SR'}
+    yield {'drugbank_id': 'DB00602', 'name': 'Ivermectin', 'synonyms': '', 'products': 'Stromectol'}
+
+
+class TestResultCache(TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.cache = ResultCache(self.path, max_entries=2)
+
+    def tearDown(self):
+        self.cache.close()
+        shutil.rmtree(self.path)
+
+    def test_key(self):
+        config = {"info": {"threshold": 0.7}, "index_version": "a"}
+        self.assertEqual(cache_key("ivermectin", config), cache_key("ivermectin", dict(config)))
+        self.assertNotEqual(cache_key("ivermectin", config), cache_key("ivermectina", config))
+        self.assertNotEqual(cache_key("ivermectin", config), cache_key("ivermectin", dict(config, index_version="b")))
+
+    def test_hits_and_eviction(self):
+        matches = [[{'start': 0, 'end': 10, 'term': 'ivermectin', 'drugbank_id': 'DB00602', 'similarity': 1.0}]]
+        self.cache.put("a", matches)
+        self.cache.put("b", [])
+        self.assertEqual(self.cache.get_many(["a", "c"]), {"a": matches})
+        self.cache.put("c", [])
+        # "b" is the least recently used entry
+        self.assertIsNone(self.cache.get("b"))
+        self.assertEqual(self.cache.get("c"), [])
+        self.assertEqual(self.cache.stats, {"hits": 2, "misses": 2, "hit_rate": 0.5, "entries": 2})
+
+    def test_entry_count(self):
+        self.cache.put_many({"a": [], "b": []})
+        # replacing an entry does not evict another one
+        self.cache.put("a", [])
+        self.assertEqual(self.cache.get_many(["a", "b"]), {"a": [], "b": []})
+
+        # the entries put by another process are counted every `COUNT_INTERVAL` puts
+        other = ResultCache(self.path, max_entries=10)
+        other.put_many({"c": [], "d": []})
+        other.close()
+        self.cache.put("a", [])
+        self.assertEqual(len(self.cache), 4)
+        with mock.patch('drugfinder.cache.COUNT_INTERVAL', 1):
+            self.cache.put("a", [])
+        self.assertEqual(len(self.cache), 2)
+        self.assertEqual(self.cache.get_many(["a", "b", "c", "d"]), {"a": [], "d": []})
+
+    def test_matchers_sharing_a_cache(self):
+        drugbank_fp = os.path.join(self.path, 'drugbank')
+        parse_and_encode_ngrams(drugs(), os.path.join(drugbank_fp, 'drugbank-simstring.db'),
+                                os.path.join(drugbank_fp, 'drugbank-db.db'), database_backend='unqlite')
+        cache_dir = os.path.join(self.path, 'cache')
+        text = 'Patients took Ritalin SR and Ivermectin.'
+        ngrams = {}
+        for overlapping_criteria in ('score', 'length'):
+            matcher = DrugFinder(drugbank_fp, tokenizer='rule', threshold=0.5, cache_dir=cache_dir,
+                                 overlapping_criteria=overlapping_criteria)
+            ngrams[overlapping_criteria] = [group[0]['ngram'] for group in matcher.match(text, ignore_syntax=True)]
+            matcher.result_cache.close()
+        # the second matcher does not read the matches selected by the first one
+        self.assertEqual(ngrams['score'], ['Ivermectin', 'Ritalin'])
+        self.assertEqual(ngrams['length'], ['Ritalin SR and Ivermectin'])
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,55 @@
+import os
+import shutil
+import tempfile
+from unittest import TestCase, main
+from drugfinder.chunking import iter_chunks, iter_sentence_ends
+from drugfinder.core import DrugFinder
+from drugfinder.install import parse_and_encode_ngrams
+from drugfinder.tests.budget import drugs
+
+
+class TestChunking(TestCase):
+
+    def test_chunks_cover_text(self):
+        text = 'Ivermectin for COVID-19. Ritalin SR daily.\n\nAspirin and paracetamol ' * 20
+        for chunk_size in (10, 50, 200):
+            chunks = list(iter_chunks(text, chunk_size, overlap_words=3))
+            self.assertEqual(chunks[0][0], 0)
+            self.assertEqual(chunks[-1][1], len(text))
+            for (_, end, _), (start, _, _) in zip(chunks, chunks[1:]):
+                self.assertEqual(end, start)
+                # chunks start with a word
+                self.assertFalse(text[start].isspace())
+
+    def test_boundaries(self):
+        text = 'a b. c d e\n\nf g h'
+        # paragraph breaks are preferred to sentence ends, and sentence ends to whitespace
+        self.assertEqual(list(iter_chunks(text, 14, overlap_words=1)), [(0, 12, 13), (12, 17, 17)])
+        self.assertEqual(list(iter_chunks(text, 8, overlap_words=2)), [(0, 5, 8), (5, 12, 15), (12, 17, 17)])
+        self.assertEqual(list(iter_sentence_ends(text)), [5, 12, 17])
+
+
+class TestChunkedMatch(TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        parse_and_encode_ngrams(drugs(), os.path.join(self.path, 'drugbank-simstring.db'),
+                                os.path.join(self.path, 'drugbank-db.db'), database_backend='unqlite')
+        self.matcher = DrugFinder(self.path, tokenizer='rule', threshold=0.5)
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def test_term_spanning_chunks(self):
+        text = 'Patients took Ritalin SR and Ivermectin daily'
+        # the first chunk ends between `Ritalin` and `SR`
+        self.assertEqual(next(iter_chunks(text, 22, self.matcher.window))[1], text.index('SR'))
+        for best_match in (True, False):
+            expected = self.matcher.match(text, best_match=best_match, ignore_syntax=True)
+            matches = self.matcher.match(text, best_match=best_match, ignore_syntax=True, chunk_size=22)
+            self.assertEqual(matches, expected)
+        self.assertIn('Ritalin SR', [match['ngram'] for group in matches for match in group])
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,43 @@
+from unittest import TestCase, main
+from drugfinder.columnar import ColumnarMatches
+
+
+class TestColumnarMatches(TestCase):
+
+    def setUp(self):
+        data = {'name': 'Ivermectin', 'state': 'solid'}
+        self.documents = [
+            [[{'start': 0, 'end': 10, 'ngram': 'Ivermectin', 'term': 'ivermectin',
+               'drugbank_id': 'DB00602', 'data': data, 'similarity': 1.0},
+              {'start': 0, 'end': 10, 'ngram': 'Ivermectin', 'term': 'ivermectina',
+               'drugbank_id': 'DB00602', 'data': data, 'similarity': 0.8}]],
+            [],
+            [[{'start': 4, 'end': 14, 'ngram': 'ivermectin', 'term': 'ivermectin',
+               'drugbank_id': 'DB00602', 'data': data, 'similarity': 1.0}]],
+        ]
+        self.columnar = ColumnarMatches()
+        for matches in self.documents:
+            self.columnar.add_document(matches)
+
+    def test_side_tables(self):
+        self.assertEqual(len(self.columnar), 3)
+        self.assertEqual(self.columnar.drugbank_ids.values, ['DB00602'])
+        self.assertEqual(self.columnar.terms.values, ['ivermectin', 'ivermectina'])
+        self.assertEqual(len(self.columnar.records), 1)
+
+    def test_structured_array(self):
+        rows = self.columnar.to_structured_array()
+        self.assertEqual(list(rows['doc']), [0, 0, 2])
+        self.assertEqual(list(rows['term']), [0, 1, 0])
+        self.assertEqual(list(rows['similarity']), [1.0, 0.8, 1.0])
+
+    def test_round_trip(self):
+        self.assertEqual(self.columnar.to_dicts(), self.documents)
+        for doc_index, matches in enumerate(self.documents):
+            self.assertEqual(self.columnar.document(doc_index), matches)
+        with self.assertRaises(IndexError):
+            self.columnar.document(3)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,40 @@
+import os
+import shutil
+import tempfile
+from unittest import TestCase, main
+
+import spacy
+
+from drugfinder.doccache import DocCache, model_version
+
+
+class TestDocCache(TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.nlp = spacy.blank('en')
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def test_parse(self):
+        texts = ['Patients took Ritalin SR daily.', 'Ivermectin 0.6 mg/kg was given.']
+        docs = DocCache(self.path, self.nlp).parse_many(texts)
+        self.assertEqual([doc.text for doc in docs], texts)
+
+        # a new cache over the same directory reads the parses instead of parsing again
+        doc_cache = DocCache(self.path, self.nlp)
+        doc = doc_cache.parse(texts[0])
+        self.assertEqual([token.text for token in doc], [token.text for token in docs[0]])
+        self.assertEqual([token.idx for token in doc], [token.idx for token in docs[0]])
+        self.assertIsNone(doc_cache.get('Refludan'))
+        self.assertEqual(doc_cache.stats['hits'], 1)
+        self.assertEqual(doc_cache.stats['misses'], 1)
+
+    def test_model_version(self):
+        self.assertEqual(model_version(self.nlp), 'en_pipeline-{}'.format(self.nlp.meta['version']))
+        self.assertEqual(DocCache(self.path, self.nlp).path, os.path.join(self.path, model_version(self.nlp)))
+
+
+if __name__ == '__main__':
+    main()
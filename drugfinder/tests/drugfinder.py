@@ -13,6 +13,34 @@ class TestDrugFinder(TestCase):
     def test_info(self):
         self.assertNotEqual(self.matcher.get_info(), {})  # add assertion here
 
+    def test_iter_matches(self):
+        text = 'Ivermectin 0.6 mg/kg was given. Patients took Ritalin SR and Refludan daily.'
+        for best_match in (True, False):
+            streamed = [group for matches in self.matcher.iter_matches(text, best_match=best_match) for group in matches]
+            matches = self.matcher.match(text, best_match=best_match)
+            self.assertCountEqual([group[0]['term'] for group in streamed], [group[0]['term'] for group in matches])
+
+    def test_count_many(self):
+        texts = ['Patients took Ritalin SR and Refludan daily.', 'No drug here.', 'Ritalin was stopped.']
+        counts = self.matcher.count_many(texts, cooccurrence=True)
+        self.assertEqual(counts.n_documents, 3)
+        for doc_index, text in enumerate(texts):
+            drugbank_ids = {group[0]['drugbank_id'] for group in self.matcher.match(text)}
+            self.assertEqual({drugbank_id for drugbank_id in counts.mentions
+                              if counts.presence(drugbank_id)[doc_index]}, drugbank_ids)
+
+    def test_time_budget(self):
+        text = 'Ivermectin 0.6 mg/kg was given. Patients took Ritalin SR and Refludan daily.'
+        matches = self.matcher.match(text, time_budget_ms=60000)
+        self.assertFalse(matches.partial)
+        self.assertEqual(matches.degradation, 'none')
+        self.assertCountEqual([group[0]['term'] for group in matches],
+                              [group[0]['term'] for group in self.matcher.match(text)])
+        # the budget is spent before the first n-grams are matched
+        matches = self.matcher.match(text + ' Aspirin.', time_budget_ms=1e-6)
+        self.assertTrue(matches.partial)
+        self.assertEqual(matches.degradation, 'skip')
+
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,52 @@
+import os
+import pickle
+import shutil
+import tempfile
+from unittest import TestCase, main
+from drugfinder.encoding import ZDICT_FILENAME, RecordCodec, train_zdict
+from drugfinder.install import parse_and_encode_ngrams
+from drugfinder.utils import DrugBankDB
+
+
+class TestRecordCodec(TestCase):
+
+    drug = {'name': 'Ivermectin', 'state': 'solid', 'indication': None,
+            'description': 'Ivermectin is a broad-spectrum anti-parasite medication. ' * 4}
+
+    def test_ids(self):
+        codec = RecordCodec()
+        self.assertEqual(len(codec.encode_ids(['DB00602'])), 9)
+        for drugbank_ids in (['DB00602'], ['DB00602', 'DB00001'], ['DB00602', 'CUSTOM-1']):
+            self.assertEqual(codec.decode_ids(codec.encode_ids(drugbank_ids)), tuple(drugbank_ids))
+
+    def test_records(self):
+        codec = RecordCodec(train_zdict([self.drug['description']] * 2))
+        encoded = codec.encode_record(self.drug)
+        self.assertLess(len(encoded), len(pickle.dumps(self.drug)) / 2)
+        self.assertEqual(codec.decode_record(encoded), self.drug)
+        self.assertEqual(RecordCodec().decode_record(RecordCodec().encode_record(self.drug)), self.drug)
+
+    def test_compression_is_opt_in(self):
+        path = tempfile.mkdtemp()
+        try:
+            for compress_records in (False, True):
+                drugbank_fp = os.path.join(path, str(compress_records))
+                drugs = [dict(self.drug, drugbank_id='DB%05d' % i, synonyms='', products='') for i in range(3)]
+                parse_and_encode_ngrams(iter(drugs), os.path.join(drugbank_fp, 'drugbank-simstring.db'),
+                                        os.path.join(drugbank_fp, 'drugbank-db.db'), database_backend='unqlite',
+                                        record_format='compact', compress_records=compress_records)
+                db_dir = os.path.join(drugbank_fp, 'drugbank-db.db')
+                self.assertEqual(os.path.exists(os.path.join(db_dir, ZDICT_FILENAME)), compress_records)
+                drugbank_db = DrugBankDB(db_dir, database_backend='unqlite', record_format='compact')
+                self.assertEqual(drugbank_db.get_data('DB00001')['description'], self.drug['description'])
+                drugbank_db.close()
+        finally:
+            shutil.rmtree(path)
+
+    def test_not_compact(self):
+        with self.assertRaises(ValueError):
+            RecordCodec().decode_record(pickle.dumps(self.drug))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,60 @@
+import os
+import shutil
+import tempfile
+from unittest import TestCase, main
+
+from drugfinder.evaluate import (iter_configs, make_synthetic_corpus, pareto_frontier, read_brat_corpus, score)
+
+
+class TestEvaluate(TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def test_score(self):
+        documents = [{'text': 'Patients took Ritalin and Refludan.', 'spans': {(14, 21, 'DB00422'), (26, 34, 'DB00001')}}]
+        results = [[
+            [{'start': 14, 'end': 21, 'drugbank_id': 'DB00422', 'similarity': 1.}],
+            [{'start': 26, 'end': 34, 'drugbank_id': 'DB00602', 'similarity': 0.8},
+             {'start': 26, 'end': 34, 'drugbank_id': 'DB00001', 'similarity': 0.7}],
+        ]]
+        self.assertEqual(score(documents, results), {'precision': 0.5, 'recall': 0.5, 'f1': 0.5})
+
+    def test_brat(self):
+        with open(os.path.join(self.path, 'doc1.txt'), 'w') as f:
+            f.write('Patients took Ritalin and Refludan.')
+        with open(os.path.join(self.path, 'doc1.ann'), 'w') as f:
+            f.write('T1\tDrug 14 21\tRitalin\nT2\tDrug 26 34\tRefludan\n'
+                    'N1\tReference T1 DrugBank:DB00422\tRitalin\n')
+        documents = read_brat_corpus(self.path)
+        self.assertEqual(documents[0]['id'], 'doc1')
+        self.assertEqual(documents[0]['spans'], {(14, 21, 'DB00422')})
+
+    def test_synthetic(self):
+        lexicon_fp = os.path.join(self.path, 'lexicon.csv')
+        with open(lexicon_fp, 'w') as f:
+            f.write('term,drugbank_id\nritalin,DB00422\nrefludan,DB00001\n')
+        documents = make_synthetic_corpus([lexicon_fp], n_documents=20)
+        self.assertEqual(len(documents), 20)
+        for document in documents:
+            for start, end, drugbank_id in document['spans']:
+                # terms may have two letters swapped, never the first one
+                term = {'DB00422': 'ritalin', 'DB00001': 'refludan'}[drugbank_id]
+                self.assertEqual(sorted(document['text'][start:end].lower()), sorted(term))
+                self.assertEqual(document['text'][start].lower(), term[0])
+
+    def test_grid(self):
+        configs = list(iter_configs({'window': [3, 5], 'threshold': [0.6, 0.7, 0.8]}))
+        self.assertEqual(len(configs), 6)
+        self.assertEqual(configs[0], {'threshold': 0.6, 'window': 3})
+
+        results = [{'f1': 0.9, 'docs_per_second': 10.}, {'f1': 0.8, 'docs_per_second': 50.},
+                   {'f1': 0.7, 'docs_per_second': 20.}, {'f1': 0.9, 'docs_per_second': 5.}]
+        self.assertEqual(pareto_frontier(results), [results[1], results[0]])
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,111 @@
+import json
+import os
+import shutil
+import tempfile
+from unittest import TestCase, main
+
+from drugfinder.install import parse_and_encode_ngrams
+from drugfinder.jobs import (JOB_FILENAME, checkpoint_filepath, input_filepath, is_done, load_job, merge_outputs,
+                             partition_filepath, partition_of, read_documents, run_job, split_inputs)
+
+OPTIONS = {'threshold': 0.7, 'window': 5, 'similarity_name': 'cosine', 'tokenizer': 'rule', 'ignore_syntax': True,
+           'all_matches': False, 'with_data': False}
+
+
+class TestJobs(TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.input_fp = os.path.join(self.path, 'corpus.jsonl')
+        with open(self.input_fp, 'w') as f:
+            for i in range(20):
+                f.write(json.dumps({'id': 'doc{}'.format(i), 'text': 'Patient {} took Ritalin.'.format(i)}) + '\n')
+            f.write(json.dumps({'text': 'No id.'}) + '\n')
+        self.output_path = os.path.join(self.path, 'job')
+        self.job = load_job(self.output_path, [self.input_fp], 4, OPTIONS)
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def test_partitions(self):
+        self.assertEqual(partition_of('doc1', 4), partition_of('doc1', 4))
+        ids = [doc_id for doc_id, _ in read_documents([self.input_fp])]
+        self.assertEqual(ids[-1], 'corpus.jsonl:21')
+
+        split_inputs(self.job, self.output_path, range(4))
+        split_ids = []
+        for partition in range(4):
+            with open(input_filepath(self.output_path, partition)) as f:
+                for line in f:
+                    doc_id = json.loads(line)['id']
+                    self.assertEqual(partition_of(doc_id, 4), partition)
+                    split_ids.append(doc_id)
+        self.assertCountEqual(split_ids, ids)
+
+    def test_resume(self):
+        job = load_job(self.output_path)
+        self.assertEqual(job['partitions'], 4)
+        self.assertRaises(ValueError, load_job, self.output_path, None, 8)
+        self.assertRaises(ValueError, load_job, self.output_path, None, None, dict(OPTIONS, threshold=0.8))
+
+        # the options of jobs created before the batch size became an option of each run
+        job_fp = os.path.join(self.output_path, JOB_FILENAME)
+        with open(job_fp, 'w') as f:
+            json.dump(dict(job, options=dict(OPTIONS, batch_size=64)), f)
+        self.assertEqual(load_job(self.output_path, None, None, OPTIONS)['options'], OPTIONS)
+
+    def test_duplicate_ids(self):
+        input_fp = os.path.join(self.path, 'duplicates.jsonl')
+        with open(input_fp, 'w') as f:
+            for doc_id in ('a', 'b', 'a'):
+                f.write(json.dumps({'id': doc_id, 'text': 'Ritalin'}) + '\n')
+        output_path = os.path.join(self.path, 'duplicates')
+        with self.assertRaisesRegex(ValueError, '"a"'):
+            load_job(output_path, [input_fp], 4, OPTIONS)
+        # the job is not created
+        self.assertFalse(os.path.exists(os.path.join(output_path, JOB_FILENAME)))
+        self.assertEqual(os.listdir(os.path.join(output_path, 'inputs')), [])
+
+    def test_interrupted_job(self):
+        drugbank_fp = os.path.join(self.path, 'drugbank')
+        drugs = [{'drugbank_id': 'DB00422', 'name': 'Methylphenidate', 'synonyms': 'Ritalin', 'products': ''}]
+        parse_and_encode_ngrams(iter(drugs), os.path.join(drugbank_fp, 'drugbank-simstring.db'),
+                                os.path.join(drugbank_fp, 'drugbank-db.db'), database_backend='unqlite')
+        # the inputs were split when the job was created: resumed runs do not read them again
+        os.remove(self.input_fp)
+
+        # interrupted after two partitions, and while writing the output of a third one
+        checkpoints = run_job(drugbank_fp, self.output_path, [0, 1], OPTIONS, batch_size=4)
+        self.assertEqual(sorted(c['partition'] for c in checkpoints), [0, 1])
+        open(partition_filepath(self.output_path, 2), 'w').close()
+
+        # the batch size of a resumed run can differ
+        checkpoints = run_job(drugbank_fp, self.output_path, range(4), OPTIONS, batch_size=2)
+        self.assertEqual(sorted(c['partition'] for c in checkpoints), [2, 3])
+        self.assertTrue(all(is_done(self.output_path, p) for p in range(4)))
+        self.assertEqual(run_job(drugbank_fp, self.output_path, range(4), OPTIONS), [])
+
+        merged_fp = os.path.join(self.path, 'merged.jsonl')
+        self.assertEqual(merge_outputs(self.output_path, merged_fp), 4)
+        with open(merged_fp) as f:
+            outputs = [json.loads(line) for line in f]
+        self.assertEqual(len(outputs), 21)
+        self.assertEqual({group[0]['drugbank_id'] for output in outputs for group in output['matches']}, {'DB00422'})
+
+    def test_merge(self):
+        for partition in (2, 0):
+            with open(partition_filepath(self.output_path, partition), 'w') as f:
+                f.write(json.dumps({'id': partition, 'matches': []}) + '\n')
+            with open(checkpoint_filepath(self.output_path, partition), 'w') as f:
+                json.dump({'partition': partition}, f)
+        # partition 3 has an output but no checkpoint: it did not finish
+        open(partition_filepath(self.output_path, 3), 'w').close()
+
+        merged_fp = os.path.join(self.path, 'merged.jsonl')
+        self.assertEqual(merge_outputs(self.output_path, merged_fp), 2)
+        with open(merged_fp) as f:
+            self.assertEqual([json.loads(line)['id'] for line in f], [0, 2])
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,47 @@
+from drugfinder.encoding import RecordCodec, train_zdict
+from drugfinder.utils import DrugBankDB, read_record_format
+import os
+import pickle
+import time
+from pathlib import Path
+
+# usage: python -m drugfinder.tests.main_encoding
+# compares the size and the decoding time of the pickle and compact record formats on the records of an install
+drugbank_data = os.environ['DRUGBANK_DATA'] if 'DRUGBANK_DATA' in os.environ else os.path.join(Path.home(), 'drugbank_data')
+
+drugbank_db = DrugBankDB(os.path.join(drugbank_data, "drugbank-db.db"), preload=True,
+                         record_format=read_record_format(drugbank_data))
+term_values = [list(drugbank_ids) for drugbank_ids in drugbank_db._terms.values()]
+records = list(drugbank_db._data.values())
+codec = RecordCodec()
+compressed_codec = RecordCodec(train_zdict(
+    value for drug in records[:2000] for value in drug.values() if isinstance(value, str)))
+
+formats = {
+    'pickle': (pickle.dumps, pickle.loads, pickle.dumps, pickle.loads),
+    'compact': (codec.encode_ids, codec.decode_ids, codec.encode_record, codec.decode_record),
+    'compact, compressed': (compressed_codec.encode_ids, compressed_codec.decode_ids, compressed_codec.encode_record,
+                            compressed_codec.decode_record),
+}
+for name, (encode_ids, decode_ids, encode_record, decode_record) in formats.items():
+    encoded_ids = [encode_ids(value) for value in term_values]
+    encoded_records = [encode_record(drug) for drug in records]
+
+    # the second pass decodes term values already seen, as when the same terms are matched again
+    ids_elapsed = []
+    for _ in range(2):
+        start = time.time()
+        for value in encoded_ids:
+            decode_ids(value)
+        ids_elapsed.append(time.time() - start)
+    start = time.time()
+    for value in encoded_records:
+        decode_record(value)
+    records_elapsed = time.time() - start
+
+    print('{}: {:,} term values in {:,} bytes ({:.2f} us each, {:.2f} us the second time), '
+          '{:,} records in {:,} bytes ({:.2f} us each)'.format(
+              name, len(encoded_ids), sum(map(len, encoded_ids)), 1e6 * ids_elapsed[0] / max(len(encoded_ids), 1),
+              1e6 * ids_elapsed[1] / max(len(encoded_ids), 1), len(encoded_records),
+              sum(map(len, encoded_records)), 1e6 * records_elapsed / max(len(encoded_records), 1)))
+print('compression dictionary: {:,} bytes'.format(len(compressed_codec.zdict)))
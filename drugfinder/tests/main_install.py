@@ -0,0 +1,50 @@
+from drugfinder.install import _extract, parse_and_encode_ngrams
+from drugfinder.utils import DrugBankDB
+import argparse
+import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+# usage: python -m drugfinder.tests.main_install full_database.xml drugbank.xsd
+# installs DrugBank with an increasing number of parsing processes and checks that the installed data is the same
+drugbank_filepath, drugbank_schema_filepath = sys.argv[1:3]
+
+
+def install(jobs, destination_path):
+    opts = argparse.Namespace(drugbank_filepath=drugbank_filepath, drugbank_schema_filepath=drugbank_schema_filepath,
+                              normalize_unicode=True, jobs=jobs)
+    start = time.time()
+    parse_and_encode_ngrams(_extract(opts),
+                            os.path.join(destination_path, "drugbank-simstring.db"),
+                            os.path.join(destination_path, "drugbank-db.db"),
+                            database_backend="unqlite",
+                            manifest_fp=os.path.join(destination_path, "drugbank-hashes.json"))
+    return time.time() - start
+
+
+def contents(destination_path):
+    drugbank_db = DrugBankDB(os.path.join(destination_path, "drugbank-db.db"))
+    items = (sorted(drugbank_db._iter_items(drugbank_db.drugbank_db_items)),
+             sorted(drugbank_db._iter_items(drugbank_db.drugbank_data_db_items)))
+    drugbank_db.close()
+    with open(os.path.join(destination_path, "drugbank-hashes.json"), "rb") as f:
+        return items, f.read()
+
+
+root = tempfile.mkdtemp()
+try:
+    reference, serial_elapsed = None, None
+    for jobs in sorted({1, 2, 4, multiprocessing.cpu_count()}):
+        destination_path = os.path.join(root, str(jobs))
+        elapsed = install(jobs, destination_path)
+        serial_elapsed = serial_elapsed or elapsed
+        if reference is None:
+            reference = contents(destination_path)
+        print('{} jobs: {:.2f} s (x{:.2f}), same data as serial: {}'.format(
+            jobs, elapsed, serial_elapsed / elapsed, contents(destination_path) == reference), file=sys.stderr)
+        shutil.rmtree(destination_path)
+finally:
+    shutil.rmtree(root)
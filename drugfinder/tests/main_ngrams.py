@@ -0,0 +1,27 @@
+from drugfinder.core import DrugFinder
+import os
+import sys
+import time
+from pathlib import Path
+
+# usage: python -m drugfinder.tests.main_ngrams [corpus.txt]
+# the corpus has one document per line; a sample sentence is repeated when no corpus is given
+drugbank_data = os.environ['DRUGBANK_DATA'] if 'DRUGBANK_DATA' in os.environ else os.path.join(Path.home(), 'drugbank_data')
+matcher = DrugFinder(drugbank_fp=drugbank_data)
+
+if len(sys.argv) > 1:
+    with open(sys.argv[1]) as f:
+        texts = [line.strip() for line in f if len(line.strip()) > 0]
+else:
+    texts = ['Ivermectin for Severe COVID-19 Management: a randomized trial of 0.6 mg/kg of ivermectin '
+             'versus placebo (standard of care) in 400 patients.'] * 1000
+
+docs = list(matcher.nlp.pipe(texts))
+n_tokens = sum(len(doc) for doc in docs)
+
+for name, generator in (('_make_ngrams', matcher._make_ngrams), ('_make_token_sequences', matcher._make_token_sequences)):
+    start = time.time()
+    n_ngrams = sum(1 for doc in docs for _ in generator(doc))
+    elapsed = time.time() - start
+    print('{}: {:,} n-grams from {:,} tokens in {:.2f} s ({:,.0f} n-grams/s)'.format(
+        name, n_ngrams, n_tokens, elapsed, n_ngrams / elapsed))
@@ -0,0 +1,35 @@
+from drugfinder.core import DrugFinder
+import os
+import sys
+import time
+from pathlib import Path
+
+# usage: python -m drugfinder.tests.main_retrieval [corpus.txt]
+# compares the simstring and the sparse retrieval engines (CPU only); DrugBank must be installed with `--sparse-index`
+drugbank_data = os.environ['DRUGBANK_DATA'] if 'DRUGBANK_DATA' in os.environ else os.path.join(Path.home(), 'drugbank_data')
+
+if len(sys.argv) > 1:
+    with open(sys.argv[1]) as f:
+        texts = [line.strip() for line in f if len(line.strip()) > 0]
+else:
+    texts = ['Ivermectin for Severe COVID-19 Management: a randomized trial of 0.6 mg/kg of ivermectin '
+             'versus placebo (standard of care) in 400 patients.'] * 1000
+
+candidates = {}
+for engine in ('simstring', 'sparse'):
+    matcher = DrugFinder(drugbank_fp=drugbank_data, retrieval_engine=engine)
+    ngrams = [ngram for doc in matcher.nlp.pipe(texts) for _, _, ngram in matcher._make_ngrams(doc)]
+
+    start = time.time()
+    candidates[engine] = matcher.simstring_db.get_many(ngrams)
+    elapsed = time.time() - start
+    print('{}: candidates of {:,} n-grams in {:.2f} s ({:,.0f} n-grams/s)'.format(
+        engine, len(ngrams), elapsed, len(ngrams) / elapsed))
+
+    start = time.time()
+    n_matches = sum(len(matches) for matches in matcher.match_many(texts))
+    elapsed = time.time() - start
+    print('{}: {:,} matches in {:.2f} s ({:,.0f} docs/s)'.format(engine, n_matches, elapsed, len(texts) / elapsed))
+
+same = all(sorted(a) == sorted(b) for a, b in zip(candidates['simstring'], candidates['sparse']))
+print('same candidates: {}'.format(same))
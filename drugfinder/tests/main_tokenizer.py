@@ -0,0 +1,38 @@
+from drugfinder.core import DrugFinder
+import os
+import sys
+import time
+from pathlib import Path
+
+# usage: python -m drugfinder.tests.main_tokenizer [corpus.txt]
+# compares the spaCy and the rule-based tokenizers when matching with ignore_syntax=True
+drugbank_data = os.environ['DRUGBANK_DATA'] if 'DRUGBANK_DATA' in os.environ else os.path.join(Path.home(), 'drugbank_data')
+
+if len(sys.argv) > 1:
+    with open(sys.argv[1]) as f:
+        texts = [line.strip() for line in f if len(line.strip()) > 0]
+else:
+    texts = ['Ivermectin for Severe COVID-19 Management: a randomized trial of 0.6 mg/kg of ivermectin '
+             'versus placebo (standard of care) in 400 patients.'] * 1000
+n_chars = sum(len(text) for text in texts)
+
+for tokenizer in ('spacy', 'rule'):
+    start = time.time()
+    matcher = DrugFinder(drugbank_fp=drugbank_data, tokenizer=tokenizer)
+    print('{}: loaded in {:.2f} s'.format(tokenizer, time.time() - start))
+
+    start = time.time()
+    if tokenizer == 'spacy':
+        n_ngrams = sum(1 for doc in matcher.nlp.pipe(texts) for _ in matcher._make_token_sequences(doc))
+    else:
+        n_ngrams = sum(1 for text in texts for _ in matcher.rule_tokenizer.make_token_sequences(
+            text, matcher.window, matcher.min_match_length))
+    elapsed = time.time() - start
+    print('{}: {:,} windows from {:,} chars in {:.2f} s ({:,.0f} docs/s, {:,.0f} chars/s)'.format(
+        tokenizer, n_ngrams, n_chars, elapsed, len(texts) / elapsed, n_chars / elapsed))
+
+    start = time.time()
+    n_matches = sum(len(matches) for matches in matcher.match_many(texts, ignore_syntax=True))
+    elapsed = time.time() - start
+    print('{}: {:,} matches in {:.2f} s ({:,.0f} docs/s)'.format(
+        tokenizer, n_matches, elapsed, len(texts) / elapsed))
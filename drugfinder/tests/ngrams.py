@@ -0,0 +1,96 @@
+import os
+import shutil
+import tempfile
+from unittest import TestCase, main
+
+from drugfinder.constants import DRUGBANK_SPECIFIC_STOPWORDS
+from drugfinder.core import DrugFinder
+from drugfinder.install import parse_and_encode_ngrams
+from drugfinder.tests.budget import drugs
+import spacy
+from spacy.tokens import Doc
+
+
+WORDS = ['The', 'patient', 'took', 'the', 'Ritalin', 'SR', '(', '10', 'mg', ')', ',', 'not', 'aspirin', '/',
+         'warfarin', 'or', 'anti', '-', 'inflammatory', 'drugs', '.']
+POS = ['DET', 'NOUN', 'VERB', 'DET', 'PROPN', 'PROPN', 'PUNCT', 'NUM', 'NOUN', 'PUNCT', 'PUNCT', 'PART', 'NOUN', 'SYM',
+       'NOUN', 'CCONJ', 'ADJ', 'PUNCT', 'ADJ', 'NOUN', 'PUNCT']
+
+# output of the token-based generator preceding `_token_flags`, with its invalid middle token check fixed
+NGRAMS = [
+    (4, 11, 'patient'), (4, 28, 'patient took Ritalin'), (4, 31, 'patient took Ritalin SR'), (12, 28, 'took Ritalin'),
+    (12, 31, 'took Ritalin SR'), (21, 28, 'Ritalin'), (21, 31, 'Ritalin SR'), (21, 36, 'Ritalin SR ( 10'),
+    (29, 31, 'SR'), (29, 36, 'SR ( 10'), (44, 55, 'not aspirin'), (48, 55, 'aspirin'), (58, 66, 'warfarin'),
+    (58, 74, 'warfarin or anti'), (58, 89, 'warfarin or anti - inflammatory'), (67, 74, 'or anti'),
+    (67, 89, 'or anti - inflammatory'), (67, 95, 'or anti - inflammatory drugs'), (70, 74, 'anti'),
+    (70, 89, 'anti - inflammatory'), (70, 95, 'anti - inflammatory drugs'), (77, 89, 'inflammatory'),
+    (77, 95, 'inflammatory drugs'), (90, 95, 'drugs'),
+]
+
+
+def reference_ngrams(matcher, sentence):
+    """Token-based n-grams, as generated before the flags were computed with `Doc.to_array`."""
+    skip_in_span = {token.i for token in sentence if token.pos_ == 'DET'}
+    invalid_mid_tokens = {token.i for token in sentence if not matcher._is_valid_middle_token(token)}
+    for i, token in enumerate(sentence):
+        if not matcher._is_valid_token(token):
+            continue
+        compensate = not matcher._is_valid_start_token(token)
+        if (i + 1 == len(sentence) and matcher._is_valid_end_token(token)
+                and len(token) >= matcher.min_match_length):
+            yield token.idx, token.idx + len(token), token.text
+        for j in range(i + 1, min(len(sentence), i + matcher.window) + 1):
+            if compensate:
+                compensate = False
+                continue
+            if sentence[j - 1].i in invalid_mid_tokens:
+                break
+            if not matcher._is_valid_end_token(sentence[j - 1]):
+                continue
+            span = sentence[i:j]
+            if not matcher._is_longer_than_min(span):
+                continue
+            text = ''.join(token.text_with_ws for token in span if token.i not in skip_in_span).strip()
+            yield span.start_char, span.end_char, text
+
+
+class TestMakeNgrams(TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        parse_and_encode_ngrams(drugs(), os.path.join(self.path, 'drugbank-simstring.db'),
+                                os.path.join(self.path, 'drugbank-db.db'), database_backend='unqlite')
+        self.matcher = DrugFinder(self.path, spacy_component=True, threshold=0.5)
+        # independent of the NLTK stopwords installed
+        self.matcher._stopwords = {'the', 'took', 'not', 'or'} | DRUGBANK_SPECIFIC_STOPWORDS
+        self.vocab = spacy.blank('en').vocab
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def test_ngrams(self):
+        doc = Doc(self.vocab, words=WORDS, pos=POS)
+        ngrams = list(self.matcher._make_ngrams(doc))
+        self.assertEqual(ngrams, NGRAMS)
+        self.assertEqual(ngrams, list(reference_ngrams(self.matcher, doc)))
+        # determiners never start a span, stopwords are not n-grams by themselves and do not end one
+        texts = [ngram for _, _, ngram in ngrams]
+        self.assertFalse(any(ngram.lower().startswith('the') for ngram in texts))
+        self.assertFalse(set(texts) & {'took', 'not', 'or', 'mg'})
+        self.assertFalse(any(ngram.endswith((' took', ' or', ' mg')) for ngram in texts))
+        # a span is cut at punctuation, but not at brackets or dashes
+        self.assertFalse(any(',' in ngram or '/' in ngram for _, _, ngram in ngrams))
+        self.assertIn((21, 36, 'Ritalin SR ( 10'), ngrams)
+        self.assertIn((70, 89, 'anti - inflammatory'), ngrams)
+
+    def test_sentence(self):
+        doc = Doc(self.vocab, words=WORDS * 2, pos=POS * 2)
+        for sentence in (doc[:len(WORDS)], doc[len(WORDS):], doc[3:15]):
+            for window in (1, 3, self.matcher.window):
+                self.matcher.window = window
+                self.assertEqual(list(self.matcher._make_ngrams(sentence)),
+                                 list(reference_ngrams(self.matcher, sentence)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,44 @@
+import unicodedata
+from unittest import TestCase, main
+
+from unidecode import unidecode
+
+from drugfinder.normalization import NormalizedText, normalize_term, transliterate
+
+
+def reference(ngram, normalize_unicode):
+    # the normalization of each n-gram before texts were normalized once
+    ngram = unidecode(ngram) if normalize_unicode else ngram
+    return ngram, unicodedata.normalize('NFKD', ngram.lower())
+
+
+class TestNormalization(TestCase):
+
+    def test_terms(self):
+        self.assertEqual(normalize_term('Ritalin SR'), 'ritalin sr')
+        self.assertEqual(normalize_term('Ácido Fólico'), unicodedata.normalize('NFKD', 'ácido fólico'))
+        self.assertEqual(normalize_term('Ácido Fólico', normalize_unicode=True), 'acido folico')
+        self.assertEqual(transliterate('Ácido', normalize_unicode=False), 'Ácido')
+
+    def test_offsets(self):
+        texts = ['Patients took Ritalin SR daily.',
+                 'Ácido fólico and ﬁlgrastim (ＡＢＣ) with étanercept, STRASSE and İbuprofen.']
+        for text in texts:
+            for normalize_unicode in (False, True):
+                normalized_text = NormalizedText(text, normalize_unicode)
+                for start in range(len(text)):
+                    for end in range(start + 1, min(len(text), start + 20) + 1):
+                        forms = normalized_text.get(start, end)
+                        if forms is not None:
+                            self.assertEqual(forms, reference(text[start:end], normalize_unicode))
+                self.assertIsNotNone(normalized_text.get(0, len(text)))
+
+    def test_fallback(self):
+        normalized_text = NormalizedText('e\u0301tanercept', False)
+        # the offset falls between a letter and its combining accent
+        self.assertIsNone(normalized_text.get(1, 5))
+        self.assertIsNone(NormalizedText('ΟΔΟΣ', False).get(0, 4))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,77 @@
+import os
+import shutil
+import tempfile
+from unittest import TestCase, main
+
+from drugfinder.core import DrugFinder
+from drugfinder.install import parse_and_encode_ngrams
+from drugfinder.overlay import LexiconOverlay, build_overlay
+from drugfinder.utils import DrugBankDB
+
+
+class TestOverlay(TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.lexicon_fp = os.path.join(self.path, 'lexicon.csv')
+        with open(self.lexicon_fp, 'w') as f:
+            f.write('term,drugbank_id,name\nStromectol,DB00602,\nZorblax,CUSTOM-1,Zorblaxin\n')
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def test_destination_guard(self):
+        overlay_fp = os.path.join(self.path, 'overlay')
+        self.assertEqual(build_overlay([self.lexicon_fp], overlay_fp), 2)
+        # an overlay is replaced
+        self.assertEqual(build_overlay([self.lexicon_fp], overlay_fp), 2)
+
+        other_fp = os.path.join(self.path, 'other')
+        os.makedirs(other_fp)
+        with open(os.path.join(other_fp, 'notes.txt'), 'w') as f:
+            f.write('keep me')
+        with self.assertRaises(IOError):
+            build_overlay([self.lexicon_fp], other_fp)
+        self.assertEqual(os.listdir(other_fp), ['notes.txt'])
+
+    def test_open_overlay_is_not_rebuilt(self):
+        overlay_fp = os.path.join(self.path, 'overlay')
+        build_overlay([self.lexicon_fp], overlay_fp)
+        overlay = LexiconOverlay(overlay_fp, similarity_name='cosine', threshold=0.7)
+        with self.assertRaises(IOError):
+            build_overlay([self.lexicon_fp], overlay_fp)
+        overlay.close()
+        self.assertEqual(build_overlay([self.lexicon_fp], overlay_fp), 2)
+
+    def test_get_many(self):
+        drugbank_fp = os.path.join(self.path, 'drugbank')
+        drugs = [{'drugbank_id': 'DB00602', 'name': 'Ivermectin', 'synonyms': '', 'products': ''}]
+        parse_and_encode_ngrams(iter(drugs), os.path.join(drugbank_fp, 'drugbank-simstring.db'),
+                                os.path.join(drugbank_fp, 'drugbank-db.db'), database_backend='unqlite')
+        overlay_fp = os.path.join(self.path, 'overlay')
+        build_overlay([self.lexicon_fp], overlay_fp)
+
+        base_db = DrugBankDB(os.path.join(drugbank_fp, 'drugbank-db.db'))
+        overlay = LexiconOverlay(overlay_fp, similarity_name='cosine', threshold=0.7)
+        keys_read = []
+        get_ids = overlay.drugbank_db._get_ids
+        overlay.drugbank_db._get_ids = lambda key: keys_read.append(key) or get_ids(key)
+
+        drugs = overlay.get_many(['stromectol', 'zorblax', 'stromectol', 'unknown'], base_db, normalized=True)
+        # each distinct term is read once; DrugBank ids without a record in the overlay use the base one
+        self.assertEqual(keys_read, ['stromectol', 'unknown', 'zorblax'])
+        self.assertEqual(drugs['stromectol'][0][0], 'DB00602')
+        self.assertEqual(drugs['stromectol'][0][1]['name'], 'Ivermectin')
+        self.assertEqual(drugs['zorblax'], [('CUSTOM-1', {'name': 'Zorblaxin'})])
+        self.assertEqual(overlay.get_ids_many(['Zorblax']), {'Zorblax': ('CUSTOM-1',)})
+        self.assertEqual(overlay.get('Zorblax', base_db), ('CUSTOM-1', {'name': 'Zorblaxin'}))
+        overlay.close()
+        base_db.close()
+
+        drug_finder = DrugFinder(drugbank_fp, tokenizer='rule', overlay_fp=overlay_fp)
+        matches = drug_finder.match('Patients took Stromectol and Zorblax.', ignore_syntax=True)
+        self.assertEqual([group[0]['drugbank_id'] for group in matches], ['DB00602', 'CUSTOM-1'])
+
+
+if __name__ == '__main__':
+    main()
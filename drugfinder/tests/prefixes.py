@@ -0,0 +1,39 @@
+import shutil
+import tempfile
+from unittest import TestCase, main
+
+from drugfinder.prefixes import PrefixIndex, build_prefix_index
+from drugfinder.tokenizer import RuleTokenizer
+
+
+class TestPrefixIndex(TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        build_prefix_index(['ritalin', 'ritalin sr', 'refludan', 'covid-19 vaccine'], self.path)
+        self.prefix_index = PrefixIndex(self.path)
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def test_max_tokens(self):
+        self.assertEqual(self.prefix_index.max_tokens('ritalin'), 2)
+        # a misspelled first token still shares n-grams with the terms
+        self.assertEqual(self.prefix_index.max_tokens('refludn'), 1)
+        self.assertEqual(self.prefix_index.max_tokens('covid-19'), 4)
+        self.assertEqual(self.prefix_index.max_tokens('patients'), 0)
+        self.assertEqual(self.prefix_index.max_tokens('-'), 0)
+
+    def test_pruned_windows(self):
+        text = 'patients took ritalin sr daily'
+        tokenizer = RuleTokenizer(stopwords={'took'})
+        tokens = tokenizer.tokenize(text)
+        limits = [self.prefix_index.max_tokens(text[start:end]) for start, end in tokens]
+        ngrams = [ngram for _, _, ngram in tokenizer.make_token_sequences(text, 5, 1, tokens, limits)]
+        self.assertEqual(ngrams, ['ritalin', 'ritalin sr'])
+        all_ngrams = [ngram for _, _, ngram in tokenizer.make_token_sequences(text, 5, 1, tokens)]
+        self.assertTrue(set(ngrams) < set(all_ngrams))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,42 @@
+import os
+import shutil
+import tempfile
+from unittest import TestCase, main
+
+from drugfinder.install import parse_and_encode_ngrams
+from drugfinder.utils import DrugBankDB
+
+
+def drugs():
+    yield {'drugbank_id': 'DB00422', 'name': 'Methylphenidate', 'synonyms': 'Ritalin', 'products': 'Ritalin SR'}
+    yield {'drugbank_id': 'DB00602', 'name': 'Ivermectin', 'synonyms': '', 'products': 'Stromectol'}
+
+
+class TestReadOnly(TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.db_dir = os.path.join(self.path, 'drugbank-db.db')
+        parse_and_encode_ngrams(drugs(), os.path.join(self.path, 'drugbank-simstring.db'), self.db_dir,
+                                database_backend='leveldb')
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def test_leveldb_readers(self):
+        # a process holding the lock of leveldb does not block the read-only readers
+        writer = DrugBankDB(self.db_dir, database_backend='leveldb')
+        readers = [DrugBankDB(self.db_dir, database_backend='leveldb', read_only=True) for _ in range(2)]
+        for reader in readers:
+            self.assertEqual(reader.get_ids('ritalin'), ['DB00422'])
+            self.assertEqual(reader.get_data('DB00602')['name'], 'Ivermectin')
+            with self.assertRaises(IOError):
+                reader.insert_term('zorblax', ['DB00602'])
+            reader.close()
+        writer.close()
+        # the snapshots of the readers do not change the installation
+        self.assertEqual(sorted(os.listdir(self.db_dir)), ['drugbank_data.leveldb', 'drugbank_id.leveldb'])
+
+
+if __name__ == '__main__':
+    main()
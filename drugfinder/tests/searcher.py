@@ -10,8 +10,8 @@ class TestSearch(TestCase):
     def setUp(self):
         drugbank_data = os.environ['DRUGBANK_DATA'] if 'DRUGBANK_DATA' in os.environ else os.path.join(Path.home(), 'drugbank_data')
         self.simstring_dir = os.path.join(drugbank_data, "drugbank-simstring.db")
-        drugbank_dir = os.path.join(drugbank_data, "drugbank-db.db")
-        self.drugbank_db = DrugBankDB(drugbank_dir)
+        self.drugbank_dir = os.path.join(drugbank_data, "drugbank-db.db")
+        self.drugbank_db = DrugBankDB(self.drugbank_dir)
 
     def test_cosine_search(self):
         simstring_db = SimstringDBReader(self.simstring_dir,
@@ -31,11 +31,8 @@ class TestSearch(TestCase):
                                                                 'dexamfetamine',
                                                                 'dexamfetamina',
                                                                 'dexamfetaminum',
-                                                                'lisdexamfetamine',
                                                                 'lisdexamfetamine'))
         self.assertEqual(simstring_db.get('Ivermectin'), ('ivermectin',
-                                                          'ivermectin',
-                                                          'ivermectin',
                                                           'ivermectine',
                                                           'ivermectina',
                                                           'ivermectinum'))
@@ -51,8 +48,6 @@ class TestSearch(TestCase):
         self.assertEqual(simstring_db.get('ritalin'), ('ritalin', ))
         self.assertEqual(simstring_db.get('lisdexamfetamine dimesylate'), ())
         self.assertEqual(simstring_db.get('Ivermectin'), ('ivermectin',
-                                                          'ivermectin',
-                                                          'ivermectin',
                                                           'ivermectine',
                                                           'ivermectina'))
 
@@ -60,6 +55,18 @@ class TestSearch(TestCase):
         self.assertEqual(self.drugbank_db.get('Refludan')[0], 'DB00001')
         self.assertEqual(self.drugbank_db.get('Ritalin')[0], 'DB00422')
         self.assertEqual(self.drugbank_db.get('Methylphenidate')[0], 'DB00422')
+        self.assertEqual([drugbank_id for drugbank_id, _ in self.drugbank_db.get_all('Ritalin')], ['DB00422'])
+
+    def test_preload(self):
+        preloaded_db = DrugBankDB(self.drugbank_dir, preload=True)
+        self.assertTrue(preloaded_db.preload_stats['records_complete'])
+        for term in ['Refludan', 'Ritalin', 'Methylphenidate', 'not a drug']:
+            self.assertEqual(preloaded_db.get(term), self.drugbank_db.get(term))
+
+        # terms and records that do not fit in the budget are read from disk
+        budget_db = DrugBankDB(self.drugbank_dir, preload=True, memory_budget=1024)
+        self.assertFalse(budget_db.preload_stats['records_complete'])
+        self.assertEqual(budget_db.get('Ritalin'), self.drugbank_db.get('Ritalin'))
 
 
 if __name__ == '__main__':
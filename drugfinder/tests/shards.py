@@ -0,0 +1,51 @@
+import argparse
+import os
+import tempfile
+from unittest import TestCase, main, mock
+from drugfinder.install import _extract, split_drugbank
+
+HEADER = b'<?xml version="1.0" encoding="UTF-8"?>\n<drugbank xmlns="http://www.drugbank.ca" version="5.1">\n'
+DRUG = (b'<drug type="small molecule">\n  <drugbank-id primary="true">DB0000%d</drugbank-id>\n'
+        b'  <pathways><pathway><drugs><drug><drugbank-id>DB00001</drugbank-id></drug></drugs></pathway></pathways>\n'
+        b'</drug>\n')
+
+
+class TestShards(TestCase):
+
+    def setUp(self):
+        fd, self.path = tempfile.mkstemp(suffix='.xml')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(HEADER + b''.join(DRUG % i for i in range(1, 6)) + b'</drugbank>\n')
+
+    def tearDown(self):
+        os.remove(self.path)
+
+    def test_split(self):
+        with open(self.path, 'rb') as f:
+            data = f.read()
+        for shard_size in (1, len(DRUG) * 2, len(data)):
+            header, shards = split_drugbank(self.path, shard_size=shard_size)
+            self.assertEqual(header, HEADER)
+            self.assertEqual(b''.join(data[start:end] for start, end in shards), b''.join(DRUG % i for i in range(1, 6)))
+            # nested drug elements are never a shard boundary
+            for start, _ in shards:
+                self.assertTrue(data[start:].startswith(b'<drug type='))
+        self.assertEqual(len(split_drugbank(self.path, shard_size=1)[1]), 5)
+
+    def test_jobs(self):
+        with mock.patch('drugfinder.install.extract_from_drugbank') as sequential, \
+                mock.patch('drugfinder.install.extract_from_drugbank_parallel') as parallel, \
+                mock.patch('os.cpu_count', return_value=2):
+            for jobs, expected in ((1, 1), (2, 2), (8, 2)):
+                opts = argparse.Namespace(jobs=jobs, drugbank_filepath=self.path, drugbank_schema_filepath=None)
+                _extract(opts)
+                self.assertEqual(opts.jobs, expected)
+            self.assertEqual(sequential.call_count, 1)
+            self.assertEqual(parallel.call_count, 2)
+            with mock.patch('os.cpu_count', return_value=1):
+                _extract(argparse.Namespace(jobs=4, drugbank_filepath=self.path, drugbank_schema_filepath=None))
+            self.assertEqual(sequential.call_count, 2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,143 @@
+import multiprocessing
+import os
+import shutil
+import tempfile
+from unittest import TestCase, main
+
+from drugfinder.core import DrugFinder
+from drugfinder.install import parse_and_encode_ngrams
+from drugfinder.sharedcache import SharedCache, WAYS
+from drugfinder.versions import publish_version, version_path
+
+DRUGS = {
+    'v1': [{'drugbank_id': 'DB00422', 'name': 'Methylphenidate', 'synonyms': 'Ritalin', 'products': 'Ritalin SR'},
+           {'drugbank_id': 'DB00602', 'name': 'Ivermectin', 'synonyms': '', 'products': 'Stromectol'}],
+    'v2': [{'drugbank_id': 'DB00602', 'name': 'Ivermectin', 'synonyms': 'Ritalin', 'products': ''}],
+}
+
+
+def _fill(name):
+    cache = SharedCache(name)
+    cache.put('ritalin', ('DB00422',))
+    cache.get('ritalin')
+    cache.close()
+
+
+class TestSharedCache(TestCase):
+
+    def setUp(self):
+        self.name = 'drugfinder-test-{}'.format(os.getpid())
+        self.cache = SharedCache(self.name, n_slots=64, slot_size=256)
+
+    def tearDown(self):
+        self.cache.unlink()
+        self.cache.close()
+
+    def test_get_put(self):
+        self.assertEqual(self.cache.get('ritalin'), (False, None))
+        self.assertTrue(self.cache.put('ritalin', ('DB00422',)))
+        self.assertEqual(self.cache.get('ritalin'), (True, ('DB00422',)))
+        self.assertTrue(self.cache.put('ritalin', ()))
+        self.assertEqual(self.cache.get('ritalin'), (True, ()))
+        self.assertFalse(self.cache.put('description', 'x' * 1000))
+
+        computed = []
+        values = self.cache.get_many(['a', 'b', 'a'], lambda keys: computed.extend(keys) or [k * 2 for k in keys],
+                                     namespace='ns:')
+        self.assertEqual(values, ['aa', 'bb', 'aa'])
+        self.assertEqual(self.cache.get_many(['b'], lambda keys: computed.extend(keys), namespace='ns:'), ['bb'])
+        self.assertEqual(computed, ['a', 'b'])
+
+    def test_eviction(self):
+        for i in range(64 * WAYS):
+            self.cache.put('term{}'.format(i), i)
+        stats = self.cache.stats
+        self.assertEqual(stats['inserts'], 64 * WAYS)
+        self.assertGreater(stats['evictions'], 0)
+        found = [self.cache.get('term{}'.format(i))[0] for i in range(64 * WAYS)]
+        self.assertLessEqual(sum(found), 64)
+
+    def test_processes(self):
+        # the geometry is the one of the segment, whatever the other processes ask for
+        process = multiprocessing.get_context('spawn').Process(target=_fill, args=(self.name,))
+        process.start()
+        process.join()
+        self.assertEqual(self.cache.get('ritalin'), (True, ('DB00422',)))
+        stats = self.cache.stats
+        self.assertEqual((stats['hits'], stats['misses'], stats['inserts']), (2, 0, 1))
+
+
+
+class TestDrugFinderSharedCache(TestCase):
+
+    text = 'Patients took Ritalin SR and Ivermectin.'
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.name = 'drugfinder-test-matcher-{}'.format(os.getpid())
+        self.install('v1')
+
+    def tearDown(self):
+        cache = SharedCache(self.name)
+        cache.unlink()
+        cache.close()
+        shutil.rmtree(self.path)
+
+    def install(self, version):
+        directory = version_path(self.path, version)
+        parse_and_encode_ngrams(iter([dict(drug) for drug in DRUGS[version]]),
+                                os.path.join(directory, 'drugbank-simstring.db'),
+                                os.path.join(directory, 'drugbank-db.db'), database_backend='unqlite')
+        publish_version(self.path, version, keep=2)
+
+    def matcher(self, threshold=0.5, **options):
+        matcher = DrugFinder(self.path, tokenizer='rule', threshold=threshold, **options)
+        if matcher.shared_cache is not None:
+            self.addCleanup(matcher.shared_cache.close)
+        return matcher
+
+    def match(self, matcher, text=None):
+        return matcher.match(self.text if text is None else text, ignore_syntax=True)
+
+    def test_matches(self):
+        matcher = self.matcher(shared_cache=self.name, shared_cache_slots=256, shared_cache_slot_size=4096)
+        expected = self.match(self.matcher())
+        self.assertEqual(self.match(matcher), expected)
+        hits = matcher.shared_cache_stats['hits']
+        self.assertEqual(self.match(matcher), expected)
+        self.assertGreater(matcher.shared_cache_stats['hits'], hits)
+        self.assertEqual(matcher.shared_cache_stats['oversized'], 0)
+
+        # candidates are cached by retrieval options: another threshold does not read them
+        other = self.matcher(threshold=0.9, shared_cache=self.name)
+        self.assertNotEqual(other._shared_namespace('candidates'), matcher._shared_namespace('candidates'))
+        self.assertEqual(other._shared_namespace('drugs'), matcher._shared_namespace('drugs'))
+
+        # terms that are not installed are cached as missing
+        for _ in range(2):
+            self.assertEqual(list(matcher._lookup_many(['ritalin', 'zorblax'], 'ids')), ['ritalin'])
+
+        # a new version is cached under the fingerprint of its files
+        self.install('v2')
+        namespace = matcher._shared_namespace('drugs')
+        self.assertTrue(matcher.reload())
+        self.assertNotEqual(matcher._shared_namespace('drugs'), namespace)
+        expected = self.match(self.matcher())
+        self.assertEqual([group[0]['drugbank_id'] for group in expected], ['DB00602', 'DB00602'])
+        self.assertEqual(self.match(matcher), expected)
+        self.assertEqual(self.match(matcher), expected)
+
+    def test_oversized(self):
+        # drug records do not fit in slots this small, and are looked up again each time
+        matcher = self.matcher(shared_cache=self.name, shared_cache_slots=256, shared_cache_slot_size=96)
+        expected = self.match(self.matcher())
+        for _ in range(2):
+            self.assertEqual(self.match(matcher), expected)
+        stats = matcher.shared_cache_stats
+        self.assertGreater(stats['oversized'], 0)
+        self.assertGreater(stats['oversized_rate'], 0)
+        self.assertEqual(stats['slot_size'], 96)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,44 @@
+import shutil
+import tempfile
+from unittest import TestCase, main, mock
+from drugfinder.simstring import SimstringDBReader, SimstringDBWriter
+from drugfinder.sparse import SparseDBReader, build_sparse_index, simstring_features
+
+
+class TestSparseRetrieval(TestCase):
+
+    terms = ['lepirudin', 'lepirudin recombinant', 'ritalin', 'ritalin-sr', 'ritalin la', 'ivermectin',
+             'ivermectin', 'ivermectine', 'stromectol', 'abcabc', 'ab']
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        simstring_db = SimstringDBWriter(self.path, filename='terms.simstring')
+        for term in self.terms:
+            simstring_db.insert(term)
+        simstring_db.close()
+        build_sparse_index(self.terms, self.path, filename='terms.simstring')
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def test_features(self):
+        self.assertEqual(simstring_features('ab'), ['ab\x01'])
+        self.assertEqual(simstring_features('abcabc'), ['abc', 'abc2', 'bca', 'cab'])
+
+    def test_same_candidates_as_simstring(self):
+        queries = ['Ivermectin', 'ivermectinivermectin', 'ritalin s', 'lepirudi', 'a', 'abcab', 'stromectol tablets']
+        for similarity_name in ('dice', 'jaccard', 'cosine', 'overlap'):
+            for threshold in (0.5, 0.7, 0.9):
+                simstring_db = SimstringDBReader(self.path, similarity_name, threshold, filename='terms.simstring')
+                sparse_db = SparseDBReader(self.path, similarity_name, threshold, filename='terms.simstring')
+                for query, candidates in zip(queries, sparse_db.get_many(queries)):
+                    self.assertEqual(sorted(candidates), sorted(simstring_db.get(query)))
+
+    def test_missing_scipy(self):
+        with mock.patch('drugfinder.sparse.SCIPY_AVAILABLE', False):
+            with self.assertRaisesRegex(ImportError, r'drugfinder\[sparse\]'):
+                SparseDBReader(self.path, 'cosine', 0.7, filename='terms.simstring')
+
+
+if __name__ == '__main__':
+    main()
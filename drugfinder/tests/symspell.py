@@ -0,0 +1,36 @@
+import shutil
+import tempfile
+from unittest import TestCase, main
+from drugfinder.symspell import SymSpellDB, build_symspell_index, deletes, edit_distance
+
+
+class TestSymSpell(TestCase):
+
+    terms = ['ritalin', 'ritalin sr', 'refludan', 'stromectol', 'asa', 'methylphenidatum']
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        build_symspell_index(self.terms, self.path, 'unqlite', max_term_length=10, max_distance=2)
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def test_edit_distance(self):
+        self.assertEqual(edit_distance('ritalin', 'ritlain', 2), 1)
+        self.assertEqual(edit_distance('kitten', 'sitting', 3), 3)
+        self.assertIsNone(edit_distance('kitten', 'sitting', 2))
+        self.assertEqual(deletes('abc', 1), {'abc', 'bc', 'ac', 'ab'})
+
+    def test_lookup(self):
+        symspell_db = SymSpellDB(self.path, 'unqlite')
+        self.assertEqual(symspell_db.lookup('Ritlain'), [('ritalin', 1)])
+        self.assertEqual(symspell_db.lookup('refludn', max_distance=1), [('refludan', 1)])
+        self.assertEqual(symspell_db.lookup('stromectl'), [('stromectol', 1)])
+        # longer terms are not indexed
+        self.assertEqual(symspell_db.lookup('methylphenidatun'), [])
+        self.assertEqual(symspell_db.lookup('ritalin s'), [('ritalin sr', 1), ('ritalin', 2)])
+        symspell_db.close()
+
+
+if __name__ == '__main__':
+    main()
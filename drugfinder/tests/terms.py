@@ -0,0 +1,100 @@
+import os
+import shutil
+import tempfile
+from unittest import TestCase, main
+from drugfinder.install import parse_and_encode_ngrams, read_drug_hashes, upgrade_drugbank, write_symspell_index
+from drugfinder.simstring import SimstringDBReader
+from drugfinder.sparse import SparseDBReader
+from drugfinder.symspell import SymSpellDB
+from drugfinder.utils import DrugBankDB, get_drug_terms
+
+
+def drugs(aspirin_synonyms):
+    yield {'drugbank_id': 'DB00945', 'name': 'Aspirin', 'synonyms': aspirin_synonyms, 'products': 'Aspirin'}
+    yield {'drugbank_id': 'DB00316', 'name': 'Acetaminophen', 'synonyms': 'Paracetamol;APAP', 'products': 'Tylenol'}
+
+
+class TestTermMapping(TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.simstring_dir = os.path.join(self.path, 'drugbank-simstring.db')
+        self.drugbank_dir = os.path.join(self.path, 'drugbank-db.db')
+        self.manifest_fp = os.path.join(self.path, 'drugbank-hashes.json')
+        parse_and_encode_ngrams(drugs('Acetylsalicylic acid;APAP'), self.simstring_dir, self.drugbank_dir,
+                                database_backend='unqlite', manifest_fp=self.manifest_fp)
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def test_deduplicated_terms(self):
+        simstring_db = SimstringDBReader(self.simstring_dir, similarity_name='cosine', threshold=0.7,
+                                         filename='drug-terms.simstring')
+        self.assertEqual(simstring_db.get('aspirin'), ('aspirin',))
+        drugbank_db = DrugBankDB(self.drugbank_dir)
+        self.assertEqual(drugbank_db.get_ids('APAP'), ['DB00945', 'DB00316'])
+        self.assertEqual([drugbank_id for drugbank_id, _ in drugbank_db.get_all('apap')], ['DB00945', 'DB00316'])
+        self.assertEqual(drugbank_db.get('Tylenol')[0], 'DB00316')
+        drugbank_db.close()
+
+    def test_upgrade(self):
+        stats = upgrade_drugbank(drugs('Acetylsalicylic acid'), self.simstring_dir, self.drugbank_dir,
+                                 database_backend='unqlite', manifest_fp=self.manifest_fp)
+        self.assertEqual(stats['terms_changed'], 1)
+        self.assertFalse(stats['simstring_rebuilt'])
+        drugbank_db = DrugBankDB(self.drugbank_dir)
+        self.assertEqual(drugbank_db.get_ids('apap'), ['DB00316'])
+        drugbank_db.close()
+
+    def test_upgrade_removed_term(self):
+        # indexes built by `--sparse-index` and `--symspell`
+        shutil.rmtree(self.simstring_dir)
+        shutil.rmtree(self.drugbank_dir)
+        parse_and_encode_ngrams(drugs('Acetylsalicylic acid;APAP'), self.simstring_dir, self.drugbank_dir,
+                                database_backend='unqlite', manifest_fp=self.manifest_fp, sparse_index=True)
+        symspell_dir = os.path.join(self.path, 'drugbank-symspell.db')
+        write_symspell_index(symspell_dir, read_drug_hashes(self.manifest_fp), 'unqlite', max_term_length=25,
+                             max_distance=2)
+
+        stats = upgrade_drugbank(drugs(''), self.simstring_dir, self.drugbank_dir, database_backend='unqlite',
+                                 manifest_fp=self.manifest_fp, symspell_dir=symspell_dir)
+        self.assertEqual(stats['removed'], 0)
+        self.assertTrue(stats['simstring_rebuilt'])
+        self.assertEqual(sorted(os.listdir(self.path)),
+                         ['drugbank-db.db', 'drugbank-hashes.json', 'drugbank-simstring.db', 'drugbank-symspell.db'])
+
+        simstring_db = SimstringDBReader(self.simstring_dir, similarity_name='cosine', threshold=0.7,
+                                         filename='drug-terms.simstring')
+        self.assertEqual(simstring_db.get('acetylsalicylic acid'), ())
+        self.assertEqual(simstring_db.get('aspirin'), ('aspirin',))
+        sparse_db = SparseDBReader(self.simstring_dir, 'cosine', 0.7, filename='drug-terms.simstring')
+        self.assertEqual(sparse_db.get_many(['acetylsalicylic acid', 'aspirin']), [(), ('aspirin',)])
+        sparse_db.close()
+        symspell_db = SymSpellDB(symspell_dir, 'unqlite')
+        self.assertEqual(symspell_db.lookup('acetylsalicylic acd'), [])
+        self.assertEqual(symspell_db.lookup('aspirn'), [('aspirin', 1)])
+        symspell_db.close()
+        drugbank_db = DrugBankDB(self.drugbank_dir)
+        self.assertEqual(drugbank_db.get_ids('acetylsalicylic acid'), [])
+        self.assertEqual(drugbank_db.get_ids('apap'), ['DB00316'])
+        drugbank_db.close()
+
+    def test_separator(self):
+        # the installer joins synonyms and products with ';', and names of drugs may contain commas
+        drug = {'drugbank_id': 'DB00945', 'name': 'Aspirin', 'synonyms': 'Acid, acetylsalicylic;ASA',
+                'products': 'Aspirin;Bayer Aspirin'}
+        self.assertEqual(get_drug_terms(drug), ['aspirin', 'acid, acetylsalicylic', 'asa', 'bayer aspirin'])
+
+        # `DrugBankDB.insert` maps the same terms as the installer
+        drugbank_dir = os.path.join(self.path, 'insert-db.db')
+        os.makedirs(drugbank_dir)
+        drugbank_db = DrugBankDB(drugbank_dir)
+        drugbank_db.insert(dict(drug))
+        for term in get_drug_terms(drug):
+            self.assertEqual(drugbank_db.get_ids(term), ['DB00945'])
+        self.assertEqual(drugbank_db.get_ids('acid'), [])
+        drugbank_db.close()
+
+
+if __name__ == '__main__':
+    main()
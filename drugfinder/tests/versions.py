@@ -0,0 +1,144 @@
+import os
+import shutil
+import tempfile
+from unittest import TestCase, main
+
+from drugfinder.core import DrugFinder
+from drugfinder.install import parse_and_encode_ngrams
+from drugfinder.utils import InstallLock, mkdir
+from drugfinder.versions import (copy_version, current_version, publish_version, read_manifest, remove_version,
+                                 resolve_installation, version_path)
+
+DRUGS = {
+    'v1': {'drugbank_id': 'DB00602', 'name': 'Ivermectin', 'synonyms': '', 'products': 'Stromectol'},
+    'v2': {'drugbank_id': 'DB00422', 'name': 'Methylphenidate', 'synonyms': 'Ritalin', 'products': ''},
+    'v3': {'drugbank_id': 'DB00316', 'name': 'Acetaminophen', 'synonyms': 'Paracetamol', 'products': ''},
+}
+
+
+class TestVersions(TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def install(self, version):
+        mkdir(version_path(self.path, version))
+        publish_version(self.path, version, keep=2)
+
+    def test_unversioned(self):
+        self.assertEqual(resolve_installation(self.path), (None, self.path))
+
+    def test_publish(self):
+        self.install("v1")
+        self.install("v2")
+        self.assertEqual(resolve_installation(self.path), ("v2", version_path(self.path, "v2")))
+        self.install("v3")
+        # only the two most recent versions are kept
+        self.assertEqual([entry["name"] for entry in read_manifest(self.path)["versions"]], ["v2", "v3"])
+        self.assertFalse(os.path.exists(version_path(self.path, "v1")))
+
+    def test_version_in_use_is_kept(self):
+        self.install("v1")
+        reader_lock = InstallLock(version_path(self.path, "v1"))
+        self.install("v2")
+        self.install("v3")
+        self.assertEqual(current_version(self.path)[0], "v3")
+        self.assertTrue(os.path.exists(version_path(self.path, "v1")))
+        reader_lock.release()
+        # removed by the next install
+        self.install("v4")
+        self.assertFalse(os.path.exists(version_path(self.path, "v1")))
+
+    def test_copy(self):
+        self.install("v1")
+        directory = version_path(self.path, "v1")
+        for store in ("drugbank-db.db", "drugbank-simstring.db"):
+            mkdir(os.path.join(directory, store))
+            with open(os.path.join(directory, store, "data"), "w") as f:
+                f.write(store)
+        lock = InstallLock(directory)
+
+        new_directory = copy_version(self.path, "v1", "v2", modified=("drugbank-db.db",))
+        lock.release()
+        self.assertEqual(sorted(os.listdir(new_directory)), ["drugbank-db.db", "drugbank-simstring.db"])
+        # only the stores written in place are copied
+        for store, shared in (("drugbank-db.db", False), ("drugbank-simstring.db", True)):
+            fp = os.path.join(store, "data")
+            self.assertEqual(os.path.samefile(os.path.join(directory, fp), os.path.join(new_directory, fp)), shared)
+            with open(os.path.join(new_directory, fp)) as f:
+                self.assertEqual(f.read(), store)
+
+
+class TestReload(TestCase):
+
+    text = 'Patients took Ivermectin, Ritalin and Paracetamol.'
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def install(self, version, keep=1):
+        directory = version_path(self.path, version)
+        parse_and_encode_ngrams(iter([dict(DRUGS[version])]), os.path.join(directory, 'drugbank-simstring.db'),
+                                os.path.join(directory, 'drugbank-db.db'), database_backend='unqlite')
+        publish_version(self.path, version, keep=keep)
+
+    def matched(self, drug_finder):
+        return [group[0]['ngram'] for group in drug_finder.match(self.text, ignore_syntax=True)]
+
+    def test_reload(self):
+        self.install('v1')
+        drug_finder = DrugFinder(self.path, tokenizer='rule')
+        self.assertEqual(self.matched(drug_finder), ['Ivermectin'])
+        self.assertFalse(drug_finder.reload())
+
+        # the reader is not read-only, and still keeps the version it has open
+        self.install('v2')
+        self.assertTrue(os.path.exists(version_path(self.path, 'v1')))
+        self.assertEqual(self.matched(drug_finder), ['Ivermectin'])
+
+        self.assertTrue(drug_finder.reload())
+        self.assertEqual(drug_finder._indexes.version, 'v2')
+        self.assertEqual(self.matched(drug_finder), ['Ritalin'])
+        # the replaced version was closed, so the next install removes it
+        self.install('v3')
+        self.assertFalse(os.path.exists(version_path(self.path, 'v1')))
+        self.assertTrue(os.path.exists(version_path(self.path, 'v2')))
+        drug_finder._indexes.retire()
+
+    def test_pinned_version(self):
+        self.install('v1')
+        drug_finder = DrugFinder(self.path, tokenizer='rule')
+        self.install('v2', keep=2)
+        with drug_finder._pinned_indexes() as indexes:
+            self.assertTrue(drug_finder.reload())
+            # the request keeps the version it started on, which is retired but not closed
+            self.assertEqual(indexes.version, 'v1')
+            self.assertEqual(self.matched(drug_finder), ['Ivermectin'])
+            self.assertFalse(remove_version(self.path, 'v1'))
+        # a request started after the swap uses the new version
+        self.assertEqual(self.matched(drug_finder), ['Ritalin'])
+        self.assertTrue(remove_version(self.path, 'v1'))
+        drug_finder._indexes.retire()
+
+    def test_retire_and_release(self):
+        self.install('v1')
+        drug_finder = DrugFinder(self.path, tokenizer='rule')
+        indexes = drug_finder._acquire_indexes()
+        indexes.acquire()
+        indexes.retire()
+        indexes.release()
+        self.assertFalse(remove_version(self.path, 'v1'))
+        # closed by the last release
+        indexes.release()
+        self.install('v2')
+        self.assertFalse(os.path.exists(version_path(self.path, 'v1')))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,67 @@
+import itertools
+import re
+
+from drugfinder import constants
+from drugfinder.prefixes import count_tokens
+
+_BRACKETS = set("()[]{}")
+
+
+class RuleTokenizer(object):
+    """Rule-based tokenizer used to match with `ignore_syntax=True` without loading a spaCy model.
+
+    Tokens are runs of word characters, optionally joined by any of `constants.UNICODE_DASHES`
+    (e.g. `COVID-19`), or single symbols. Windows follow the same rules as `DrugFinder._make_ngrams`
+    for stopwords and punctuation: they neither start nor end with a stopword or a symbol, and they
+    do not extend over a symbol other than a dash or a bracket.
+    """
+
+    def __init__(self, stopwords, valid_punctuation=None):
+        self.stopwords = stopwords
+        self.valid_punctuation = constants.UNICODE_DASHES if valid_punctuation is None else valid_punctuation
+        dashes = "".join(re.escape(dash) for dash in sorted(self.valid_punctuation))
+        self._token_re = re.compile(r"\w+(?:[{0}]\w+)*|[^\w\s]".format(dashes))
+
+    def tokenize(self, text):
+        """Returns the (start, end) character offsets of the tokens of the text."""
+        return [m.span() for m in self._token_re.finditer(text)]
+
+    def make_token_sequences(self, text, window, min_match_length, tokens=None, limits=None):
+        """Yields (start, end, text) for every valid window of up to `window` tokens.
+
+        `limits` optionally gives, for each token, the largest number of tokens of the prefix index
+        (`drugfinder.prefixes`) a window starting with it can have; tokens with a limit of 0 start none.
+        """
+        if tokens is None:
+            tokens = self.tokenize(text)
+
+        words = [text[start:end] for start, end in tokens]
+        is_word = [word[0].isalnum() or word[0] == "_" for word in words]
+        valid_edge = [w and word not in self.stopwords for w, word in zip(is_word, words)]
+        valid_middle = [
+            w or word in self.valid_punctuation or word in _BRACKETS for w, word in zip(is_word, words)
+        ]
+
+        if limits is not None:
+            term_tokens = list(itertools.accumulate((count_tokens(word) for word in words), initial=0))
+
+        for i in range(len(tokens)):
+            if not valid_edge[i] or (limits is not None and limits[i] == 0):
+                continue
+
+            start = tokens[i][0]
+            for j in range(i, min(i + window, len(tokens))):
+                if not valid_middle[j]:
+                    break
+
+                if limits is not None and term_tokens[j + 1] - term_tokens[i] > limits[i]:
+                    break
+
+                if not valid_edge[j]:
+                    continue
+
+                end = tokens[j][1]
+                if end - start < min_match_length:
+                    continue
+
+                yield start, end, text[start:end]
@@ -2,21 +2,42 @@ from __future__ import division, print_function, unicode_literals
 
 import unicodedata
 import argparse
+import contextlib
+import fcntl
 import logging
 import os
 import pickle
+import shutil
+import sys
+import tempfile
+import time
 
 import numpy
 
 from quickumls.toolbox import make_ngrams
 
+from drugfinder.encoding import RecordCodec, train_zdict
+from drugfinder.normalization import normalize_term
+
 try:
     import unqlite
     UNQLITE_AVAILABLE = True
 except ImportError:
-    import leveldb
     UNQLITE_AVAILABLE = False
 
+try:
+    import leveldb
+    LEVELDB_AVAILABLE = True
+except ImportError:
+    LEVELDB_AVAILABLE = False
+
+# open flags of unqlite, not exposed by its python bindings
+UNQLITE_OPEN_READONLY = 0x00000001
+UNQLITE_OPEN_MMAP = 0x00000100
+
+# advisory lock held shared by readers and exclusively by installers of an installation directory
+LOCK_FILENAME = ".drugfinder.lock"
+
 
 def parse_args():
     ap = argparse.ArgumentParser()
@@ -45,6 +66,67 @@ def parse_args():
         default="unqlite",
         help="Key-Value database used to store drugbank-ids and drug data",
     )
+    ap.add_argument(
+        "--record-format",
+        choices=("pickle", "compact"),
+        default="pickle",
+        help="Encoding of the term mappings and drug records; `compact` is a smaller, versioned binary format, "
+             "but slower to decode than pickle"
+    )
+    ap.add_argument(
+        "--compress-records",
+        action="store_true",
+        help="Compress the text fields of `--record-format compact` drug records with a dictionary trained on "
+             "the first drugs; records get about half as large, and slower to decode"
+    )
+    ap.add_argument(
+        "--sparse-index",
+        action="store_true",
+        help="Also build the trigram matrix used by `DrugFinder(retrieval_engine='sparse')`"
+    )
+    ap.add_argument(
+        "--symspell",
+        action="store_true",
+        help="Also build a deletion index for edit distance lookups of short terms"
+    )
+    ap.add_argument(
+        "--symspell-max-length",
+        type=int,
+        default=10,
+        help="Longest term, in characters, indexed by `--symspell`"
+    )
+    ap.add_argument(
+        "--symspell-max-distance",
+        type=int,
+        default=2,
+        help="Largest edit distance supported by the `--symspell` index"
+    )
+    ap.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=1,
+        help="Number of processes parsing the DrugBank XML, at most the number of CPUs; a single process writes "
+             "the installation. Defaults to 1, sequential parsing"
+    )
+    ap.add_argument(
+        "--upgrade",
+        action="store_true",
+        help="Upgrade an existing installation in place, or a copy of its current version if it is versioned, "
+             "rewriting only the drugs that changed"
+    )
+    ap.add_argument(
+        "--versioned",
+        action="store_true",
+        help="Install in a new version directory and make it current once complete, so that running "
+             "processes can switch to it with `DrugFinder.reload`; implied for versioned installations"
+    )
+    ap.add_argument(
+        "--keep-versions",
+        type=int,
+        default=2,
+        help="Number of versions kept by versioned installs and upgrades, the current one included"
+    )
     opts = ap.parse_args()
     return opts
 
@@ -57,6 +139,19 @@ def mkdir(path):
         return False
 
 
+def read_record_format(path):
+    """Returns the record format of an installation; installs without `record-format.flag` use pickle."""
+    record_format_fp = os.path.join(path, "record-format.flag")
+    if not os.path.exists(record_format_fp):
+        return "pickle"
+    with open(record_format_fp) as f:
+        return f.read().strip()
+
+
+# separator of the synonyms and of the products of a drug record
+TERM_SEPARATOR = ";"
+
+
 def safe_unicode(s):
     return "{}".format(unicodedata.normalize("NFKD", s))
 
@@ -65,37 +160,314 @@ def db_key_encode(term):
     return term.encode("utf-8")
 
 
+def get_drug_terms(drug):
+    """Returns the distinct normalized terms (name, synonyms and products) under which a drug is indexed.
+
+    Synonyms and products are joined with `TERM_SEPARATOR` by the installer; names may contain commas.
+    """
+    terms = [drug['name']]
+    terms.extend(drug.get('synonyms', '').split(TERM_SEPARATOR))
+    terms.extend(drug.get('products', '').split(TERM_SEPARATOR))
+    return list(dict.fromkeys(normalize_term(term) for term in terms if len(term) > 0))
+
+
+def _load_ids(value):
+    # installs made before terms were deduplicated store a single drugbank id per term
+    drugbank_ids = pickle.loads(value)
+    if isinstance(drugbank_ids, str):
+        return (drugbank_ids,)
+    return tuple(drugbank_ids)
+
+
+# approximate cost of one slot of a Python dict
+_DICT_ENTRY_SIZE = 3 * 8
+
+
+def _sizeof(obj):
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(sys.getsizeof(k) + _sizeof(v) + _DICT_ENTRY_SIZE for k, v in obj.items())
+    elif isinstance(obj, (list, tuple)):
+        size += sum(_sizeof(v) for v in obj)
+    return size
+
+
+class InstallLock(object):
+    """Advisory lock on an installation directory.
+
+    Processes that read an installation hold the lock shared, so any number of them can use it at
+    the same time, while `drugfinder.install` holds it exclusively. Whoever comes second gets an
+    IOError instead of reading a half-written installation or overwriting one in use.
+    """
+
+    def __init__(self, path, exclusive=False):
+        self.path = os.path.join(path, LOCK_FILENAME)
+        self._fd = None
+        try:
+            self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        except OSError:
+            if exclusive or not os.path.exists(self.path):
+                # installations on read-only storage cannot be written by anybody
+                if exclusive:
+                    raise
+                return
+            self._fd = os.open(self.path, os.O_RDONLY)
+
+        try:
+            fcntl.flock(self._fd, (fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH) | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(self._fd)
+            self._fd = None
+            if exclusive:
+                err_msg = '"{}" is in use by other processes; stop them before installing'.format(path)
+            else:
+                err_msg = '"{}" is being installed or upgraded by another process'.format(path)
+            raise IOError(err_msg)
+
+    def release(self):
+        if self._fd is not None:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+            os.close(self._fd)
+            self._fd = None
+
+
+def empty_directory(path):
+    """Removes the content of an installation directory, except its lock file."""
+    for filename in os.listdir(path):
+        if filename == LOCK_FILENAME:
+            continue
+        filepath = os.path.join(path, filename)
+        if os.path.isdir(filepath):
+            shutil.rmtree(filepath)
+        else:
+            os.remove(filepath)
+
+
+def _read_only(*args):
+    raise IOError("The database was opened read-only")
+
+
+def _open_leveldb(path):
+    try:
+        return leveldb.LevelDB(path, create_if_missing=True)
+    except leveldb.LevelDBError as err:
+        raise IOError('Could not open "{}": {}'.format(path, err))
+
+
+@contextlib.contextmanager
+def _leveldb_snapshot(path):
+    """Opens a private copy of a leveldb database, removed on exit.
+
+    leveldb allows a single process per database, even for reading, so read-only readers each load
+    their own copy instead of waiting for each other. Table files are never modified once written:
+    they are hard-linked when the temporary directory is on the same filesystem, and copied otherwise.
+    The installation must not change meanwhile, which the shared `InstallLock` of the readers ensures.
+    """
+    snapshot = tempfile.mkdtemp(prefix="drugfinder-leveldb-")
+    try:
+        for filename in os.listdir(path):
+            if filename == "LOCK":
+                continue
+            if filename.endswith((".ldb", ".sst")):
+                try:
+                    os.link(os.path.join(path, filename), os.path.join(snapshot, filename))
+                    continue
+                except OSError:
+                    pass
+            shutil.copy(os.path.join(path, filename), os.path.join(snapshot, filename))
+        try:
+            db = leveldb.LevelDB(snapshot, create_if_missing=False)
+        except leveldb.LevelDBError as err:
+            raise IOError('Could not open "{}": {}'.format(path, err))
+        yield db
+    finally:
+        shutil.rmtree(snapshot, ignore_errors=True)
+
+
 class DrugBankDB(object):
-    def __init__(self, path, database_backend="unqlite"):
+    def __init__(self, path, database_backend="unqlite", preload=False, memory_budget=None, read_only=False,
+                 record_format="pickle"):
         if not (os.path.exists(path) or os.path.isdir(path)):
             err_msg = '"{}" is not a valid directory'.format(path)
             raise IOError(err_msg)
 
+        self.path = path
+        self.database_backend = database_backend
+        self.record_format = record_format
+        if record_format == "pickle":
+            self._encode_ids, self._decode_ids = pickle.dumps, _load_ids
+            self._encode_record, self._decode_record = pickle.dumps, pickle.loads
+        elif record_format == "compact":
+            self.codec = RecordCodec.load(path)
+            self._encode_ids, self._decode_ids = self.codec.encode_ids, self.codec.decode_ids
+            self._encode_record, self._decode_record = self.codec.encode_record, self.codec.decode_record
+        else:
+            raise ValueError(f"record_format {record_format} not recognized")
+        self.read_only = read_only
+        self._install_lock = None
+        if read_only:
+            self._install_lock = InstallLock(os.path.dirname(os.path.abspath(path)))
+
         if database_backend == "unqlite":
             assert UNQLITE_AVAILABLE, (
                 "You selected unqlite as database backend, but it is not "
                 "installed. Please install it via `pip install unqlite`"
             )
-            self.drugbank_db = unqlite.UnQLite(os.path.join(path, "drugbank_id.unqlite"))
+            if read_only:
+                # read-only memory-mapped files can be shared by any number of processes
+                flags = UNQLITE_OPEN_READONLY | UNQLITE_OPEN_MMAP
+                self.drugbank_db = unqlite.UnQLite(os.path.join(path, "drugbank_id.unqlite"), flags=flags)
+                self.drugbank_data_db = unqlite.UnQLite(os.path.join(path, "drugbank_data.unqlite"), flags=flags)
+            else:
+                self.drugbank_db = unqlite.UnQLite(os.path.join(path, "drugbank_id.unqlite"))
+                self.drugbank_data_db = unqlite.UnQLite(os.path.join(path, "drugbank_data.unqlite"))
             self.drugbank_db_put = self.drugbank_db.store
             self.drugbank_db_get = self.drugbank_db.fetch
-            self.drugbank_data_db = unqlite.UnQLite(os.path.join(path, "drugbank_data.unqlite"))
+            self.drugbank_db_items = self.drugbank_db.items
+            self.drugbank_db_delete = self.drugbank_db.delete
             self.drugbank_data_db_put = self.drugbank_data_db.store
             self.drugbank_data_db_get = self.drugbank_data_db.fetch
+            self.drugbank_data_db_items = self.drugbank_data_db.items
+            self.drugbank_data_db_delete = self.drugbank_data_db.delete
         elif database_backend == "leveldb":
-            self.drugbank_db = leveldb.LevelDB(os.path.join(path, "drugbank_id.leveldb"))
-            self.drugbank_db_put = self.drugbank_db.Put
-            self.drugbank_db_get = self.drugbank_db.Get
-            self.drugbank_data_db = leveldb.LevelDB(os.path.join(path, "drugbank_data.leveldb"))
-            self.drugbank_data_db_put = self.drugbank_data_db.Put
-            self.drugbank_data_db_get = self.drugbank_data_db.Get
+            assert LEVELDB_AVAILABLE, (
+                "You selected leveldb as database backend, but it is not "
+                "installed. Please install it via `pip install leveldb`"
+            )
+            # read-only databases are opened from snapshots once preloaded, below
+            if not read_only:
+                self._bind_leveldb(_open_leveldb(os.path.join(path, "drugbank_id.leveldb")),
+                                   _open_leveldb(os.path.join(path, "drugbank_data.leveldb")))
         else:
             raise ValueError(f"database_backend {database_backend} not recognized")
 
+        # in-memory copies of the two stores, filled by `preload`
+        self._terms = None
+        self._terms_complete = False
+        self._data = None
+        self._data_complete = False
+        self.preload_stats = None
+        if read_only:
+            self.drugbank_db_put = self.drugbank_data_db_put = _read_only
+            self.drugbank_db_delete = self.drugbank_data_db_delete = _read_only
+
+        if read_only and database_backend == "leveldb":
+            # the lock of leveldb cannot be shared, so the data is loaded in memory from private snapshots
+            if memory_budget is not None:
+                logging.warning("memory_budget is ignored by read-only leveldb databases")
+            with _leveldb_snapshot(os.path.join(path, "drugbank_id.leveldb")) as drugbank_db, \
+                    _leveldb_snapshot(os.path.join(path, "drugbank_data.leveldb")) as drugbank_data_db:
+                self._bind_leveldb(drugbank_db, drugbank_data_db)
+                self.preload()
+                self._release_handles()
+            self.drugbank_db_put = self.drugbank_data_db_put = _read_only
+            self.drugbank_db_delete = self.drugbank_data_db_delete = _read_only
+        elif preload:
+            self.preload(memory_budget=memory_budget)
+
+    def _bind_leveldb(self, drugbank_db, drugbank_data_db):
+        self.drugbank_db = drugbank_db
+        self.drugbank_db_put = drugbank_db.Put
+        self.drugbank_db_get = drugbank_db.Get
+        self.drugbank_db_items = drugbank_db.RangeIter
+        self.drugbank_db_delete = drugbank_db.Delete
+        self.drugbank_data_db = drugbank_data_db
+        self.drugbank_data_db_put = drugbank_data_db.Put
+        self.drugbank_data_db_get = drugbank_data_db.Get
+        self.drugbank_data_db_items = drugbank_data_db.RangeIter
+        self.drugbank_data_db_delete = drugbank_data_db.Delete
+
+    @staticmethod
+    def _iter_items(items):
+        for key, value in items():
+            if not isinstance(key, str):
+                key = bytes(key).decode("utf-8")
+            yield key, bytes(value)
+
+    def preload(self, memory_budget=None):
+        """Loads the term -> drugbank_ids map and the drug records into memory.
+
+        The term map is loaded first, then the drug records. Loading stops as soon as the estimated
+        size of the loaded objects would exceed `memory_budget` (in bytes); entries that did not fit
+        are still read from disk by `get`.
+
+        Returns:
+            Dict: number of terms and records loaded, estimated size in bytes, elapsed seconds and
+                whether each store fit entirely in memory. Also kept in `preload_stats`.
+        """
+        start = time.time()
+        used = 0
+        self._terms, self._terms_complete = {}, True
+        self._data, self._data_complete = {}, False
+        for key, value in self._iter_items(self.drugbank_db_items):
+            drugbank_ids = tuple(sys.intern(drugbank_id) for drugbank_id in self._decode_ids(value))
+            size = sys.getsizeof(key) + sys.getsizeof(drugbank_ids) + _DICT_ENTRY_SIZE
+            if memory_budget is not None and used + size > memory_budget:
+                self._terms_complete = False
+                break
+            self._terms[key] = drugbank_ids
+            used += size
+
+        if self._terms_complete:
+            self._data_complete = True
+            for key, value in self._iter_items(self.drugbank_data_db_items):
+                drug = self._decode_record(value)
+                size = _sizeof(drug) + sys.getsizeof(key) + _DICT_ENTRY_SIZE
+                if memory_budget is not None and used + size > memory_budget:
+                    self._data_complete = False
+                    break
+                self._data[sys.intern(key)] = drug
+                used += size
+
+        self.preload_stats = {
+            "terms": len(self._terms),
+            "records": len(self._data),
+            "bytes": used,
+            "seconds": time.time() - start,
+            "terms_complete": self._terms_complete,
+            "records_complete": self._data_complete,
+        }
+        logging.info("Preloaded {terms:,} terms and {records:,} drug records ({bytes:,} bytes) "
+                     "in {seconds:.2f} s".format(**self.preload_stats))
+        return self.preload_stats
+
+    def _get_ids(self, term):
+        if self._terms is not None:
+            try:
+                return self._terms[term]
+            except KeyError:
+                if self._terms_complete:
+                    raise
+        return self._decode_ids(self.drugbank_db_get(db_key_encode(term)))
+
+    def _get_data(self, drugbank_id):
+        if self._data is not None:
+            try:
+                return self._data[drugbank_id]
+            except KeyError:
+                if self._data_complete:
+                    raise
+        return self._decode_record(self.drugbank_data_db_get(db_key_encode(drugbank_id)))
+
+    def close(self):
+        if self.drugbank_db is not None and self.database_backend == "unqlite":
+            self.drugbank_db.close()
+            self.drugbank_data_db.close()
+        self._release_handles()
+        if self._install_lock is not None:
+            self._install_lock.release()
+
+    def _release_handles(self):
+        # leveldb releases its lock once every reference to the database is gone
+        self.drugbank_db = self.drugbank_db_put = self.drugbank_db_get = None
+        self.drugbank_db_items = self.drugbank_db_delete = None
+        self.drugbank_data_db = self.drugbank_data_db_put = self.drugbank_data_db_get = None
+        self.drugbank_data_db_items = self.drugbank_data_db_delete = None
+
     def has_term(self, term):
         term = safe_unicode(term)
         try:
-            self.drugbank_db_get(db_key_encode(term))
+            self._get_ids(term)
             return True
         except KeyError:
             return
@@ -115,32 +487,132 @@ class DrugBankDB(object):
             logging.debug("Drug data: %s", list(drug.keys()))
             return
 
-        name = safe_unicode(drug['name'].lower())
-        synonyms = [safe_unicode(synonym.lower())
-                    for synonym in drug['synonyms'].split(',') if len(synonym) > 0]
-        products = [safe_unicode(product.lower())
-                    for product in drug['products'].split(',') if len(product) > 0]
+        terms = get_drug_terms(drug)
         drugbank_id = safe_unicode(drug.pop('drugbank_id'))
 
-        self.drugbank_db_put(name, pickle.dumps(drugbank_id))
-        if len(synonyms) > 0:
-            [self.drugbank_db_put(synonym, pickle.dumps(drugbank_id)) for synonym in synonyms if len(synonym) > 0]
-        if len(products) > 0:
-            [self.drugbank_db_put(product, pickle.dumps(drugbank_id)) for product in products if len(product) > 0]
+        # a term shared with drugs inserted before maps to all of them
+        for term in terms:
+            drugbank_ids = self.get_ids(term)
+            if drugbank_id not in drugbank_ids:
+                self.insert_term(term, drugbank_ids + [drugbank_id])
+
+        self.insert_data(drugbank_id, drug)
+
+    def insert_term(self, term, drugbank_ids):
+        """Maps a term to a drugbank id or to a list of drugbank ids, replacing its previous mapping."""
+        if isinstance(drugbank_ids, str):
+            drugbank_ids = [drugbank_ids]
+        self.drugbank_db_put(db_key_encode(normalize_term(term)), self._encode_ids(list(drugbank_ids)))
+
+    def insert_data(self, drugbank_id, drug, overwrite=False):
+        if not overwrite:
+            try:
+                self.drugbank_data_db_get(db_key_encode(drugbank_id))
+                return
+            except KeyError:
+                pass
+        self.drugbank_data_db_put(db_key_encode(drugbank_id), self._encode_record(drug))
+
+    def train_compression(self, drugs):
+        """Builds the compression dictionary of a compact database from sample drug records.
+
+        It must be called before any record is inserted; pickle databases are not compressed.
+        """
+        if self.record_format != "compact":
+            return
+        self.codec.zdict = train_zdict(value for drug in drugs for value in drug.values() if isinstance(value, str))
+        self.codec.save(self.path)
 
+    def delete_term(self, term):
         try:
-            self.drugbank_data_db_get(db_key_encode(drugbank_id))
+            self.drugbank_db_delete(db_key_encode(normalize_term(term)))
         except KeyError:
-            self.drugbank_data_db_put(db_key_encode(drugbank_id), pickle.dumps(drug))
+            pass
 
-    def get(self, term):
-        term = safe_unicode(term.lower())
+    def delete_data(self, drugbank_id):
         try:
-            drugbank_id = pickle.loads(self.drugbank_db_get(db_key_encode(term)))
+            self.drugbank_data_db_delete(db_key_encode(drugbank_id))
+        except KeyError:
+            pass
+
+    def get_id(self, term):
+        """Returns the first drugbank id of a term, or None."""
+        drugbank_ids = self.get_ids(term)
+        return drugbank_ids[0] if len(drugbank_ids) > 0 else None
+
+    def get_ids(self, term):
+        """Returns the list of drugbank ids of a term, empty if the term is not installed."""
+        term = normalize_term(term)
+        try:
+            return list(self._get_ids(term))
+        except KeyError:
+            return []
+
+    def get_data(self, drugbank_id):
+        try:
+            return self._get_data(drugbank_id)
         except KeyError:
             return None
 
-        return drugbank_id, pickle.loads(self.drugbank_data_db_get(db_key_encode(drugbank_id)))
+    def get_many(self, terms, normalized=False):
+        """Looks up many terms at once.
+
+        Each distinct term and each distinct drugbank id is read once, in sorted key order, so the
+        terms of a whole document cost one key-value read per distinct key. Terms that share a drug
+        share the same record. `normalized` terms, e.g. the candidates retrieved from the indexes, are
+        looked up as they are.
+
+        Returns:
+            Dict: list of the (drugbank_id, data) pairs of each term that was found, in the order the
+                drugs were installed.
+        """
+        drugbank_ids = self.get_ids_many(terms, normalized)
+        records = self.get_data_many({drugbank_id for ids in drugbank_ids.values() for drugbank_id in ids})
+
+        drugs = {}
+        for term, ids in drugbank_ids.items():
+            items = [(drugbank_id, records[drugbank_id]) for drugbank_id in ids if drugbank_id in records]
+            if len(items) > 0:
+                drugs[term] = items
+        return drugs
+
+    def get_data_many(self, drugbank_ids):
+        """Reads the record of each distinct drugbank id once, in sorted key order.
+
+        Returns:
+            Dict: record of each drugbank id that was found.
+        """
+        records = {}
+        for drugbank_id in sorted(set(drugbank_ids)):
+            try:
+                records[drugbank_id] = self._get_data(drugbank_id)
+            except KeyError:
+                continue
+        return records
+
+    def get_ids_many(self, terms, normalized=False):
+        """Same as `get_many`, without reading the drug records.
+
+        Returns:
+            Dict: tuple of the drugbank ids of each term that was found.
+        """
+        keys = {term: term if normalized else normalize_term(term) for term in terms}
+        drugbank_ids = {}
+        for key in sorted(set(keys.values())):
+            try:
+                drugbank_ids[key] = self._get_ids(key)
+            except KeyError:
+                continue
+        return {term: drugbank_ids[key] for term, key in keys.items() if key in drugbank_ids}
+
+    def get(self, term):
+        """Returns the (drugbank_id, data) pair of the first drug of a term, or None."""
+        items = self.get_all(term)
+        return items[0] if len(items) > 0 else None
+
+    def get_all(self, term):
+        """Returns the (drugbank_id, data) pairs of every drug of a term."""
+        return self.get_many([term]).get(term, [])
 
 
 class Intervals(object):
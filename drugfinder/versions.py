@@ -0,0 +1,111 @@
+import datetime
+import json
+import logging
+import os
+import shutil
+
+from drugfinder.utils import InstallLock, LOCK_FILENAME, mkdir
+
+# the manifest of a versioned installation names its versions and the current one
+MANIFEST_FILENAME = "manifest.json"
+VERSIONS_DIRNAME = "versions"
+
+
+def is_versioned(path):
+    return os.path.exists(os.path.join(path, MANIFEST_FILENAME))
+
+
+def read_manifest(path):
+    with open(os.path.join(path, MANIFEST_FILENAME)) as f:
+        return json.load(f)
+
+
+def version_path(path, version):
+    return os.path.join(path, VERSIONS_DIRNAME, version)
+
+
+def new_version_name():
+    return datetime.datetime.now(datetime.timezone.utc).strftime("%Y%m%dT%H%M%S%fZ")
+
+
+def current_version(path):
+    """Returns the name and the directory of the current version of a versioned installation."""
+    version = read_manifest(path)["current"]
+    return version, version_path(path, version)
+
+
+def resolve_installation(path):
+    """Returns the version and the directory of the files to open; unversioned installations have no version."""
+    if is_versioned(path):
+        return current_version(path)
+    return None, path
+
+
+def publish_version(path, version, keep=2):
+    """Makes `version` the current version of the installation in `path`, then removes old versions.
+
+    The manifest is replaced atomically, so readers see either the previous or the new version. Only the
+    `keep` most recent versions are kept; versions opened by running processes are skipped and
+    removed by a later install.
+    """
+    manifest = read_manifest(path) if is_versioned(path) else {"versions": []}
+    versions = [entry for entry in manifest["versions"] if entry["name"] != version]
+    versions.append({"name": version, "created": datetime.datetime.now(datetime.timezone.utc).isoformat()})
+    _write_manifest(path, {"current": version, "versions": versions})
+
+    old_versions = versions[:-keep] if keep > 0 else []
+    removed = [entry for entry in old_versions if remove_version(path, entry["name"])]
+    if len(removed) > 0:
+        _write_manifest(path, {"current": version, "versions": [e for e in versions if e not in removed]})
+
+
+def _write_manifest(path, manifest):
+    manifest_fp = os.path.join(path, MANIFEST_FILENAME)
+    with open(manifest_fp + ".tmp", "w") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(manifest_fp + ".tmp", manifest_fp)
+
+
+def remove_version(path, version):
+    """Removes a version that no process has open; returns whether it was removed."""
+    if version == current_version(path)[0]:
+        return False
+    directory = version_path(path, version)
+    if os.path.exists(directory):
+        try:
+            install_lock = InstallLock(directory, exclusive=True)
+        except IOError as err:
+            logging.info("Keeping version {}: {}".format(version, err))
+            return False
+        shutil.rmtree(directory)
+        install_lock.release()
+    return True
+
+
+def copy_version(path, version, new_version, modified=()):
+    """Copies a version of an installation, to be upgraded as a new version.
+
+    The stores named in `modified` are written in place by the upgrade and are copied. The other files are
+    only ever replaced, so they are hard-linked and both versions share them; they are copied when the
+    filesystem does not support hard links.
+    """
+    directory = version_path(path, version)
+    new_directory = version_path(path, new_version)
+    mkdir(new_directory)
+    for filename in os.listdir(directory):
+        if filename == LOCK_FILENAME:
+            continue
+        copy_function = shutil.copy2 if filename in modified else _link_or_copy
+        src, dst = os.path.join(directory, filename), os.path.join(new_directory, filename)
+        if os.path.isdir(src):
+            shutil.copytree(src, dst, ignore=shutil.ignore_patterns(LOCK_FILENAME), copy_function=copy_function)
+        else:
+            copy_function(src, dst)
+    return new_directory
+
+
+def _link_or_copy(src, dst):
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copy2(src, dst)
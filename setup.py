@@ -59,6 +59,8 @@ def setup_package():
         url="https://github.com/phdabel/DrugFinder",
         license=about["__license__"],
         install_requires=requirements,
+        # `DrugFinder(retrieval_engine="sparse")`
+        extras_require={"sparse": ["scipy>=1.6.0"]},
         dependency_links=dependency_links,
         classifiers=[
             "Programming Language :: Python :: 3",